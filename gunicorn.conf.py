@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+import os
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # drop the live gauges of the worker from the metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or \
+            os.environ.get('prometheus_multiproc_dir'):
+        multiprocess.mark_process_dead(worker.pid)
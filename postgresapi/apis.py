@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, request, jsonify
+import os
+import time
+import itertools
+from collections import OrderedDict
+
+from flask import (Flask, Response, g, request, jsonify, json,
+                   stream_with_context)
 from flask.ext.basicauth import BasicAuth
+import psycopg2
+from prometheus_client import CONTENT_TYPE_LATEST
 
-from .database import AppDatabase
-from .storage import InstanceStorage, InstanceNotFound
-from .models import canonicalize_db_name
+from .database import (AppDatabase, CommandError, ExportError,
+                       UnknownCompression, breakers, tracer)
+from .storage import (InstanceStorage, InstanceNotFound, BackupStorage,
+                      BackupNotFound, instance_cache)
+from .models import canonicalize_db_name, DatabaseInUse
+from .scheduler import ClusterFull
+from . import backups, capacity, health, metrics, stats
 
 import plans
 
@@ -16,8 +28,54 @@ app.config['BASIC_AUTH_FORCE'] = True
 AppDatabase(app)
 
 
+@app.before_request
+def start_health_monitor():
+    if app.config['HEALTH_MONITOR_THREAD']:
+        health.start_monitor()
+
+
+@app.before_request
+def start_stats_collector():
+    if app.config['STATS_COLLECTOR_THREAD']:
+        stats.start_collector()
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.time()
+    tracer.start()
+
+
+@app.teardown_request
+def stop_tracing(exc):
+    tracer.stop()
+
+
+def observe_request(status):
+    if getattr(g, 'request_observed', False):
+        return
+    g.request_observed = True
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUESTS.labels(method=request.method, route=route,
+                            status=status).inc()
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        metrics.REQUEST_DURATION.labels(method=request.method,
+                                        route=route).observe(
+                                            time.time() - start)
+
+
+@app.after_request
+def observe_response(response):
+    observe_request(response.status_code)
+    if app.config['TRACE_HEADER'] and 'X-Debug-Trace' in request.headers:
+        response.headers['X-Debug-Trace'] = json.dumps(tracer.traces())
+    return response
+
+
 @app.errorhandler(500)
 def internal_server_error(e):
+    observe_request(500)
     if e.args:
         return e.args[-1], 500
     else:
@@ -42,7 +100,8 @@ def create_instance():
 
     Possible HTTP status codes:
 
-    * 201: database is successfully created
+    * 201: database is successfully created, or is being provisioned in
+      the background for dedicated instances (see the status endpoint)
     * 400: bad request, check your query
     * 500: creation process is failed
 
@@ -63,6 +122,122 @@ def create_instance():
     return '', 201
 
 
+@app.route("/resources", methods=["GET"])
+def list_instances():
+    """List the instances, ordered by name
+
+    Query parameters:
+
+    * after: only list instances named after this one
+    * limit: list at most this number of instances
+    * plan, state, host: only list the matching instances
+
+    The response is streamed as `{"instances": [...], "next": name}`,
+    where `next` is the `after` parameter of the next page, or null if
+    the listing is over. Credentials are not listed.
+
+    Possible HTTP status codes:
+
+    * 200: instances are listed
+    * 400: bad request, check your query
+    * 500: listing is failed
+
+    """
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            return 'Parameter `limit` must be a positive integer', 400
+
+    plan = request.args.get('plan')
+    if plan is not None and plan not in ('shared', 'dedicated'):
+        return 'Parameter `plan` is invalid', 400
+
+    state = request.args.get('state')
+    if state is not None and state not in ('pending', 'running', 'error'):
+        return 'Parameter `state` is invalid', 400
+
+    instances = InstanceStorage().iter_instances(
+        after=request.args.get('after'),
+        limit=limit,
+        plan=plan,
+        state=state,
+        host=request.args.get('host'))
+    # Run the query before the response starts, so that its errors are
+    # not sent as a truncated listing
+    first = next(instances, None)
+    if first is not None:
+        instances = itertools.chain([first], instances)
+
+    def generate():
+        yield '{"instances": ['
+        count = 0
+        last = None
+        for instance in instances:
+            if count:
+                yield ', '
+            yield json.dumps(instance.to_dict())
+            count += 1
+            last = instance.name
+        if limit is None or count < limit:
+            last = None
+        yield '], "next": %s}' % json.dumps(last)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+
+@app.route("/resources/<name>/clone", methods=["POST"])
+def clone_instance(name):
+    """Create a new shared database as a copy of this one
+
+    The copy is made by the server with CREATE DATABASE ... TEMPLATE,
+    so the sessions on the source database are terminated first, or
+    waited for (see CLONE_TERMINATE_SESSIONS).
+
+    Possible HTTP status codes:
+
+    * 201: database is successfully cloned
+    * 400: bad request, check your query
+    * 404: database does not exist
+    * 409: database is still in use, or its cluster is full
+    * 412: database is not ready
+    * 500: cloning process is failed
+
+    """
+    name = canonicalize_db_name(name)
+
+    if 'name' not in request.form:
+        return 'Parameter `name` is missing', 400
+
+    clone_name = request.form['name']
+    if not clone_name:
+        return 'Parameter `name` is empty', 400
+
+    try:
+        storage = InstanceStorage()
+        instance = storage.instance_by_name(name)
+    except InstanceNotFound:
+        return 'Instance `%s` is not found' % name, 404
+
+    if instance.plan != 'shared':
+        return 'Only shared instances can be cloned', 400
+
+    if instance.state != 'running':
+        return 'Can\'t clone this instance because it\'s not running', 412
+
+    try:
+        plans.get_manager_by_instance(instance).clone_instance(
+            instance, canonicalize_db_name(clone_name))
+    except (DatabaseInUse, ClusterFull) as e:
+        return e.args[0], 409
+
+    return '', 201
+
+
 @app.route("/resources/<name>/bind-app", methods=["POST"])
 def bind_app(name):
     """Bind an app to the database
@@ -104,6 +279,55 @@ def bind_app(name):
         return 'Can\'t bind to this instance because it\'s not running', 412
 
     username, password = instance.create_user(hostname)
+    return jsonify(bind_config(instance, username, password)), 201
+
+
+@app.route("/resources/<name>/bind-apps", methods=["POST"])
+def bind_apps(name):
+    """Bind the apps of several hosts to the database at once
+
+    The hosts are given as repeated `app-host` form fields, or as a JSON
+    list. Their users are created in a single transaction, and a JSON
+    object maps each host to the environment variables of bind-app.
+
+    Possible HTTP status codes:
+
+    * 201: database users are successfully created
+    * 400: bad request, check your query
+    * 404: database does not exist
+    * 412: database is not ready
+    * 500: user creation process is failed, no user is created
+
+    """
+    name = canonicalize_db_name(name)
+
+    hostnames = request.get_json(silent=True)
+    if hostnames is None:
+        hostnames = request.form.getlist('app-host')
+    if not isinstance(hostnames, list) or not hostnames:
+        return 'Parameter `app-host` is missing', 400
+    if not all(isinstance(h, basestring) and h for h in hostnames):
+        return 'Parameter `app-host` is empty', 400
+
+    try:
+        storage = InstanceStorage()
+        instance = storage.instance_by_name(name)
+    except InstanceNotFound:
+        return 'Instance `%s` is not found' % name, 404
+
+    if instance.state != 'running':
+        return 'Can\'t bind to this instance because it\'s not running', 412
+
+    hostnames = list(OrderedDict.fromkeys(hostnames))
+    credentials = instance.create_users(hostnames)
+    configs = {}
+    for hostname, (username, password) in zip(hostnames, credentials):
+        configs[hostname] = bind_config(instance, username, password)
+    return jsonify(configs), 201
+
+
+def bind_config(instance, username, password):
+    """Environment variables given to an app bound to the instance"""
     config = {
         'PG_HOST': instance.get_public_host(),
         'PG_PORT': str(instance.get_port()),
@@ -116,7 +340,7 @@ def bind_app(name):
         config['PG_ADMIN_USER'] = instance.username
         config['PG_ADMIN_PASSWORD'] = instance.password
 
-    return jsonify(config), 201
+    return config
 
 
 @app.route("/resources/<name>/bind", methods=["POST"])
@@ -206,12 +430,57 @@ def destroy_instance(name):
     return '', 200
 
 
+@app.route("/resources/status", methods=["POST"])
+def batch_status():
+    """Check the status of several instances at once
+
+    The names are given as a JSON list, or as a JSON object with a
+    `names` list, or as repeated `name` form fields. Instances are probed
+    concurrently, and a JSON object maps each name to its `state` and to
+    the `latency` of its probe in seconds:
+
+    * pending, error: state of the instance, which is not probed
+    * running: the instance accepts connections
+    * down: the instance is running but does not accept connections
+    * unknown: the probe did not finish in time
+    * not found: the instance does not exist
+
+    Possible HTTP status codes:
+
+    * 200: instances are checked
+    * 400: bad request, check your query
+
+    """
+    names = request.get_json(silent=True)
+    if isinstance(names, dict):
+        names = names.get('names')
+    if names is None:
+        names = request.form.getlist('name')
+    if not isinstance(names, list) or not names:
+        return 'Parameter `names` is missing', 400
+    if not all(isinstance(name, basestring) and name for name in names):
+        return 'Parameter `names` must only hold names', 400
+
+    canonical = dict((name, canonicalize_db_name(name)) for name in names)
+    instances = InstanceStorage().instances_by_names(canonical.values())
+    probes = health.probe_all(instances)
+    results = {}
+    for name in names:
+        results[name] = probes.get(canonical[name],
+                                   {'state': 'not found', 'latency': None})
+    return jsonify(results), 200
+
+
 @app.route("/resources/<name>/status", methods=["GET"])
 def status(name):
     """Check instance status
 
     $ tsuru service-status postgres_instance
 
+    A running instance is reported from the health recorded by the
+    monitor. It is probed when the record is missing or outdated, or
+    when the `live` query parameter is set.
+
     Possible HTTP status codes:
 
     * 202: database is pending
@@ -223,6 +492,15 @@ def status(name):
 
     try:
         storage = InstanceStorage()
+        if not request.args.get('live'):
+            record = storage.health_by_name(name,
+                                            app.config['HEALTH_MAX_AGE'])
+            if record['state'] == 'pending':
+                return record['state'], 202
+            elif record['state'] != 'running' or record['health'] == 'down':
+                return '', 500
+            elif record['health'] == 'running':
+                return '', 204
         instance = storage.instance_by_name(name)
     except InstanceNotFound:
         return 'Instance `%s` is not found' % name, 404
@@ -233,3 +511,283 @@ def status(name):
         return '', 204
 
     return '', 500
+
+
+EXPORT_EXTENSIONS = {'plain': '.sql', 'custom': '.dump',
+                     'gzip': '.gz', 'zstd': '.zst'}
+
+
+@app.route("/resources/<name>/export", methods=["GET"])
+def export_instance(name):
+    """Download a dump of the database
+
+    Query parameters:
+
+    * format: plain (SQL script, default) or custom (for pg_restore)
+    * compress: gzip or zstd, the dump is not compressed when missing
+
+    The dump is streamed as pg_dump writes it, and pg_dump is killed if
+    the client goes away before the end.
+
+    Possible HTTP status codes:
+
+    * 200: dump is streamed
+    * 400: bad request, check your query
+    * 404: database does not exist
+    * 412: database is not ready
+    * 500: dump is failed
+
+    """
+    name = canonicalize_db_name(name)
+
+    format = request.args.get('format', 'plain')
+    if format not in ('plain', 'custom'):
+        return 'Parameter `format` is invalid', 400
+    compress = request.args.get('compress') or None
+
+    try:
+        instance = InstanceStorage().instance_by_name(name)
+    except InstanceNotFound:
+        return 'Instance `%s` is not found' % name, 404
+
+    if instance.state != 'running':
+        return 'Can\'t export this instance because it\'s not running', 412
+
+    pg_dump = os.path.join(app.config['PG_BIN_DIR'], 'pg_dump')
+    try:
+        chunks = instance.export(format=format, compress=compress,
+                                 pg_dump=pg_dump)
+        # pg_dump failing to connect is reported before any byte is sent
+        first = next(chunks, '')
+    except UnknownCompression as e:
+        return e.args[0], 400
+    except ExportError as e:
+        return e.args[0], 500
+
+    def generate():
+        try:
+            yield first
+            for chunk in chunks:
+                yield chunk
+        finally:
+            chunks.close()
+
+    filename = name + EXPORT_EXTENSIONS[format]
+    if compress is not None:
+        filename += EXPORT_EXTENSIONS[compress]
+    response = Response(generate(), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="%s"' % filename
+    return response
+
+
+@app.route("/resources/<name>/import", methods=["POST"])
+def import_instance(name):
+    """Load data streamed in the request body into the database
+
+    Query parameters:
+
+    * format: csv (default) or custom, a pg_dump custom-format archive
+    * table: table CSV rows are copied to, may be qualified by a schema
+    * columns: comma separated columns of the CSV rows, all by default
+    * header: whether the first CSV line is a header to skip
+
+    The body is read in chunks as it is sent to COPY or pg_restore, and
+    loaded in a single transaction.
+
+    Possible HTTP status codes:
+
+    * 200: CSV rows are loaded, their number is returned
+    * 204: dump is restored
+    * 400: bad request, check your query or data
+    * 404: database does not exist
+    * 412: database is not ready
+    * 500: import is failed
+
+    """
+    name = canonicalize_db_name(name)
+
+    format = request.args.get('format', 'csv')
+    if format not in ('csv', 'custom'):
+        return 'Parameter `format` is invalid', 400
+
+    table = request.args.get('table')
+    if format == 'csv' and not table:
+        return 'Parameter `table` is missing', 400
+
+    try:
+        instance = InstanceStorage().instance_by_name(name)
+    except InstanceNotFound:
+        return 'Instance `%s` is not found' % name, 404
+
+    if instance.state != 'running':
+        return 'Can\'t import into this instance because it\'s not ' \
+            'running', 412
+
+    if format == 'custom':
+        try:
+            instance.import_dump(
+                request.stream,
+                pg_restore=os.path.join(app.config['PG_BIN_DIR'],
+                                        'pg_restore'))
+        except CommandError as e:
+            return e.args[0], 500
+        return '', 204
+
+    columns = request.args.get('columns')
+    if columns:
+        columns = [column.strip() for column in columns.split(',')]
+    try:
+        rows = instance.import_csv(
+            table, request.stream, columns=columns,
+            header=request.args.get('header') in ('1', 'true', 'yes'))
+    except (psycopg2.DataError, psycopg2.IntegrityError,
+            psycopg2.ProgrammingError) as e:
+        return e.pgerror or str(e), 400
+    return jsonify(rows=rows), 200
+
+
+@app.route("/resources/<name>/backups", methods=["POST"])
+def create_backup(name):
+    """Back up the database to the backup directory
+
+    The backup runs in the background, its progress is shown by the
+    listing of the backups.
+
+    Possible HTTP status codes:
+
+    * 202: backup is started
+    * 404: database does not exist
+    * 409: a backup or a restore of the database is running
+    * 412: database is not ready
+
+    """
+    name = canonicalize_db_name(name)
+
+    try:
+        instance = InstanceStorage().instance_by_name(name)
+    except InstanceNotFound:
+        return 'Instance `%s` is not found' % name, 404
+
+    if instance.state != 'running':
+        return 'Can\'t back up this instance because it\'s not running', 412
+
+    try:
+        backup = backups.create_backup(instance, wait=False)
+    except backups.BackupInProgress as e:
+        return e.args[0], 409
+    return jsonify(backup.to_dict()), 202
+
+
+@app.route("/resources/<name>/backups", methods=["GET"])
+def list_backups(name):
+    """List the backups of the database, latest first
+
+    Possible HTTP status codes:
+
+    * 200: backups are listed
+
+    """
+    name = canonicalize_db_name(name)
+    return jsonify(backups=[backup.to_dict() for backup in
+                            BackupStorage().find_by_instance(name)]), 200
+
+
+@app.route("/resources/<name>/backups/<int:backup_id>/restore",
+           methods=["POST"])
+def restore_backup(name, backup_id):
+    """Restore a backup over the database
+
+    Objects of the backup replace the existing ones. The restore runs in
+    the background, its progress is shown by the listing of the backups.
+    A failed restore may leave some of the objects dropped.
+
+    Possible HTTP status codes:
+
+    * 202: restore is started
+    * 404: database or backup does not exist
+    * 409: backup is not done, or a backup or a restore of the database
+      is running
+    * 412: database is not ready
+
+    """
+    name = canonicalize_db_name(name)
+
+    try:
+        instance = InstanceStorage().instance_by_name(name)
+        backup = BackupStorage().backup_by_id(name, backup_id)
+    except (InstanceNotFound, BackupNotFound) as e:
+        return e.args[0], 404
+
+    if instance.state != 'running':
+        return 'Can\'t restore this instance because it\'s not running', 412
+
+    try:
+        backups.restore_backup(instance, backup, wait=False)
+    except (backups.BackupNotDone, backups.BackupInProgress) as e:
+        return e.args[0], 409
+    return '', 202
+
+
+@app.route("/resources/<name>/stats", methods=["GET"])
+def instance_stats(name):
+    """Show the usage statistics of the database
+
+    Size is in bytes, connections are the current sessions, the other
+    counters come from pg_stat_database since its last reset. Statistics
+    are cached, `collected_at` is when they were queried.
+
+    Possible HTTP status codes:
+
+    * 200: statistics are returned
+    * 404: database does not exist
+    * 412: database is not ready
+
+    """
+    name = canonicalize_db_name(name)
+
+    try:
+        instance = InstanceStorage().instance_by_name(name)
+    except InstanceNotFound:
+        return 'Instance `%s` is not found' % name, 404
+
+    if instance.state != 'running':
+        return 'Can\'t get statistics of this instance because it\'s not ' \
+            'running', 412
+
+    result = stats.instance_stats(instance)
+    if result is None:
+        return 'Database `%s` is not found' % name, 404
+    return jsonify(result), 200
+
+
+@app.route("/admin/cache", methods=["GET"])
+def cache_stats():
+    """Show the hit and miss counters of the instance cache
+
+    """
+    return jsonify(instance_cache().stats()), 200
+
+
+@app.route("/admin/breakers", methods=["GET"])
+def breaker_states():
+    """Show the circuit breaker of each server connected to
+
+    """
+    return jsonify(breakers()), 200
+
+
+@app.route("/admin/capacity", methods=["GET"])
+def capacity_report():
+    """Show how full the shared clusters and the docker hosts are
+
+    """
+    return jsonify(capacity.report()), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def show_metrics():
+    """Expose the metrics in the Prometheus text format
+
+    """
+    return Response(metrics.render(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import hashlib
+import logging
+
+from flask import current_app as app
+
+from . import workers
+from .storage import BackupStorage, advisory_lock, BACKUP_LOCK
+
+logger = logging.getLogger(__name__)
+
+
+class BackupNotDone(Exception):
+    def __init__(self, id, status):
+        self.args = ["Backup %s is %s, only done backups can be "
+                     "restored." % (id, status)]
+
+
+class BackupCorrupted(Exception):
+    def __init__(self, id):
+        self.args = ["Backup %s does not match its checksum." % id]
+
+
+class BackupInProgress(Exception):
+    def __init__(self, name):
+        self.args = ["A backup or a restore of %s is already running." %
+                     name]
+
+
+def backup_path(backup):
+    return os.path.join(app.config['BACKUP_DIR'], backup.instance,
+                        str(backup.id))
+
+
+def directory_digest(path, block_size=1 << 20):
+    """Get the total size and the SHA-256 of the files of a directory
+
+    Files are read in name order, and their names are part of the
+    checksum.
+
+    """
+    size = 0
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        digest.update(name + '\0')
+        with open(os.path.join(path, name), 'rb') as fp:
+            while True:
+                block = fp.read(block_size)
+                if not block:
+                    break
+                size += len(block)
+                digest.update(block)
+    return size, digest.hexdigest()
+
+
+def _pool():
+    return workers.get_pool('backup', app.config['BACKUP_WORKERS'])
+
+
+def _bin(program):
+    return os.path.join(app.config['PG_BIN_DIR'], program)
+
+
+def _instance_lock(instance):
+    return advisory_lock(BACKUP_LOCK, instance.name)
+
+
+def _check_idle(instance):
+    with _instance_lock(instance) as locked:
+        if not locked:
+            raise BackupInProgress(name=instance.name)
+
+
+def create_backup(instance, wait=True):
+    """Back up the instance with `pg_dump -Fd -j BACKUP_JOBS`
+
+    Without `wait`, the backup runs on the `backup` worker pool and
+    the pending backup is returned at once. BackupInProgress is raised
+    while another backup or restore of the instance runs.
+
+    """
+    _check_idle(instance)
+    backup = BackupStorage().create(instance.name)
+    if wait:
+        run_backup(instance, backup)
+    else:
+        _pool().submit(run_backup, instance, backup)
+    return backup
+
+
+def run_backup(instance, backup):
+    storage = BackupStorage()
+    with _instance_lock(instance) as locked:
+        if not locked:
+            e = BackupInProgress(name=instance.name)
+            storage.fail(backup.id, str(e))
+            raise e
+        storage.start(backup.id)
+        path = backup_path(backup)
+        start = time.time()
+        try:
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            instance.backup(path, jobs=app.config['BACKUP_JOBS'],
+                            pg_dump=_bin('pg_dump'))
+            size, checksum = directory_digest(path)
+        except Exception as e:
+            shutil.rmtree(path, ignore_errors=True)
+            storage.fail(backup.id, str(e))
+            raise
+        storage.finish(backup.id, size, time.time() - start, checksum)
+
+
+def restore_backup(instance, backup, wait=True):
+    """Restore a done backup with `pg_restore -j BACKUP_JOBS`
+
+    The files are checked against the checksum first. Without `wait`,
+    the restore runs on the `backup` worker pool. BackupInProgress is
+    raised while another backup or restore of the instance runs.
+
+    The objects of the backup are dropped and restored by parallel jobs,
+    not in one transaction: a failed restore leaves the database with
+    some of them dropped, until a restore succeeds.
+
+    """
+    if backup.status != 'done':
+        raise BackupNotDone(id=backup.id, status=backup.status)
+    _check_idle(instance)
+    BackupStorage().set_restore_status(backup.id, 'pending')
+    if wait:
+        run_restore(instance, backup)
+    else:
+        _pool().submit(run_restore, instance, backup)
+
+
+def run_restore(instance, backup):
+    storage = BackupStorage()
+    with _instance_lock(instance) as locked:
+        if not locked:
+            e = BackupInProgress(name=instance.name)
+            storage.set_restore_status(backup.id, 'failed', error=str(e))
+            raise e
+        storage.set_restore_status(backup.id, 'running')
+        path = backup_path(backup)
+        try:
+            if directory_digest(path)[1] != backup.checksum:
+                raise BackupCorrupted(id=backup.id)
+            instance.restore(path, jobs=app.config['BACKUP_JOBS'],
+                             pg_restore=_bin('pg_restore'))
+        except Exception as e:
+            storage.set_restore_status(backup.id, 'failed', error=str(e))
+            raise
+        storage.set_restore_status(backup.id, 'done')
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A bounded, thread-safe LRU cache with expiring entries
+
+    Each entry expires `ttl` seconds after it was set. Once `maxsize`
+    entries are stored, the least recently used one is evicted.
+
+    A value looked up before the key is invalidated must not be cached
+    afterwards: take the `generation` of the key before the lookup and
+    pass it to `set`, which drops the value if the key was invalidated
+    (or the cache cleared) in the meantime.
+
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._epoch = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return default
+            # re-insert as the most recently used
+            self._data[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, key):
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key, value, ttl, generation=None):
+        with self._lock:
+            if generation is not None and \
+                    generation != (self._epoch,
+                                   self._generations.get(key, 0)):
+                return
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if len(self._generations) > self.maxsize:
+                # keep it bounded, a new epoch outdates every generation
+                self._generations.clear()
+                self._epoch += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
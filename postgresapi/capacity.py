@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from .models import shared_clusters
+from .scheduler import DockerScheduler
+from .storage import InstanceStorage
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+
+def _ratio(used, total):
+    if not total:
+        return None
+    return float(used) / total
+
+
+def shared_report(clusters=None):
+    """Describe how full each shared cluster is
+
+    Instances are counted by one query on postgresapi's database, sizes
+    and sessions come from the cached statistics of each cluster.
+
+    """
+    if clusters is None:
+        clusters = shared_clusters()
+    counts = InstanceStorage().count_by_cluster(clusters[0].name)
+
+    report = []
+    for cluster in clusters:
+        instances = counts.get(cluster.name, 0)
+        entry = {
+            'name': cluster.name,
+            'host': cluster.host,
+            'port': cluster.port,
+            'weight': cluster.weight,
+            'instances': instances,
+            'capacity': cluster.capacity,
+            'instance_usage': _ratio(instances, cluster.capacity),
+            'reachable': True,
+            'databases': None,
+            'size': None,
+            'connections': None,
+            'max_connections': None,
+            'connection_usage': None,
+            'collected_at': None,
+        }
+        try:
+            cluster_stats = stats.cluster_stats(cluster.cluster_manager)
+        except Exception:
+            logger.exception('Getting the statistics of %s failed',
+                             cluster.name)
+            entry['reachable'] = False
+        else:
+            databases = cluster_stats['databases'].values()
+            connections = sum(db['connections'] for db in databases)
+            entry.update(
+                databases=len(databases),
+                size=sum(db['size'] for db in databases),
+                connections=connections,
+                max_connections=cluster_stats['max_connections'],
+                connection_usage=_ratio(connections,
+                                        cluster_stats['max_connections']),
+                collected_at=cluster_stats['collected_at'])
+        report.append(entry)
+    return report
+
+
+def dedicated_report(scheduler=None):
+    """Describe how dedicated instances are spread on the docker hosts
+
+    Counts come from the aggregate queries of the scheduler, memory and
+    CPUs from the cached `docker info` of each host.
+
+    """
+    if scheduler is None:
+        scheduler = DockerScheduler()
+
+    report = []
+    for load in scheduler.loads():
+        info = load.info or {}
+        report.append({
+            'host': load.hostname,
+            'url': load.url,
+            'reachable': load.reachable,
+            'instances': load.instances,
+            'warm': load.warm,
+            'used_ports': load.used_ports,
+            'total_ports': load.total_ports,
+            'port_usage': _ratio(load.used_ports, load.total_ports),
+            'allocated_memory': load.allocated_memory,
+            'memory_total': info.get('MemTotal'),
+            'memory_usage': load.memory_usage,
+            'cpus': info.get('NCPU'),
+        })
+    return report
+
+
+def report():
+    return {'shared': shared_report(), 'dedicated': dedicated_report()}
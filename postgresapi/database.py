@@ -1,67 +1,802 @@
 # -*- coding: utf-8 -*-
 import os
+import re
+import time
+import select
+import logging
+import threading
+import tempfile
 import subprocess
+import zlib
+from collections import deque
 from contextlib import contextmanager
 
 import psycopg2
 from psycopg2.extensions import (ISOLATION_LEVEL_AUTOCOMMIT,
-                                 ISOLATION_LEVEL_READ_COMMITTED)
+                                 ISOLATION_LEVEL_READ_COMMITTED,
+                                 TRANSACTION_STATUS_IDLE)
+
+from . import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger(__name__ + '.slow')
 
 _interrupt = (KeyboardInterrupt, SystemExit)
 
 
+class PoolTimeout(Exception):
+    def __init__(self, timeout):
+        self.args = ["No database connection available after %s seconds" %
+                     timeout]
+
+
+_literal = re.compile(r"'(?:[^']|'')*'")
+
+
+def redact(sql, limit=500):
+    """Replace the string literals of a statement, and shorten it"""
+    sql = _literal.sub('?', sql)
+    if len(sql) > limit:
+        sql = sql[:limit] + '...'
+    return sql
+
+
+class Tracer(object):
+    """Record the duration of the statements run by each thread
+
+    Statements taking `slow_threshold` seconds or more are logged to the
+    `postgresapi.database.slow` logger, 0 disables it. Between `start`
+    and `stop`, the last `keep` statements of the thread are kept and
+    returned by `traces`. Statements are recorded without their
+    parameters, and their string literals are redacted.
+
+    """
+
+    def __init__(self, slow_threshold=1.0, keep=20):
+        self.slow_threshold = slow_threshold
+        self.keep = keep
+        self._local = threading.local()
+
+    def start(self):
+        self._local.traces = deque(maxlen=self.keep)
+
+    def stop(self):
+        self._local.traces = None
+
+    def traces(self):
+        return list(getattr(self._local, 'traces', None) or ())
+
+    def record(self, sql, host, database, duration):
+        traces = getattr(self._local, 'traces', None)
+        slow = self.slow_threshold and duration >= self.slow_threshold
+        if traces is None and not slow:
+            return
+        sql = redact(sql)
+        if traces is not None:
+            traces.append({'sql': sql,
+                           'host': host,
+                           'database': database,
+                           'duration': round(duration, 6)})
+        if slow:
+            slow_logger.warning('%.3fs on %s/%s: %s', duration, host,
+                                database, sql)
+
+
+tracer = Tracer()
+
+
+class TracingCursor(psycopg2.extensions.cursor):
+    """A cursor timing its statements with the tracer
+
+    `busy` adds up the seconds spent waiting on the server, the fetches
+    of a server-side cursor included.
+
+    """
+
+    target = (None, None)
+    busy = 0
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        try:
+            return super(TracingCursor, self).execute(query, vars)
+        finally:
+            elapsed = time.time() - start
+            self.busy += elapsed
+            host, database = self.target
+            tracer.record(query, host, database, elapsed)
+
+    def fetchmany(self, size=None):
+        start = time.time()
+        try:
+            return super(TracingCursor, self).fetchmany(
+                self.arraysize if size is None else size)
+        finally:
+            self.busy += time.time() - start
+
+    def __iter__(self):
+        if self.name is None:
+            return super(TracingCursor, self).__iter__()
+        return self._iter_named()
+
+    def _iter_named(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+
+class CommandError(Exception):
+    def __init__(self, command, database, stderr):
+        self.args = ["%s of %s failed: %s" % (command, database,
+                                               stderr.strip())]
+
+
+class ExportError(CommandError):
+    def __init__(self, database, stderr):
+        super(ExportError, self).__init__('Export', database, stderr)
+
+
+class UnknownCompression(Exception):
+    def __init__(self, name):
+        self.args = ["Compression %s is not supported" % name]
+
+
+def get_compressor(name):
+    """Get a compressor object of the gzip or zstd format
+
+    zstd requires the zstandard package.
+
+    """
+    if name is None:
+        return None
+    if name == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if name == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor().compressobj()
+    raise UnknownCompression(name=name)
+
+
+class CircuitOpen(psycopg2.OperationalError):
+    def __init__(self, host, port):
+        self.args = ["Connections to %s:%s are failing, not retried yet" %
+                     (host, port)]
+
+
+# Messages of connection errors raised by a server which answered
+AUTH_ERRORS = ('authentication failed', 'no password supplied',
+               'no pg_hba.conf entry', 'does not exist')
+
+
+def is_auth_error(e):
+    """Tell whether a connection was refused by a reachable server"""
+    message = str(e)
+    return any(error in message for error in AUTH_ERRORS)
+
+
+class CircuitBreaker(object):
+    """Fail fast while connections to a server keep failing
+
+    After `threshold` failures in a row the circuit opens: connections
+    are refused at once for `reset_timeout` seconds. Then it is half
+    open and a single connection is let through; the circuit closes if
+    it succeeds and opens again otherwise.
+
+    """
+
+    def __init__(self, host, port, threshold=5, reset_timeout=30):
+        self.host = host
+        self.port = port
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self._trial or \
+                time.time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before(self):
+        """Raise CircuitOpen unless a connection may be attempted"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if not self._trial and \
+                    time.time() - self.opened_at >= self.reset_timeout:
+                self._trial = True
+                return
+            raise CircuitOpen(host=self.host, port=self.port)
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.time()
+                self._trial = False
+
+    def to_dict(self):
+        return {'state': self.state,
+                'failures': self.failures,
+                'opened_at': self.opened_at}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host, port, threshold=5, reset_timeout=30):
+    """Get the process-wide circuit breaker of a server"""
+    key = (host, port)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(
+                host, port, threshold=threshold,
+                reset_timeout=reset_timeout)
+        breaker.threshold = threshold
+        breaker.reset_timeout = reset_timeout
+        return breaker
+
+
+def breakers():
+    """Map "host:port" to the state of its circuit breaker"""
+    with _breakers_lock:
+        items = list(_breakers.items())
+    return dict(('%s:%s' % key, breaker.to_dict())
+                for key, breaker in items)
+
+
+class ConnectionLimit(object):
+    """A bound on the connections several pools open to one server
+
+    At most `maxconn` connections are open at once. When they all are,
+    the longest idle connection of the pools is closed to make room, or
+    if none is idle, the caller waits up to `timeout` seconds.
+
+    """
+
+    def __init__(self, maxconn, timeout=30):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.size = 0
+        self._pools = []
+        self._cond = threading.Condition()
+
+    def register(self, pool):
+        with self._cond:
+            self._pools.append(pool)
+
+    def unregister(self, pool):
+        with self._cond:
+            if pool in self._pools:
+                self._pools.remove(pool)
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        while True:
+            with self._cond:
+                if self.size < self.maxconn:
+                    self.size += 1
+                    return
+                pools = list(self._pools)
+            # make room, the connection closed releases its slot
+            idle = [(pool.idle_since(), pool) for pool in pools]
+            idle = [item for item in idle if item[0] is not None]
+            if idle and min(idle, key=lambda item: item[0])[1].close_idle():
+                continue
+            with self._cond:
+                if self.size < self.maxconn:
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout(timeout=self.timeout)
+                self._cond.wait(remaining)
+
+    def release(self):
+        with self._cond:
+            self.size -= 1
+            self._cond.notify()
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def get_connection_limit(host, port, maxconn=10, timeout=30):
+    """Get the process-wide connection limit of a server"""
+    key = (host, port)
+    with _limits_lock:
+        limit = _limits.get(key)
+        if limit is None:
+            limit = _limits[key] = ConnectionLimit(maxconn, timeout=timeout)
+        limit.maxconn = maxconn
+        limit.timeout = timeout
+        return limit
+
+
+class ConnectionPool(object):
+    """A bounded, thread-safe pool of psycopg2 connections
+
+    At most `maxconn` connections are opened, and `minconn` of them are
+    opened in advance. A checkout waits up to `timeout` seconds for a
+    connection to be returned. Connections idle for more than
+    `check_interval` seconds are pinged before being handed out, and
+    connections older than `max_lifetime` seconds are closed. When
+    `idle_timeout` is set, `evict_idle` closes connections left unused
+    for that long, down to `minconn`.
+
+    With a circuit breaker, checkouts raise CircuitOpen while it is
+    open, idle connections are always pinged while it is half open, and
+    pings report to it. With a ConnectionLimit, connections are only
+    opened within the limit shared with other pools.
+
+    """
+
+    def __init__(self, connect, minconn=0, maxconn=10, timeout=30,
+                 max_lifetime=3600, check_interval=10, idle_timeout=None,
+                 name='default', breaker=None, limit=None):
+        self._connect = connect
+        self.name = name
+        self.breaker = breaker
+        self.limit = limit
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.idle_timeout = idle_timeout
+        self.size = 0
+        self.closed = False
+        self._idle = []
+        self._born = {}
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._open_gauge = metrics.POOL_CONNECTIONS.labels(pool=name,
+                                                           state='open')
+        self._in_use_gauge = metrics.POOL_CONNECTIONS.labels(pool=name,
+                                                             state='in_use')
+        if limit is not None:
+            limit.register(self)
+        self.fill()
+
+    def fill(self):
+        """Open connections until the pool holds `minconn` of them"""
+        while True:
+            with self._cond:
+                if self.size >= self.minconn:
+                    return
+                self._resize(1)
+            conn = self._open()
+            self._checkin(conn)
+
+    def _open(self):
+        try:
+            if self.limit is not None:
+                self.limit.acquire()
+            try:
+                conn = self._connect()
+            except:
+                if self.limit is not None:
+                    self.limit.release()
+                raise
+        except:
+            with self._cond:
+                self._resize(-1)
+                self._cond.notify()
+            raise
+        self._born[conn] = time.time()
+        return conn
+
+    def _reserve(self):
+        """Take an idle connection, or a slot to open a new one"""
+        deadline = time.time() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self.size < self.maxconn:
+                    self._resize(1)
+                    return None, None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    metrics.POOL_TIMEOUTS.labels(pool=self.name).inc()
+                    raise PoolTimeout(timeout=self.timeout)
+                self._cond.wait(remaining)
+
+    def _expired(self, conn):
+        born = self._born.get(conn, 0)
+        return time.time() - born >= self.max_lifetime
+
+    def _healthy(self, conn, last_used):
+        if conn.closed or self._expired(conn):
+            return False
+        if time.time() - last_used < self.check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+            conn.rollback()
+        except _interrupt:
+            raise
+        except Exception:
+            if self.breaker is not None and conn.closed:
+                self.breaker.failure()
+            return False
+        if self.breaker is not None:
+            self.breaker.success()
+        return True
+
+    def _discard(self, conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(conn, None)
+            self._resize(-1)
+            self._cond.notify()
+        if self.limit is not None:
+            self.limit.release()
+
+    def _resize(self, delta):
+        # called with the condition's lock held
+        self.size += delta
+        self._open_gauge.inc(delta)
+
+    def getconn(self):
+        suspect = False
+        if self.breaker is not None:
+            state = self.breaker.state
+            if state == 'open':
+                raise CircuitOpen(host=self.breaker.host,
+                                  port=self.breaker.port)
+            suspect = state != 'closed'
+        with metrics.timed(metrics.POOL_WAIT, pool=self.name):
+            while True:
+                conn, last_used = self._reserve()
+                if conn is None:
+                    conn = self._open()
+                    break
+                if self._healthy(conn, 0 if suspect else last_used):
+                    break
+                self._discard(conn)
+        self._in_use_gauge.inc()
+        return conn
+
+    def putconn(self, conn):
+        self._in_use_gauge.dec()
+        self._checkin(conn)
+
+    def _checkin(self, conn):
+        if self.closed:
+            return self._discard(conn)
+        if conn.closed:
+            # The server may have dropped the other connections as well,
+            # have them pinged before they are handed out again
+            with self._cond:
+                self._idle = [(idle, 0) for idle, _ in self._idle]
+            return self._discard(conn)
+        if self._expired(conn):
+            return self._discard(conn)
+        if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                return self._discard(conn)
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the block
+
+        A thread that already holds a connection of this pool gets the
+        same one back, so nested transactions keep sharing a connection
+        as they did before pooling.
+
+        """
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+        conn = self.getconn()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self.putconn(conn)
+
+    def evict_idle(self):
+        """Close connections idle for more than `idle_timeout` seconds"""
+        if self.idle_timeout is None:
+            return
+        now = time.time()
+        stale = []
+        with self._cond:
+            # the oldest idle connections are at the front
+            for item in self._idle:
+                if self.size - len(stale) <= self.minconn or \
+                        now - item[1] < self.idle_timeout:
+                    break
+                stale.append(item)
+            del self._idle[:len(stale)]
+        for conn, _ in stale:
+            self._discard(conn)
+
+    def idle_since(self):
+        """Tell since when the longest idle connection is, if any"""
+        with self._cond:
+            if self._idle:
+                return self._idle[0][1]
+        return None
+
+    def close_idle(self):
+        """Close the longest idle connection, tell whether there was one"""
+        with self._cond:
+            if not self._idle:
+                return False
+            conn, _ = self._idle.pop(0)
+        self._discard(conn)
+        return True
+
+    def closeall(self):
+        """Close the idle connections, and the others once returned"""
+        with self._cond:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+        if self.limit is not None:
+            self.limit.unregister(self)
+
+
+class Listener(object):
+    """Call `callback` with the payload of each notification of a channel
+
+    Notifications are received by a daemon thread on a dedicated
+    connection, which is opened again whenever it is lost. Notifications
+    sent while the thread is disconnected are lost, so `on_connect` is
+    called once listening starts again, and `connected` tells whether the
+    thread is listening at the moment.
+
+    """
+
+    def __init__(self, connect, channel, callback, on_connect=None,
+                 poll_interval=5, retry_interval=1):
+        self._connect = connect
+        self.channel = channel
+        self.callback = callback
+        self.on_connect = on_connect
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.connected = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='listen-%s' % self.channel)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                self._listen(conn)
+            except Exception:
+                logger.exception('Listening on %s failed', self.channel)
+            finally:
+                self.connected = False
+                if conn is not None and not conn.closed:
+                    conn.close()
+            self._stopped.wait(self.retry_interval)
+
+    def _listen(self, conn):
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = conn.cursor()
+        cursor.execute('LISTEN "%s"' % self.channel)
+        if self.on_connect is not None:
+            self.on_connect()
+        self.connected = True
+
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([conn], [], [],
+                                           self.poll_interval)
+            if readable:
+                conn.poll()
+            else:
+                # make sure the connection is still alive, notifications
+                # read along with its result are in conn.notifies too
+                cursor.execute('SELECT 1')
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self.callback(notify.payload)
+
+
 class Database(object):
 
-    def __init__(self, database, user, password, host, port):
+    def __init__(self, database, user, password, host, port, pool=None,
+                 connect_timeout=None, statement_timeout=None,
+                 breaker=None, keepalives=None):
         self.user = user
         self.host = host
         self.port = port
         self.password = password
         self.database = database
         self.conn = None
+        self.pool = pool
+        self.connect_timeout = connect_timeout
+        self.statement_timeout = statement_timeout
+        self.breaker = breaker
+        self.keepalives = keepalives
+
+    def connect(self):
+        """Open a new connection to the database
+
+        With a circuit breaker, CircuitOpen is raised at once while the
+        server is deemed unreachable. A server refusing the credentials
+        is not deemed unreachable.
+
+        `keepalives` holds the keepalives_idle, keepalives_interval,
+        keepalives_count and tcp_user_timeout options of libpq, those set
+        to 0 are left out. tcp_user_timeout needs libpq 12 or later.
+
+        """
+        options = {}
+        for key, value in (self.keepalives or {}).items():
+            if not value or key == 'tcp_user_timeout' and \
+                    psycopg2.extensions.libpq_version() < 120000:
+                continue
+            options[key] = value
+        if self.connect_timeout:
+            options['connect_timeout'] = self.connect_timeout
+        if self.statement_timeout:
+            options['options'] = '-c statement_timeout=%d' % \
+                self.statement_timeout
+        if self.breaker is not None:
+            self.breaker.before()
+        try:
+            conn = psycopg2.connect(database=self.database,
+                                    user=self.user,
+                                    password=self.password,
+                                    host=self.host,
+                                    port=self.port,
+                                    **options)
+        except Exception as e:
+            if self.breaker is not None:
+                if is_auth_error(e):
+                    self.breaker.success()
+                else:
+                    self.breaker.failure()
+            raise
+        if self.breaker is not None:
+            self.breaker.success()
+        return conn
 
     def connection(self):
         if not self.conn or self.conn.closed:
-            self.conn = psycopg2.connect(database=self.database,
-                                         user=self.user,
-                                         password=self.password,
-                                         host=self.host,
-                                         port=self.port)
+            self.conn = self.connect()
         return self.conn
 
     @contextmanager
-    def transaction(self):
-        """Open a "read committed" transaction for SQLs execution"""
-        conn = self.connection()
-        orig_level = conn.isolation_level
-        conn.set_isolation_level(ISOLATION_LEVEL_READ_COMMITTED)
-        cursor = conn.cursor()
-        try:
-            yield cursor
-            conn.commit()
-        except:
-            conn.rollback()
-            raise
-        finally:
-            cursor.close()
-            conn.set_isolation_level(orig_level)
+    def borrow(self):
+        """Hold a connection for the duration of the block"""
+        if self.pool is None:
+            yield self.connection()
+        else:
+            with self.pool.connection() as conn:
+                yield conn
+
+    def close(self):
+        if self.conn and not self.conn.closed:
+            self.conn.close()
+        if self.pool is not None:
+            self.pool.closeall()
 
     @contextmanager
-    def autocommit(self):
+    def transaction(self, cursor_name=None, operation='other'):
+        """Open a "read committed" transaction for SQLs execution
+
+        With `cursor_name`, the cursor is a server-side one, fetching rows
+        `itersize` at a time as they are iterated over. The duration of
+        the transaction is measured under the `operation` label, from the
+        checkout of the connection on. For a server-side cursor, only the
+        time spent on the server is, not the time the caller spends on
+        the rows.
+
+        """
+        with self.borrow() as conn:
+            start = time.time()
+            orig_level = conn.isolation_level
+            conn.set_isolation_level(ISOLATION_LEVEL_READ_COMMITTED)
+            cursor = conn.cursor(name=cursor_name,
+                                 cursor_factory=TracingCursor)
+            cursor.target = (self.host, self.database)
+            commit_start = None
+            try:
+                yield cursor
+                commit_start = time.time()
+                # a server-side cursor does not outlive the transaction
+                cursor.close()
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                self._lost(conn)
+                raise
+            finally:
+                if not cursor.closed and cursor_name is None:
+                    cursor.close()
+                if not conn.closed:
+                    conn.set_isolation_level(orig_level)
+                end = time.time()
+                if cursor_name is None:
+                    duration = end - start
+                else:
+                    duration = cursor.busy + end - (commit_start or end)
+                metrics.SQL_DURATION.labels(operation=operation).observe(
+                    duration)
+
+    @contextmanager
+    def autocommit(self, operation='other'):
         """Execute SQLs in a non-transaction (auto-commit)"""
-        conn = self.connection()
-        orig_level = conn.isolation_level
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
-        try:
-            yield cursor
-        finally:
-            cursor.close()
-            conn.set_isolation_level(orig_level)
+        with self.borrow() as conn, \
+                metrics.timed(metrics.SQL_DURATION, operation=operation):
+            orig_level = conn.isolation_level
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor(cursor_factory=TracingCursor)
+            cursor.target = (self.host, self.database)
+            try:
+                yield cursor
+            except:
+                self._lost(conn)
+                raise
+            finally:
+                cursor.close()
+                if not conn.closed:
+                    conn.set_isolation_level(orig_level)
+
+    def _lost(self, conn):
+        # a statement failing with the connection is a server failure
+        if self.breaker is not None and conn.closed:
+            self.breaker.failure()
 
     def ping(self):
         try:
-            with self.transaction() as cursor:
+            with self.transaction(operation='ping') as cursor:
                 cursor.execute('SELECT 1')
                 result = cursor.fetchone()
                 return result == (1,)
@@ -71,27 +806,177 @@ class Database(object):
         except Exception:
             return False
 
-    def export(self):
+    def export(self, format='plain', compress=None, pg_dump='pg_dump',
+               chunk_size=65536):
+        """Yield the dump of the database, chunk by chunk, as pg_dump runs
+
+        `format` is plain or custom, and `compress` gzip, zstd or None.
+        Closing the generator before the end kills pg_dump. ExportError
+        is raised when pg_dump fails.
+
+        """
+        compressor = get_compressor(compress)
+        cmd, environ = self._client_command(
+            pg_dump, '--format', format, self.database)
+
+        errors = tempfile.TemporaryFile()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=errors, env=environ)
+        try:
+            while True:
+                chunk = process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+            if process.wait() != 0:
+                errors.seek(0)
+                raise ExportError(self.database, errors.read())
+            if compressor is not None:
+                chunk = compressor.flush()
+                if chunk:
+                    yield chunk
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            errors.close()
+
+    def backup(self, path, jobs=1, pg_dump='pg_dump'):
+        """Dump the database to the `path` directory with `jobs` processes
+
+        The directory must not exist. CommandError is raised when
+        pg_dump fails.
+
+        """
+        cmd, environ = self._client_command(
+            pg_dump, '--format', 'directory', '--jobs', str(jobs),
+            '--file', path, self.database)
+        self._run('Backup', cmd, environ)
+
+    def restore(self, path, jobs=1, pg_restore='pg_restore'):
+        """Restore a directory dump with `jobs` processes
+
+        Objects of the dump are dropped first if they exist. CommandError
+        is raised when pg_restore fails.
+
+        """
+        cmd, environ = self._client_command(
+            pg_restore, '--format', 'directory', '--jobs', str(jobs),
+            '--clean', '--if-exists', '--dbname', self.database, path)
+        self._run('Restore', cmd, environ)
+
+    def import_dump(self, fp, role=None, pg_restore='pg_restore',
+                    chunk_size=65536):
+        """Restore a custom-format dump read from the `fp` file object
+
+        The dump is piped to pg_restore `chunk_size` bytes at a time and
+        restored in a single transaction, without its owners and
+        privileges. Objects are created by `role` if given. CommandError
+        is raised when pg_restore fails.
+
+        """
+        args = ['--format', 'custom', '--single-transaction', '--no-owner',
+                '--no-acl', '--dbname', self.database]
+        if role is not None:
+            args += ['--role', role]
+        cmd, environ = self._client_command(pg_restore, *args)
+
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                       stdout=errors, stderr=errors,
+                                       env=environ)
+            try:
+                while True:
+                    chunk = fp.read(chunk_size)
+                    if not chunk:
+                        break
+                    try:
+                        process.stdin.write(chunk)
+                    except IOError:
+                        # pg_restore gave up, its error is reported below
+                        break
+                process.stdin.close()
+                returncode = process.wait()
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            if returncode != 0:
+                errors.seek(0)
+                raise CommandError('Import', self.database, errors.read())
+
+    def _client_command(self, program, *args):
+        """Build the command line and environment of a client program"""
         environ = os.environ.copy()
         if self.password:
             environ['PGPASSWORD'] = self.password
-        cmd = ["pg_dump", "-U", self.user, self.name]
-        return subprocess.check_output(cmd, env=environ)
+        if self.connect_timeout:
+            environ['PGCONNECT_TIMEOUT'] = str(self.connect_timeout)
+        cmd = [program, '--no-password', '--host', self.host,
+               '--port', str(self.port), '--username', self.user]
+        return cmd + list(args), environ
+
+    def _run(self, command, cmd, environ):
+        with tempfile.TemporaryFile() as errors:
+            if subprocess.call(cmd, stderr=errors, env=environ) != 0:
+                errors.seek(0)
+                raise CommandError(command, self.database, errors.read())
 
 
 class AppDatabase(Database):
 
+    breaker = None
+
     def __init__(self, app=None):
         app.db = self
         self.app = app
         self.conn = None
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        tracer.slow_threshold = app.config['SLOW_QUERY_THRESHOLD']
+        tracer.keep = app.config['TRACE_KEEP']
 
-    def connection(self):
-        if not self.conn or self.conn.closed:
-            self.conn = psycopg2.connect(
-                database=self.app.config['POSTGRESQL_DATABASE'],
-                user=self.app.config['POSTGRESQL_USER'],
-                password=self.app.config['POSTGRESQL_PASSWORD'],
-                host=self.app.config['POSTGRESQL_HOST'],
-                port=self.app.config['POSTGRESQL_PORT'])
-        return self.conn
+    @property
+    def host(self):
+        return self.app.config['POSTGRESQL_HOST']
+
+    @property
+    def database(self):
+        return self.app.config['POSTGRESQL_DATABASE']
+
+    def connect(self):
+        return psycopg2.connect(
+            database=self.app.config['POSTGRESQL_DATABASE'],
+            user=self.app.config['POSTGRESQL_USER'],
+            password=self.app.config['POSTGRESQL_PASSWORD'],
+            host=self.app.config['POSTGRESQL_HOST'],
+            port=self.app.config['POSTGRESQL_PORT'])
+
+    @property
+    def pool(self):
+        # The pool is created on first use, after the worker forked
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                config = self.app.config
+                self._pool = ConnectionPool(
+                    self.connect,
+                    name='postgresapi',
+                    minconn=config['POSTGRESQL_POOL_MIN'],
+                    maxconn=config['POSTGRESQL_POOL_MAX'],
+                    timeout=config['POSTGRESQL_POOL_TIMEOUT'],
+                    max_lifetime=config['POSTGRESQL_POOL_MAX_LIFETIME'],
+                    check_interval=config['POSTGRESQL_POOL_CHECK_INTERVAL'])
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.closeall()
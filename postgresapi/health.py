@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import logging
+import threading
+
+from flask import current_app as app
+
+from . import workers
+from .storage import InstanceStorage, advisory_lock, HEALTH_MONITOR_LOCK
+
+logger = logging.getLogger(__name__)
+
+
+def probe(instance):
+    """Check whether the instance accepts connections
+
+    Returns the state of the instance and how many seconds the check
+    took, on a connection of its own. A running instance which can not
+    be reached is `down`.
+
+    """
+    if instance.state != 'running':
+        return {'state': instance.state, 'latency': None}
+
+    start = time.time()
+    try:
+        up = instance.is_up()
+    except Exception:
+        logger.exception('Probing %s failed', instance.name)
+        up = False
+    latency = time.time() - start
+    return {'state': 'running' if up else 'down', 'latency': latency}
+
+
+def probe_all(instances, timeout=None):
+    """Probe the instances concurrently and map their name to the result
+
+    Probes run on the `health` worker pool of HEALTH_WORKERS threads.
+    Instances whose probe is not over after `timeout` seconds, for the
+    whole batch, are reported as `unknown`.
+
+    """
+    if timeout is None:
+        timeout = app.config['HEALTH_TIMEOUT']
+    pool = workers.get_pool('health', app.config['HEALTH_WORKERS'])
+    tasks = [(instance, pool.submit(probe, instance))
+             for instance in instances]
+
+    deadline = time.time() + timeout
+    results = {}
+    for instance, task in tasks:
+        task.wait(max(deadline - time.time(), 0))
+        if task.done() and task.exception is None:
+            results[instance.name] = task.result
+        else:
+            results[instance.name] = {'state': 'unknown', 'latency': None}
+    return results
+
+
+def monitor(batch_size=500):
+    """Probe every running instance and record the results
+
+    Instances are probed `batch_size` at a time. Returns the number of
+    probed instances. Only one process at a time monitors the instances,
+    others return 0 at once.
+
+    """
+    storage = InstanceStorage()
+    probed = 0
+    with advisory_lock(HEALTH_MONITOR_LOCK) as locked:
+        if not locked:
+            return 0
+
+        after = None
+        while True:
+            instances = list(storage.iter_instances(
+                after=after, limit=batch_size, state='running'))
+            if not instances:
+                break
+            storage.record_health(probe_all(instances))
+            probed += len(instances)
+            after = instances[-1].name
+    return probed
+
+
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+
+def start_monitor():
+    """Run the monitor every HEALTH_MONITOR_INTERVAL seconds in a thread
+
+    The thread is started once per process.
+
+    """
+    global _monitor_pid
+    with _monitor_lock:
+        if _monitor_pid == os.getpid():
+            return
+        _monitor_pid = os.getpid()
+
+    flask_app = app._get_current_object()
+
+    def run():
+        while True:
+            try:
+                with flask_app.app_context():
+                    monitor()
+            except Exception:
+                logger.exception('Monitoring the instances failed')
+            time.sleep(flask_app.config['HEALTH_MONITOR_INTERVAL'])
+
+    thread = threading.Thread(target=run, name='health-monitor')
+    thread.daemon = True
+    thread.start()
@@ -3,10 +3,16 @@ from __future__ import print_function
 
 import os
 import sys
+import time
 
 from flask.ext.script import Manager
 
 from .apis import app
+from .managers import SharedManager, DedicatedManager
+from .models import canonicalize_db_name
+from .storage import InstanceStorage, BackupStorage
+from .capacity import report as capacity_report
+from . import backups, health
 
 manager = Manager(app)
 
@@ -86,3 +92,139 @@ def downgrade_db(to_version=None):
     _execute_sqls(sqldir, sqls,
                   lambda ver: ver <= from_version,
                   stop_version)
+
+
+@manager.command
+def warm_pool():
+    """List the warm containers of dedicated instances"""
+    dedicated = DedicatedManager()
+    containers = dedicated.warm_storage.find_all()
+    for container in containers:
+        print('%s\t%s:%s\t%s' % (container.container_id[:12],
+                                  container.host, container.port,
+                                  container.created_at))
+    print('%d warm container(s), %d wanted per host' %
+          (len(containers), dedicated.warm_pool_size))
+
+
+@manager.command
+def warm_pool_refill(once=False):
+    """Keep the warm pool of dedicated containers topped up"""
+    dedicated = DedicatedManager()
+    while True:
+        started = dedicated.refill_warm_pool()
+        print('%d warm container(s) started' % started)
+        if once:
+            break
+        time.sleep(app.config['DEDICATED_WARM_POOL_INTERVAL'])
+
+
+@manager.command
+def warm_pool_drain():
+    """Remove every warm container"""
+    for container in DedicatedManager().drain_warm_pool():
+        print('%s removed' % container.container_id[:12])
+
+
+@manager.command
+def spare_pool():
+    """List the spare databases of the shared plan"""
+    shared = SharedManager()
+    spares = shared.spare_storage.find_all()
+    for name, group, cluster in spares:
+        print('%s\t%s\t%s' % (cluster, name, group))
+    print('%d spare database(s), %d wanted per cluster' %
+          (len(spares), shared.spare_pool_size))
+
+
+@manager.command
+def spare_pool_refill(once=False):
+    """Keep the spare databases of the shared plan topped up"""
+    shared = SharedManager()
+    while True:
+        created = shared.refill_spare_databases()
+        print('%d spare database(s) created' % created)
+        if once:
+            break
+        time.sleep(app.config['SHARED_SPARE_POOL_INTERVAL'])
+
+
+@manager.command
+def spare_pool_drain():
+    """Drop every spare database"""
+    for name in SharedManager().drain_spare_databases():
+        print('%s dropped' % name)
+
+
+@manager.command
+def monitor(once=False):
+    """Probe the running instances and record their health"""
+    while True:
+        probed = health.monitor()
+        print('%d instance(s) probed' % probed)
+        if once:
+            break
+        time.sleep(app.config['HEALTH_MONITOR_INTERVAL'])
+
+
+@manager.command
+def reconcile(once=False):
+    """Set instances whose provisioning was lost to error"""
+    while True:
+        for name in InstanceStorage().fail_pending(
+                app.config['PROVISIONING_TIMEOUT']):
+            print('%s was still pending, set to error' % name)
+        if once:
+            break
+        time.sleep(app.config['PROVISIONING_TIMEOUT'] / 10)
+
+
+@manager.command
+def backup(name):
+    """Back up an instance to BACKUP_DIR"""
+    instance = InstanceStorage().instance_by_name(canonicalize_db_name(name))
+    done = BackupStorage().backup_by_id(
+        instance.name, backups.create_backup(instance).id)
+    print('backup %d of %s: %d bytes in %.1fs, sha256 %s' %
+          (done.id, done.instance, done.size, done.duration, done.checksum))
+
+
+@manager.command
+def restore(name, backup_id):
+    """Restore a backup of an instance"""
+    instance = InstanceStorage().instance_by_name(canonicalize_db_name(name))
+    backup = BackupStorage().backup_by_id(instance.name, int(backup_id))
+    backups.restore_backup(instance, backup)
+    print('backup %d of %s restored' % (backup.id, backup.instance))
+
+
+def _percent(ratio):
+    return '-' if ratio is None else '%.0f%%' % (ratio * 100)
+
+
+@manager.command
+def capacity():
+    """Show how full the shared clusters and the docker hosts are"""
+    report = capacity_report()
+    for cluster in report['shared']:
+        if not cluster['reachable']:
+            print('%s\t%s:%s\t%d instance(s)\tunreachable' %
+                  (cluster['name'], cluster['host'], cluster['port'],
+                   cluster['instances']))
+            continue
+        print('%s\t%s:%s\t%d/%s instance(s) (%s)\t%d MB\t'
+              '%d/%d connection(s) (%s)' %
+              (cluster['name'], cluster['host'], cluster['port'],
+               cluster['instances'], cluster['capacity'] or '-',
+               _percent(cluster['instance_usage']),
+               cluster['size'] / 1024 ** 2, cluster['connections'],
+               cluster['max_connections'],
+               _percent(cluster['connection_usage'])))
+    for host in report['dedicated']:
+        print('%s\t%d instance(s), %d warm\t%d/%d port(s) (%s)\t'
+              'memory %s\t%s' %
+              (host['host'], host['instances'], host['warm'],
+               host['used_ports'], host['total_ports'],
+               _percent(host['port_usage']),
+               _percent(host['memory_usage']),
+               'reachable' if host['reachable'] else 'unreachable'))
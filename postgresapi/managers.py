@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
-from .models import Instance, generate_password, generate_user
-from .storage import InstanceStorage, InstanceAlreadyExists, InstanceNotFound
+from .models import (Instance, WarmContainer, generate_password,
+                     generate_user, shared_clusters)
+from .storage import (InstanceStorage, InstanceAlreadyExists,
+                      InstanceNotFound, WarmContainerStorage,
+                      SpareDatabaseStorage, PortAllocator)
+from .scheduler import DockerScheduler, SharedScheduler, extract_hostname
+from . import metrics, workers
 from flask import current_app as app
 
+import os
 import psycopg2
 import docker
 import time
-from urlparse import urlparse
+import logging
+import binascii
+
+logger = logging.getLogger(__name__)
 
 
 class DockerUnexpectedResponse(Exception):
@@ -19,6 +28,11 @@ class DockerImageNotFound(Exception):
         self.args = ["Docker image %s is not found"]
 
 
+class DockerHostNotConfigured(Exception):
+    def __init__(self, host):
+        self.args = ["Docker host %s is not configured" % host]
+
+
 class DockerContainerError(Exception):
     pass
 
@@ -32,14 +46,118 @@ class BaseManager(object):
 
 
 class SharedManager(BaseManager):
+    def __init__(self):
+        super(SharedManager, self).__init__()
+
+        self.spare_storage = SpareDatabaseStorage()
+
+    @property
+    def spare_pool_size(self):
+        return app.config["SHARED_SPARE_POOL_SIZE"]
+
     def create_instance(self, name):
         if self.storage.instance_exists(name):
             raise InstanceAlreadyExists(name=name)
 
-        instance = Instance(name, 'shared')
+        cluster = SharedScheduler().choose()
+        instance = Instance(name, 'shared', cluster=cluster.name)
 
+        start = time.time()
         try:
-            instance.cluster_manager.create_database(instance.name)
+            if not self.assign_spare_database(instance):
+                instance.cluster_manager.create_database(instance.name)
+        except Exception as e:
+            metrics.PROVISIONING_DURATION.labels(
+                plan='shared', result='error').observe(time.time() - start)
+            if isinstance(e, psycopg2.ProgrammingError) and \
+                    e.args and 'already exists' in e.args[0]:
+                raise InstanceAlreadyExists(name=instance.name)
+
+            raise
+
+        instance.state = 'running'
+        metrics.PROVISIONING_DURATION.labels(
+            plan='shared', result='running').observe(time.time() - start)
+
+        self.storage.store(instance)
+        return instance
+
+    def assign_spare_database(self, instance):
+        """Give the instance a spare database, if there is one left"""
+        if self.spare_pool_size <= 0:
+            return False
+
+        spare = self.spare_storage.claim(instance.cluster)
+        workers.get_pool('provisioning', app.config['PROVISIONING_WORKERS']) \
+            .submit(self.refill_spare_databases)
+        if spare is None:
+            return False
+
+        try:
+            instance.cluster_manager.assign_spare_database(
+                spare[0], spare[1], instance.name)
+        except Exception:
+            self.spare_storage.store(*spare)
+            raise
+        return True
+
+    def refill_spare_databases(self):
+        """Create spare databases until every cluster has enough of them
+
+        Returns the number of created databases. Only one process at a
+        time refills the spares, others return 0 at once.
+
+        """
+        if self.spare_pool_size <= 0:
+            return 0
+
+        created = 0
+        with self.spare_storage.refill_lock() as locked:
+            if not locked:
+                return 0
+
+            counts = self.spare_storage.count_by_cluster()
+            for cluster in shared_clusters():
+                count = counts.get(cluster.name, 0)
+                for i in range(self.spare_pool_size - count):
+                    name = 'spare_' + binascii.hexlify(os.urandom(8))
+                    group = name + '_group'
+                    try:
+                        cluster.cluster_manager.create_spare_database(
+                            name, group, app.config["SHARED_SPARE_TEMPLATE"])
+                        self.spare_storage.store(name, group, cluster.name)
+                    except Exception:
+                        logger.exception('Could not create a spare database '
+                                         'on %s', cluster.name)
+                        break
+                    created += 1
+        return created
+
+    def drain_spare_databases(self):
+        """Drop every spare database and return their names"""
+        drained = []
+        for cluster in shared_clusters():
+            while True:
+                spare = self.spare_storage.claim(cluster.name)
+                if spare is None:
+                    break
+                cluster.cluster_manager.drop_spare_database(spare[0],
+                                                            spare[1])
+                drained.append(spare[0])
+        return drained
+
+    def clone_instance(self, source, name):
+        """Create an instance as a copy of another one, on its cluster"""
+        if self.storage.instance_exists(name):
+            raise InstanceAlreadyExists(name=name)
+
+        SharedScheduler().check_capacity(source.cluster)
+        instance = Instance(name, 'shared', cluster=source.cluster)
+        try:
+            instance.cluster_manager.clone_database(
+                source.name, name,
+                terminate=app.config['CLONE_TERMINATE_SESSIONS'],
+                wait=app.config['CLONE_WAIT_TIMEOUT'])
         except psycopg2.ProgrammingError as e:
             if e.args and 'already exists' in e.args[0]:
                 raise InstanceAlreadyExists(name=instance.name)
@@ -64,47 +182,47 @@ class DedicatedManager(BaseManager):
     def __init__(self):
         super(DedicatedManager, self).__init__()
 
-        self.docker_host = app.config["DOCKER_HOST"]
-        self.port_range_start = app.config["DEDICATED_PORT_RANGE_START"]
+        self.scheduler = DockerScheduler()
+        self.ports = PortAllocator()
         self.image_name = app.config["DEDICATED_IMAGE_NAME"]
+        self.memory = app.config["DEDICATED_MEMORY"]
+        self.warm_pool_size = app.config["DEDICATED_WARM_POOL_SIZE"]
+        self.warm_storage = WarmContainerStorage()
 
     def client(self, host=None):
-        if host is None:
-            host = self.docker_host
+        if host is None and self.scheduler.hosts:
+            host = self.scheduler.hosts[0]
 
         return docker.Client(base_url=host)
 
-    def extract_hostname(self, url):
-        return urlparse(url).hostname
-
-    def get_port_by_host(self, host):
-        storage = InstanceStorage()
-        instances = storage.find_instances_by_host(host)
+    def client_for(self, hostname):
+        """Get a client of the docker host an instance was placed on
 
-        if instances:
-            ports = []
-            for instance in instances:
-                if instance.port is not None:
-                    ports.append(int(instance.port))
+        Instances without host get the first docker host. A host which
+        is not configured anymore raises DockerHostNotConfigured, rather
+        than sending the call to another daemon.
 
-            return max(ports) + 1
+        """
+        if hostname is None:
+            return self.client()
+        url = self.scheduler.url_of(hostname)
+        if url is None:
+            raise DockerHostNotConfigured(host=hostname)
+        return self.client(url)
 
-        return self.port_range_start
+    def extract_hostname(self, url):
+        return extract_hostname(url)
 
-    def create_instance(self, name):
-        if self.storage.instance_exists(name):
-            raise InstanceAlreadyExists(name=name)
-
-        client = self.client()
-        host = self.extract_hostname(client.base_url)
-        port = self.get_port_by_host(host)
-        admin_user = generate_user(name, host)
-        admin_password = generate_password(name, host)
+    def allocate_port(self, host, owner):
+        start, end = self.scheduler.port_range_of(host)
+        return self.ports.allocate(host, owner, start, end)
 
+    def create_container(self, client, admin_user, admin_password):
         try:
             output = client.create_container(
                 self.image_name,
                 command="",
+                mem_limit=self.memory,
                 ports=[5432],
                 environment={
                     "POSTGRES_USER": admin_user,
@@ -117,38 +235,120 @@ class DedicatedManager(BaseManager):
             else:
                 raise DockerUnexpectedResponse(response=e.response)
 
+        return output["Id"]
+
+    def start_container(self, client, container, max_try):
+        """Start the container and wait for PostgreSQL to be up"""
+        try:
+            client.start(container.container_id,
+                         port_bindings={5432: ('0.0.0.0', container.port)})
+        except docker.APIError as e:
+            raise DockerUnexpectedResponse(response=e.response.content)
+
+        if not self.is_up(container, max_try):
+            raise DockerContainerError(
+                'Instance not up after %d tries' % max_try)
+
+    def create_instance(self, name):
+        """Create the container and provision it in the background
+
+        The instance is placed on the least loaded docker host, stored as
+        `pending` and moves to `running` or `error` once the provisioning
+        task is over. When the warm pool has a ready container for the
+        host, it is claimed instead of creating a new one.
+
+        """
+        if self.storage.instance_exists(name):
+            raise InstanceAlreadyExists(name=name)
+
+        client = self.client(self.scheduler.choose())
+        host = self.extract_hostname(client.base_url)
+        admin_password = generate_password(name, host)
+        pool = workers.get_pool('provisioning',
+                                app.config['PROVISIONING_WORKERS'])
+
+        warm = self.warm_storage.claim(host)
+        if warm is not None:
+            instance = Instance(
+                name=name,
+                plan='dedicated',
+                host=host,
+                port=warm.port,
+                container_id=warm.container_id,
+                username=warm.username,
+                password=admin_password
+            )
+            self.ports.transfer(host, warm.port, name)
+            self.storage.store(instance)
+            pool.submit(self.provision_instance, instance, warm)
+            pool.submit(self.refill_warm_pool)
+            return instance
+
+        port = self.allocate_port(host, name)
+        admin_user = generate_user(name, host)
+        try:
+            container_id = self.create_container(client, admin_user,
+                                                 admin_password)
+        except Exception:
+            self.ports.release(host, port)
+            raise
+
         instance = Instance(
             name=name,
             plan='dedicated',
             host=host,
             port=port,
-            container_id=output["Id"],
+            container_id=container_id,
             username=admin_user,
             password=admin_password
         )
         self.storage.store(instance)
 
-        try:
-            client.start(output["Id"], port_bindings={5432: ('0.0.0.0', port)})
-        except docker.APIError as e:
-            raise DockerUnexpectedResponse(response=e.response.content)
+        pool.submit(self.provision_instance, instance)
+        return instance
 
-        instance.state = 'running'
-        self.storage.store(instance)
+    def provision_instance(self, instance, warm=None):
+        """Get the container ready and create the instance's database
 
-        if not self.is_up(instance, 30):
-            raise DockerContainerError(
-                'Instance not up after %d tries with (%s/%s)' %
-                (30, admin_user, admin_password))
+        A claimed warm container is already started, only its admin
+        password is changed to the instance's one.
 
-        instance.cluster_manager.create_database(name)
-        self.storage.store(instance)
+        """
+        start = time.time()
+        try:
+            if warm is None:
+                self.start_container(self.client_for(instance.host),
+                                     instance,
+                                     app.config['PROVISIONING_MAX_TRY'])
+            else:
+                self.rotate_credentials(warm, instance)
 
+            instance.cluster_manager.create_database(instance.name)
+            instance.state = 'running'
+        except Exception:
+            logger.exception('Provisioning of %s failed', instance.name)
+            instance.state = 'error'
+        metrics.PROVISIONING_DURATION.labels(
+            plan='dedicated', result=instance.state).observe(
+                time.time() - start)
+
+        # The instance may have been removed while it was provisioned
+        self.storage.update(instance)
         return instance
 
+    def rotate_credentials(self, warm, instance):
+        manager = warm.cluster_manager
+        try:
+            with manager.db().autocommit() as cursor:
+                cursor.execute('ALTER ROLE %s WITH PASSWORD %%s' %
+                               warm.username, (instance.password, ))
+        finally:
+            manager.close()
+
     def is_up(self, instance, max_try=3):
         while max_try > 0:
-            if instance.is_up(instance.username):
+            if instance.cluster_manager.is_up(instance.username,
+                                              starting=True):
                 return True
             else:
                 time.sleep(1)
@@ -157,8 +357,90 @@ class DedicatedManager(BaseManager):
         return False
 
     def delete_instance(self, instance):
-        client = self.client()
+        client = self.client_for(instance.host)
         client.stop(instance.container_id)
         client.remove_container(instance.container_id)
 
         self.storage.delete_by_name(instance.name)
+        self.ports.release(instance.host, instance.port)
+
+    def create_warm_container(self, client):
+        host = self.extract_hostname(client.base_url)
+        admin_user = 'warm' + binascii.hexlify(os.urandom(4))
+        admin_password = generate_password(admin_user, host)
+        port = self.allocate_port(host, admin_user)
+        try:
+            container_id = self.create_container(client, admin_user,
+                                                 admin_password)
+        except Exception:
+            self.ports.release(host, port)
+            raise
+        self.ports.transfer(host, port, container_id)
+        container = WarmContainer(
+            container_id=container_id,
+            host=host,
+            port=port,
+            username=admin_user,
+            password=admin_password
+        )
+
+        try:
+            self.start_container(client, container,
+                                 app.config['PROVISIONING_MAX_TRY'])
+            self.warm_storage.store(container)
+        except Exception:
+            self.remove_warm_container(container)
+            raise
+        finally:
+            container.cluster_manager.close()
+        return container
+
+    def remove_warm_container(self, container):
+        client = self.client_for(container.host)
+        try:
+            client.stop(container.container_id)
+        except docker.APIError:
+            pass
+        client.remove_container(container.container_id)
+        self.ports.release(container.host, container.port)
+
+    def refill_warm_pool(self):
+        """Start containers until every host has enough warm ones
+
+        Returns the number of started containers. Only one process at a
+        time refills the pool, others return 0 at once.
+
+        """
+        if self.warm_pool_size <= 0:
+            return 0
+
+        started = 0
+        with self.warm_storage.refill_lock() as locked:
+            if not locked:
+                return 0
+
+            counts = self.warm_storage.count_by_host()
+            for url in self.scheduler.hosts:
+                client = self.client(url)
+                host = self.extract_hostname(url)
+                for i in range(self.warm_pool_size - counts.get(host, 0)):
+                    try:
+                        self.create_warm_container(client)
+                    except Exception:
+                        logger.exception('Could not start a warm container '
+                                         'on %s', host)
+                        break
+                    started += 1
+        return started
+
+    def drain_warm_pool(self):
+        """Remove every warm container and return them"""
+        drained = []
+        for container in self.warm_storage.find_all():
+            container = self.warm_storage.claim_container(
+                container.container_id)
+            if container is None:
+                continue
+            self.remove_warm_container(container)
+            drained.append(container)
+        return drained
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest, multiprocess)
+
+# Metrics of all the gunicorn workers are aggregated when this directory
+# is set, older prometheus_client releases only know the lower case name
+MULTIPROC_DIR_ENVS = ('PROMETHEUS_MULTIPROC_DIR', 'prometheus_multiproc_dir')
+
+REQUESTS = Counter(
+    'postgresapi_http_requests_total',
+    'HTTP requests served, per route and status',
+    ['method', 'route', 'status'])
+REQUEST_DURATION = Histogram(
+    'postgresapi_http_request_duration_seconds',
+    'Time spent serving HTTP requests, per route',
+    ['method', 'route'])
+SQL_DURATION = Histogram(
+    'postgresapi_sql_duration_seconds',
+    'Time spent in transactions once connected, per operation',
+    ['operation'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10,
+             30))
+POOL_CONNECTIONS = Gauge(
+    'postgresapi_pool_connections',
+    'Connections of the connection pools, open or in use',
+    ['pool', 'state'],
+    multiprocess_mode='livesum')
+POOL_WAIT = Histogram(
+    'postgresapi_pool_wait_seconds',
+    'Time spent checking out a connection from the pools',
+    ['pool'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+             5, 10, 30))
+POOL_TIMEOUTS = Counter(
+    'postgresapi_pool_timeouts_total',
+    'Checkouts given up because no connection was available',
+    ['pool'])
+PROVISIONING_DURATION = Histogram(
+    'postgresapi_provisioning_duration_seconds',
+    'Time spent getting an instance ready, per plan and result',
+    ['plan', 'result'],
+    buckets=(.1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the block in the histogram"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.time() - start)
+
+
+def render():
+    """Render the metrics in the Prometheus text format"""
+    if any(os.environ.get(name) for name in MULTIPROC_DIR_ENVS):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
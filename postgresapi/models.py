@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 import re
 import hmac
+import time
 import hashlib
+import threading
+from contextlib import contextmanager
 
 from flask import current_app as app
+from psycopg2.extensions import quote_ident
 
-from .database import Database
+from .database import (Database, ConnectionPool, get_breaker,
+                       get_connection_limit)
 
 
 class InvalidInstanceName(Exception):
@@ -22,6 +27,12 @@ class DatabaseCreationError(Exception):
     pass
 
 
+class DatabaseInUse(Exception):
+    def __init__(self, name, sessions):
+        self.args = ["Database %s is still used by %d session(s)" %
+                     (name, sessions)]
+
+
 def generate_password(string, host):
     hm = hmac.new(app.config['SALT'], digestmod=hashlib.sha1)
     hm.update(string)
@@ -59,13 +70,26 @@ class ClusterManager(object):
                  port=5432,
                  user='postgres',
                  password='',
-                 public_host=None):
+                 public_host=None,
+                 pool_options=None,
+                 connect_timeout=None,
+                 statement_timeout=None,
+                 breaker=None,
+                 keepalives=None,
+                 limit=None):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self._public_host = public_host
+        self.pool_options = pool_options
+        self.connect_timeout = connect_timeout
+        self.statement_timeout = statement_timeout
+        self.breaker = breaker
+        self.keepalives = keepalives
+        self.limit = limit
         self.dbs = {}
+        self._lock = threading.Lock()
 
     @property
     def public_host(self):
@@ -76,16 +100,73 @@ class ClusterManager(object):
     def db(self, name=None):
         if name is None:
             name = 'postgres'  # default database
-        if name not in self.dbs:
-            self.dbs[name] = Database(name,
-                                      self.user,
-                                      self.password,
-                                      self.host,
-                                      self.port)
-        return self.dbs[name]
+        with self._lock:
+            if name not in self.dbs:
+                db = self._new_db(name)
+                if self.pool_options is not None:
+                    db.pool = ConnectionPool(db.connect, name='cluster',
+                                             breaker=self.breaker,
+                                             limit=self.limit,
+                                             **self.pool_options)
+                self.dbs[name] = db
+            return self.dbs[name]
+
+    @contextmanager
+    def oneoff(self, name=None):
+        """Get a database whose connection is closed after the block
+
+        For one-off admin work, which would otherwise leave a pooled
+        connection open to each database it touched. The connection
+        counts against the limit of the cluster all the same.
+
+        """
+        db = self._new_db(name or 'postgres')
+        if self.limit is not None:
+            self.limit.acquire()
+        try:
+            yield db
+        finally:
+            db.close()
+            if self.limit is not None:
+                self.limit.release()
+
+    def _new_db(self, name):
+        return Database(name,
+                        self.user,
+                        self.password,
+                        self.host,
+                        self.port,
+                        connect_timeout=self.connect_timeout,
+                        statement_timeout=self.statement_timeout,
+                        breaker=self.breaker,
+                        keepalives=self.keepalives)
+
+    def close_db(self, name):
+        """Close the admin connections to the given database"""
+        with self._lock:
+            db = self.dbs.pop(name, None)
+        if db is not None:
+            db.close()
+
+    def evict_idle(self):
+        """Close idle pooled connections and return how many are left"""
+        with self._lock:
+            dbs = list(self.dbs.values())
+        size = 0
+        for db in dbs:
+            if db.pool is not None:
+                db.pool.evict_idle()
+                size += db.pool.size
+        return size
+
+    def close(self):
+        with self._lock:
+            dbs, self.dbs = list(self.dbs.values()), {}
+        for db in dbs:
+            db.close()
 
     def create_database(self, name, encoding=None):
-        with self.db().autocommit() as cursor:
+        with self.db().autocommit(operation='create_database') as cursor:
             grpsql = 'CREATE ROLE %(group)s WITH NOLOGIN'
             dbsql = 'CREATE DATABASE %(name)s'
             ownsql = 'ALTER DATABASE %(name)s OWNER TO %(group)s'
@@ -99,10 +180,120 @@ class ClusterManager(object):
             cursor.execute(dbsql % context)
             cursor.execute(ownsql % context)
 
+    def create_spare_database(self, name, group, template='template1'):
+        """Create a database, owned by its group, to be assigned later"""
+        with self.db().autocommit(operation='create_spare_database') as cursor:
+            cursor.execute('CREATE ROLE %s WITH NOLOGIN' % group)
+            try:
+                cursor.execute('CREATE DATABASE %s TEMPLATE %s OWNER %s' %
+                               (name, template, group))
+            except Exception:
+                cursor.execute('DROP ROLE %s' % group)
+                raise
+
+    def clone_database(self, source, name, terminate=True, wait=30):
+        """Create a database as a file-level copy of another one
+
+        CREATE DATABASE ... TEMPLATE requires that nobody is connected to
+        the source. New connections to it are refused meanwhile, and its
+        sessions are terminated, or with `terminate` off, waited for
+        during `wait` seconds before DatabaseInUse is raised.
+        Objects of the source's group and app roles belong to the clone's
+        group in the copy.
+
+        """
+        source_group = generate_group(source)
+        group = generate_group(name)
+
+        self.close_db(source)
+        with self.db().autocommit(operation='clone_database') as cursor:
+            # otherwise the app may connect again before the copy starts
+            cursor.execute('ALTER DATABASE %s WITH ALLOW_CONNECTIONS false' %
+                           source)
+            try:
+                deadline = time.time() + wait
+                while True:
+                    # Idle admin sessions, pooled by other workers, always go
+                    cursor.execute(
+                        "SELECT pg_terminate_backend(pid) "
+                        "FROM pg_stat_activity WHERE datname = %s "
+                        "AND pid <> pg_backend_pid() "
+                        "AND (%s OR usename = current_user "
+                        "AND state = 'idle')",
+                        (source, terminate))
+                    cursor.execute("SELECT count(*) FROM pg_stat_activity "
+                                   "WHERE datname = %s "
+                                   "AND pid <> pg_backend_pid()", (source, ))
+                    sessions = cursor.fetchone()[0]
+                    if sessions == 0:
+                        break
+                    if time.time() >= deadline:
+                        raise DatabaseInUse(name=source, sessions=sessions)
+                    time.sleep(0.5)
+
+                cursor.execute('CREATE ROLE %s WITH NOLOGIN' % group)
+                try:
+                    cursor.execute('CREATE DATABASE %s TEMPLATE %s OWNER %s' %
+                                   (name, source, group))
+                except Exception:
+                    cursor.execute('DROP ROLE %s' % group)
+                    raise
+            finally:
+                cursor.execute('ALTER DATABASE %s WITH ALLOW_CONNECTIONS true'
+                               % source)
+
+            cursor.execute("SELECT rolname FROM pg_auth_members pam "
+                           "JOIN pg_roles pg ON pg.oid = pam.member "
+                           "WHERE pam.roleid = "
+                           "(SELECT oid FROM pg_roles WHERE rolname = %s)",
+                           (source_group, ))
+            owners = [source_group] + [row[0] for row in cursor.fetchall()]
+
+        try:
+            # REASSIGN OWNED moves the source database too, give it back
+            db = self.db(name)
+            with db.transaction(operation='clone_database') as cursor:
+                cursor.execute('REASSIGN OWNED BY %s TO %s' %
+                               (', '.join(owners), group))
+                cursor.execute('ALTER DATABASE %s OWNER TO %s' %
+                               (source, source_group))
+                # Default privileges of the source's app roles are left,
+                # they would keep these roles from being dropped
+                if owners[1:]:
+                    cursor.execute('DROP OWNED BY %s' % ', '.join(owners[1:]))
+        except Exception:
+            self.drop_database(name)
+            raise
+
+    def assign_spare_database(self, spare, spare_group, name):
+        """Rename a spare database and its group role after an instance
+
+        Both renames run in one transaction, so the spare is left intact
+        when the database or the group role of the instance exists.
+
+        """
+        db = self.db()
+        with db.transaction(operation='assign_spare_database') as cursor:
+            cursor.execute('ALTER DATABASE %s RENAME TO %s' % (spare, name))
+            cursor.execute('ALTER ROLE %s RENAME TO %s' %
+                           (spare_group, generate_group(name)))
+
+    def drop_spare_database(self, name, group):
+        with self.db().autocommit(operation='drop_spare_database') as cursor:
+            cursor.execute('DROP DATABASE %s' % name)
+            cursor.execute('DROP ROLE %s' % group)
+
     def drop_database(self, name):
         group = generate_group(name)
 
-        with self.db().autocommit() as cursor:
+        # Pooled admin connections, ours or other workers', would make
+        # DROP DATABASE fail because the database is being accessed
+        self.close_db(name)
+        with self.db().autocommit(operation='drop_database') as cursor:
+            cursor.execute("SELECT pg_terminate_backend(pid) "
+                           "FROM pg_stat_activity WHERE datname = %s "
+                           "AND usename = current_user "
+                           "AND pid <> pg_backend_pid()", (name, ))
             cursor.execute("DROP DATABASE %s" % name)
 
             # Drop role members first
@@ -118,50 +309,336 @@ class ClusterManager(object):
             cursor.execute("DROP ROLE %s" % group)
 
     def create_user(self, database, host):
-        with self.db(database).autocommit() as cursor:
-            username = generate_user(database, host)
-            password = generate_password(database, host)
-            group = generate_group(database)
+        """Create the login role of an app, in one round trip
+
+        The role inherits the privileges of the group role. An existing
+        role is given the password and the grants again, so a retried
+        bind succeeds.
+
+        """
+        return self.create_users(database, [host])[0]
+
+    def create_users(self, database, hosts):
+        """Create the login roles of several app hosts at once
+
+        The roles are sent in one query, run in a single transaction, and
+        their credentials are returned in the order of `hosts`.
+
+        """
+        group = generate_group(database)
+        credentials = []
+        with self.db(database).autocommit(operation='create_user') as cursor:
+            sql = []
+            for host in hosts:
+                username = generate_user(database, host)
+                password = generate_password(database, host)
+                credentials.append((username, password))
+                sql.append(cursor.mogrify(
+                    self._create_user_sql(username, group),
+                    {'username': username, 'password': password}))
+            cursor.execute(' '.join(sql))
+
+        return credentials
+
+    def _create_user_sql(self, username, group):
+        context = {'user': username, 'group': group}
+        sql = (
+            "DO $create_user$ BEGIN "
+            "IF EXISTS (SELECT 1 FROM pg_roles "
+            "WHERE rolname = %%(username)s) THEN "
+            "ALTER ROLE %(user)s WITH LOGIN PASSWORD %%(password)s; "
+            "ELSE "
+            "CREATE ROLE %(user)s WITH LOGIN PASSWORD %%(password)s; "
+            "END IF; "
+            "END $create_user$; "
+            "GRANT %(group)s TO %(user)s; " % context)
+        # Alter default privileges will grant objects on group
+        for object in ['TABLES', 'SEQUENCES', 'FUNCTIONS']:
+            sql += ("ALTER DEFAULT PRIVILEGES FOR ROLE %s "
+                    "GRANT ALL PRIVILEGES ON %s TO %s; " %
+                    (username, object, group))
+        return sql
 
-            # Create the user and inherit privileges from the group role
-            sql = "CREATE ROLE %s WITH LOGIN PASSWORD %%s IN ROLE %s"
-            cursor.execute(sql % (username, group), (password, ))
+    def drop_user(self, database, host):
+        """Drop the login role of an app, in one round trip"""
+        username = generate_user(database, host)
+        group = generate_group(database)
+
+        # Reassign objects back to the group role
+        # This is needed to be able to drop an app user role after
+        # the app has created some objects in the database (e.g. tables)
+        sql = "REASSIGN OWNED BY %s TO %s; " % (username, group)
+
+        # Remove default privileges from the role
+        for object in ['TABLES', 'SEQUENCES', 'FUNCTIONS']:
+            sql += ("ALTER DEFAULT PRIVILEGES FOR ROLE %s "
+                    "REVOKE ALL PRIVILEGES ON %s FROM %s; " %
+                    (username, object, group))
+
+        sql += "DROP ROLE %s" % username
+
+        # Sent at once, the statements run in a single transaction
+        with self.db(database).autocommit(operation='drop_user') as cursor:
+            cursor.execute(sql)
+
+    def is_up(self, database, starting=False):
+        """Tell whether the database accepts connections
+
+        The connection is closed right after, probing many databases
+        does not leave one open to each of them. A server `starting` up
+        refuses connections for a while, these refusals are not reported
+        to the circuit breaker, and once it is up the breaker is closed.
+
+        """
+        with self.oneoff(database) as db:
+            if not starting:
+                return db.ping()
+            db.breaker = None
+            up = db.ping()
+        if up and self.breaker is not None:
+            self.breaker.success()
+        return up
+
+    def database_stats(self):
+        """Get the statistics of every database of the cluster at once
+
+        Returns a dict mapping each database name to its size in bytes,
+        its sessions and the counters of pg_stat_database.
+
+        """
+        with self.oneoff() as db, \
+                db.transaction(operation='stats') as cursor:
+            cursor.execute(
+                'SELECT d.datname, pg_database_size(d.oid), s.numbackends, '
+                's.xact_commit, s.xact_rollback, s.blks_read, s.blks_hit, '
+                's.tup_returned, s.tup_fetched, s.tup_inserted, '
+                's.tup_updated, s.tup_deleted '
+                'FROM pg_database d '
+                'JOIN pg_stat_database s ON s.datid = d.oid '
+                'WHERE d.datallowconn AND NOT d.datistemplate')
+            stats = {}
+            for row in cursor:
+                blocks = row[5] + row[6]
+                stats[row[0]] = {
+                    'size': row[1],
+                    'connections': row[2],
+                    'commits': row[3],
+                    'rollbacks': row[4],
+                    'cache_hit_ratio': (float(row[6]) / blocks
+                                        if blocks else None),
+                    'tuples_returned': row[7],
+                    'tuples_fetched': row[8],
+                    'tuples_inserted': row[9],
+                    'tuples_updated': row[10],
+                    'tuples_deleted': row[11],
+                }
+            return stats
+
+    def max_connections(self):
+        """Get the number of sessions the cluster accepts, for all users"""
+        with self.oneoff() as db, \
+                db.transaction(operation='stats') as cursor:
+            cursor.execute("SELECT current_setting('max_connections')::int "
+                           "- current_setting("
+                           "'superuser_reserved_connections')::int")
+            return cursor.fetchone()[0]
+
+    def export(self, database, **kwargs):
+        """Stream a dump of the database, see Database.export"""
+        return self._client_db(database).export(**kwargs)
+
+    def backup(self, database, path, **kwargs):
+        """Dump the database to a directory, see Database.backup"""
+        self._client_db(database).backup(path, **kwargs)
+
+    def restore(self, database, path, **kwargs):
+        """Restore a directory dump, see Database.restore"""
+        self._client_db(database).restore(path, **kwargs)
+
+    def import_csv(self, database, table, fp, columns=None, header=False,
+                   role=None, chunk_size=65536):
+        """Load CSV rows read from the `fp` file object into a table
+
+        The rows are sent with COPY, `chunk_size` bytes at a time, in one
+        transaction. `table` may be qualified by its schema. With `role`,
+        the COPY and the triggers it fires run as this role. Returns the
+        number of rows loaded.
+
+        """
+        with self.db(database).transaction(operation='import') as cursor:
+            if role is not None:
+                cursor.execute('SET LOCAL ROLE %s' % quote_ident(role, cursor))
+            sql = 'COPY %s' % '.'.join(quote_ident(part, cursor)
+                                       for part in table.split('.', 1))
+            if columns:
+                sql += ' (%s)' % ', '.join(quote_ident(column, cursor)
+                                           for column in columns)
+            sql += ' FROM STDIN WITH (FORMAT csv, HEADER %s)' % \
+                ('true' if header else 'false')
+            cursor.copy_expert(sql, fp, size=chunk_size)
+            return cursor.rowcount
+
+    def import_dump(self, database, fp, **kwargs):
+        """Restore a custom-format dump, see Database.import_dump"""
+        self._client_db(database).import_dump(fp, **kwargs)
+
+    def _client_db(self, database):
+        # client programs connect on their own, out of the pools
+        return Database(database, self.user, self.password, self.host,
+                        self.port, connect_timeout=self.connect_timeout)
+
+
+_cluster_managers = {}
+_cluster_managers_lock = threading.Lock()
+_last_eviction = 0
+
+
+def _cluster_pool_options():
+    config = app.config
+    return {
+        'maxconn': config['CLUSTER_POOL_MAX'],
+        'timeout': config['CLUSTER_POOL_TIMEOUT'],
+        'max_lifetime': config['CLUSTER_POOL_MAX_LIFETIME'],
+        'check_interval': config['CLUSTER_POOL_CHECK_INTERVAL'],
+        'idle_timeout': config['CLUSTER_POOL_IDLE_TIMEOUT'],
+    }
+
+
+def _cluster_options(host, port):
+    config = app.config
+    return {
+        'pool_options': _cluster_pool_options(),
+        'connect_timeout': config['CLUSTER_CONNECT_TIMEOUT'],
+        'statement_timeout': config['CLUSTER_STATEMENT_TIMEOUT'],
+        'breaker': get_breaker(
+            host, port,
+            threshold=config['CLUSTER_BREAKER_THRESHOLD'],
+            reset_timeout=config['CLUSTER_BREAKER_RESET_TIMEOUT']),
+        'limit': get_connection_limit(
+            host, port,
+            maxconn=config['CLUSTER_MAX_CONNECTIONS'],
+            timeout=config['CLUSTER_POOL_TIMEOUT']),
+        'keepalives': {
+            'keepalives_idle': config['CLUSTER_KEEPALIVES_IDLE'],
+            'keepalives_interval': config['CLUSTER_KEEPALIVES_INTERVAL'],
+            'keepalives_count': config['CLUSTER_KEEPALIVES_COUNT'],
+            'tcp_user_timeout': config['CLUSTER_TCP_USER_TIMEOUT'],
+        },
+    }
+
+
+def get_cluster_manager(host, port, user, password, public_host=None):
+    """Get the process-wide cluster manager for (host, port, user)
+
+    Managers keep pooled admin connections to each database they touched,
+    so binds and status checks reuse them instead of connecting again.
+
+    """
+    key = (host, port, user)
+    stale = []
+    with _cluster_managers_lock:
+        manager = _cluster_managers.get(key)
+        if manager is not None and (manager.password != password or
+                                    manager._public_host != public_host):
+            stale.append(_cluster_managers.pop(key))
+            manager = None
+        if manager is None:
+            manager = ClusterManager(host=host, port=port, user=user,
+                                     password=password,
+                                     public_host=public_host,
+                                     **_cluster_options(host, port))
+            _cluster_managers[key] = manager
+    for old in stale:
+        old.close()
+    _evict_idle_cluster_managers()
+    return manager
+
+
+def _evict_idle_cluster_managers():
+    global _last_eviction
+    idle_timeout = app.config['CLUSTER_POOL_IDLE_TIMEOUT']
+    now = time.time()
+    with _cluster_managers_lock:
+        if now - _last_eviction < idle_timeout:
+            return
+        _last_eviction = now
+        managers = list(_cluster_managers.items())
+    for key, manager in managers:
+        if manager.evict_idle() == 0:
+            with _cluster_managers_lock:
+                if _cluster_managers.get(key) is manager:
+                    del _cluster_managers[key]
+
+
+class SharedCluster(object):
+    """A PostgreSQL cluster hosting instances of the shared plan"""
+
+    def __init__(self, name, host='localhost', port=5432, admin='postgres',
+                 password='', public_host=None, weight=1, capacity=None):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.admin = admin
+        self.password = password
+        self.public_host = public_host
+        self.weight = weight
+        self.capacity = capacity
 
-            # Alter default privileges will grant objects on group
-            sql = ("ALTER DEFAULT PRIVILEGES FOR ROLE %s "
-                   "GRANT ALL PRIVILEGES ON %s TO %s")
-            for object in ['TABLES', 'SEQUENCES', 'FUNCTIONS']:
-                cursor.execute(sql % (username, object, group))
+    @property
+    def cluster_manager(self):
+        return get_cluster_manager(host=self.host, port=self.port,
+                                   user=self.admin, password=self.password,
+                                   public_host=self.public_host)
 
-            return username, password
 
-    def drop_user(self, database, host):
-        with self.db(database).autocommit() as cursor:
-            username = generate_user(database, host)
-            group = generate_group(database)
+def shared_clusters():
+    """Get the clusters of the shared plan, in configuration order
+
+    Without SHARED_CLUSTERS, the cluster set by the SHARED_* settings is
+    the only one, named `default`.
+
+    """
+    config = app.config
+    if config['SHARED_CLUSTERS']:
+        return [SharedCluster(**cluster)
+                for cluster in config['SHARED_CLUSTERS']]
+    return [SharedCluster('default',
+                          host=config['SHARED_HOST'],
+                          port=config['SHARED_PORT'],
+                          admin=config['SHARED_ADMIN'],
+                          password=config['SHARED_ADMIN_PASSWORD'],
+                          public_host=config['SHARED_PUBLIC_HOST'])]
+
+
+def shared_cluster(name=None):
+    """Get a shared cluster by name, the first one when name is None"""
+    clusters = shared_clusters()
+    if name is None:
+        return clusters[0]
+    for cluster in clusters:
+        if cluster.name == name:
+            return cluster
+    raise InvalidInstanceConfiguration(field='cluster')
 
-            # Reassign objects back to the group role
-            # This is needed to be able to drop an app user role after
-            # the app has created some objects in the database (e.g. tables)
-            sql = "REASSIGN OWNED BY %s TO %s"
-            cursor.execute(sql % (username, group))
 
-            # Remove default privileges from the role
-            sql = ("ALTER DEFAULT PRIVILEGES FOR ROLE %s "
-                   "REVOKE ALL PRIVILEGES ON %s FROM %s")
-            for object in ['TABLES', 'SEQUENCES', 'FUNCTIONS']:
-                cursor.execute(sql % (username, object, group))
+def shared_cluster_manager(name=None):
+    """Get the cluster manager of a shared cluster"""
+    return shared_cluster(name).cluster_manager
 
-            cursor.execute("DROP ROLE %s" % username)
 
-    def is_up(self, database):
-        return self.db(database).ping()
+def close_cluster_managers():
+    """Close every admin connection held by the registry"""
+    with _cluster_managers_lock:
+        managers = list(_cluster_managers.values())
+        _cluster_managers.clear()
+    for manager in managers:
+        manager.close()
 
 
 class Instance(object):
     def __init__(self, name, plan, state='pending', host=None,
                  port=None, container_id=None, username=None,
-                 password=None):
+                 password=None, cluster=None):
         self.name = name
         self.plan = plan
         self.state = state
@@ -170,13 +647,50 @@ class Instance(object):
         self.container_id = container_id
         self.username = username
         self.password = password
+        self.cluster = cluster
+
+    def to_dict(self):
+        """Describe the instance, without its credentials"""
+        return {
+            'name': self.name,
+            'plan': self.plan,
+            'state': self.state,
+            'host': self.host,
+            'port': self.port,
+            'cluster': self.cluster
+        }
 
     def create_user(self, host):
         return self.cluster_manager.create_user(self.name, host)
 
+    def create_users(self, hosts):
+        return self.cluster_manager.create_users(self.name, hosts)
+
     def drop_user(self, host):
         return self.cluster_manager.drop_user(self.name, host)
 
+    def export(self, **kwargs):
+        return self.cluster_manager.export(self.name, **kwargs)
+
+    def backup(self, path, **kwargs):
+        return self.cluster_manager.backup(self.name, path, **kwargs)
+
+    def restore(self, path, **kwargs):
+        return self.cluster_manager.restore(self.name, path, **kwargs)
+
+    def import_csv(self, table, fp, **kwargs):
+        # rows of shared instances are loaded with the rights of their apps
+        if self.plan == 'shared':
+            kwargs.setdefault('role', generate_group(self.name))
+        return self.cluster_manager.import_csv(self.name, table, fp,
+                                               **kwargs)
+
+    def import_dump(self, fp, **kwargs):
+        # objects of shared instances belong to the group of their apps
+        if self.plan == 'shared':
+            kwargs.setdefault('role', generate_group(self.name))
+        return self.cluster_manager.import_dump(self.name, fp, **kwargs)
+
     def get_public_host(self):
         return self.cluster_manager.public_host
 
@@ -191,13 +705,8 @@ class Instance(object):
 
     @property
     def cluster_manager(self):
-        config = app.config
         if self.plan == 'shared':
-            host = config['SHARED_HOST']
-            port = config['SHARED_PORT']
-            user = config['SHARED_ADMIN']
-            password = config['SHARED_ADMIN_PASSWORD']
-            public_host = config['SHARED_PUBLIC_HOST']
+            return shared_cluster_manager(self.cluster)
         elif self.plan == 'dedicated':
             if self.host is None or self.port is None:
                 raise InvalidInstanceConfiguration(
@@ -214,5 +723,50 @@ class Instance(object):
             raise NotImplementedError(
                 'Currently only shared and dedicated host are supported')
 
-        return ClusterManager(host=host, port=port, user=user,
-                              password=password, public_host=public_host)
+        return get_cluster_manager(host=host, port=port, user=user,
+                                   password=password, public_host=public_host)
+
+
+class WarmContainer(object):
+    """A started dedicated container waiting to be claimed"""
+
+    def __init__(self, container_id, host, port, username, password,
+                 created_at=None):
+        self.container_id = container_id
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.created_at = created_at
+
+    @property
+    def cluster_manager(self):
+        return get_cluster_manager(host=self.host, port=self.port,
+                                   user=self.username,
+                                   password=self.password)
+
+
+class Backup(object):
+    """A directory dump of an instance, and its last restore"""
+
+    def __init__(self, id, instance, status='pending', size=None,
+                 duration=None, checksum=None, error=None, created_at=None,
+                 finished_at=None, restore_status=None, restored_at=None):
+        self.id = id
+        self.instance = instance
+        self.status = status
+        self.size = size
+        self.duration = duration
+        self.checksum = checksum
+        self.error = error
+        self.created_at = created_at
+        self.finished_at = finished_at
+        self.restore_status = restore_status
+        self.restored_at = restored_at
+
+    def to_dict(self):
+        result = dict(self.__dict__)
+        for key in ('created_at', 'finished_at', 'restored_at'):
+            if result[key] is not None:
+                result[key] = result[key].isoformat()
+        return result
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+from urlparse import urlparse
+
+import docker
+from flask import current_app as app
+
+from .models import shared_clusters
+from .storage import InstanceStorage, WarmContainerStorage, PortAllocator
+
+logger = logging.getLogger(__name__)
+
+
+class NoHostAvailable(Exception):
+    def __init__(self):
+        self.args = ["No docker host can take a new instance."]
+
+
+class NoClusterAvailable(Exception):
+    def __init__(self):
+        self.args = ["No shared cluster can take a new instance."]
+
+
+class ClusterFull(Exception):
+    def __init__(self, name):
+        self.args = ["Shared cluster %s reached its capacity." % name]
+
+
+_docker_info = {}
+_docker_info_lock = threading.Lock()
+
+
+def docker_info(url, ttl=60):
+    """Get the `docker info` of a host, cached for `ttl` seconds
+
+    Returns None when the host could not be reached.
+
+    """
+    now = time.time()
+    with _docker_info_lock:
+        cached = _docker_info.get(url)
+    if cached is not None and now - cached[0] < ttl:
+        return cached[1]
+
+    try:
+        info = docker.Client(base_url=url).info()
+    except Exception:
+        logger.exception('Could not get the info of docker host %s', url)
+        info = None
+
+    with _docker_info_lock:
+        _docker_info[url] = (now, info)
+    return info
+
+
+def docker_hosts():
+    """Get the URLs of the configured docker hosts"""
+    hosts = app.config['DOCKER_HOSTS']
+    if not hosts and app.config['DOCKER_HOST']:
+        hosts = [app.config['DOCKER_HOST']]
+    return hosts
+
+
+def extract_hostname(url):
+    return urlparse(url).hostname
+
+
+class HostLoad(object):
+    """What a docker host is running, and what it can still take"""
+
+    def __init__(self, url, instances=0, warm=0, used_ports=0,
+                 total_ports=0, memory=None, info=None):
+        self.url = url
+        self.hostname = extract_hostname(url)
+        self.instances = instances
+        self.warm = warm
+        self.used_ports = used_ports
+        self.total_ports = total_ports
+        self.memory = memory
+        self.info = info
+
+    @property
+    def reachable(self):
+        return self.info is not None
+
+    @property
+    def free_ports(self):
+        return self.total_ports - self.used_ports
+
+    @property
+    def allocated_memory(self):
+        return (self.instances + self.warm) * (self.memory or 0)
+
+    @property
+    def memory_usage(self):
+        """Share of the host memory allocated to containers, if known"""
+        total = (self.info or {}).get('MemTotal')
+        if not self.memory or not total:
+            return None
+        return float(self.allocated_memory) / total
+
+    def can_host(self):
+        usage = self.memory_usage
+        if usage is not None and \
+                usage + float(self.memory) / self.info['MemTotal'] > 1:
+            return False
+        return self.reachable and self.free_ports > 0
+
+    def score(self):
+        """Lower is better"""
+        return (self.memory_usage or 0, self.instances + self.warm)
+
+
+class DockerScheduler(object):
+    """Place dedicated instances on the least loaded docker host
+
+    Loads come from a few aggregate queries on postgresapi's database and
+    from the cached `docker info` of each host.
+
+    """
+
+    def __init__(self, hosts=None, info=None):
+        config = app.config
+        self.hosts = hosts if hosts is not None else docker_hosts()
+        self.info = info or (lambda url: docker_info(
+            url, config['DOCKER_INFO_TTL']))
+        self.memory = config['DEDICATED_MEMORY']
+        self.port_ranges = config['DEDICATED_PORT_RANGES']
+        self.port_range = (config['DEDICATED_PORT_RANGE_START'],
+                           config['DEDICATED_PORT_RANGE_END'])
+
+    def port_range_of(self, hostname):
+        return self.port_ranges.get(hostname, self.port_range)
+
+    def url_of(self, hostname):
+        """Get the docker URL of a host from its name"""
+        for url in self.hosts:
+            if extract_hostname(url) == hostname:
+                return url
+        return None
+
+    def loads(self):
+        instances = InstanceStorage().count_by_host()
+        warm = WarmContainerStorage().count_by_host()
+        ports = PortAllocator().count_by_host()
+
+        loads = []
+        for url in self.hosts:
+            hostname = extract_hostname(url)
+            start, end = self.port_range_of(hostname)
+            loads.append(HostLoad(url,
+                                  instances=instances.get(hostname, 0),
+                                  warm=warm.get(hostname, 0),
+                                  used_ports=ports.get(hostname, 0),
+                                  total_ports=end - start + 1,
+                                  memory=self.memory,
+                                  info=self.info(url)))
+        return loads
+
+    def choose(self):
+        """Get the docker URL of the host to place a new instance on"""
+        candidates = [load for load in self.loads() if load.can_host()]
+        if not candidates:
+            raise NoHostAvailable()
+        return min(candidates, key=lambda load: load.score()).url
+
+
+class SharedScheduler(object):
+    """Place shared instances on the least loaded cluster
+
+    A cluster's load is its number of instances divided by its weight.
+    Clusters that reached their capacity are skipped.
+
+    """
+
+    def __init__(self, clusters=None):
+        self.clusters = clusters if clusters is not None \
+            else shared_clusters()
+
+    def loads(self):
+        """Get (cluster, instance count) pairs, in configuration order"""
+        counts = InstanceStorage().count_by_cluster(self.clusters[0].name)
+        return [(cluster, counts.get(cluster.name, 0))
+                for cluster in self.clusters]
+
+    def check_capacity(self, name):
+        """Raise ClusterFull if the cluster can't take another instance
+
+        Instances without cluster are on the first one.
+
+        """
+        name = name or self.clusters[0].name
+        for cluster, count in self.loads():
+            if cluster.name == name and cluster.capacity and \
+                    count >= cluster.capacity:
+                raise ClusterFull(name)
+
+    def choose(self):
+        candidates = [(float(count) / (cluster.weight or 1), cluster)
+                      for cluster, count in self.loads()
+                      if cluster.weight and
+                      (not cluster.capacity or count < cluster.capacity)]
+        if not candidates:
+            raise NoClusterAvailable()
+        return min(candidates, key=lambda candidate: candidate[0])[1]
@@ -0,0 +1 @@
+DROP TABLE spare_database;
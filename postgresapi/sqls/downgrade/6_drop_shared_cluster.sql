@@ -0,0 +1,7 @@
+ALTER TABLE spare_database
+    DROP COLUMN cluster;
+
+DROP INDEX instance_cluster_idx;
+
+ALTER TABLE instance
+    DROP COLUMN cluster;
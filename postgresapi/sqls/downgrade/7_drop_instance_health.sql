@@ -0,0 +1,5 @@
+ALTER TABLE instance
+    DROP COLUMN checked_at,
+    DROP COLUMN probe_latency,
+    DROP COLUMN last_seen,
+    DROP COLUMN health;
@@ -0,0 +1,2 @@
+ALTER TABLE instance
+    DROP COLUMN created_at;
@@ -0,0 +1,25 @@
+--
+-- Name: warm_container; Type: TABLE; Schema: public
+--
+
+CREATE TABLE warm_container (
+    container_id varchar(255) NOT NULL,
+    host varchar(255) NOT NULL,
+    port integer NOT NULL,
+    admin_user varchar(255) NOT NULL,
+    admin_password varchar(255) NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now()
+);
+
+--
+-- Name: warm_container_pkey; Type: CONSTRAINT; Schema: public
+--
+
+ALTER TABLE ONLY warm_container
+    ADD CONSTRAINT warm_container_pkey PRIMARY KEY (container_id);
+
+--
+-- Name: warm_container_host_idx; Type: INDEX; Schema: public
+--
+
+CREATE INDEX warm_container_host_idx ON warm_container (host, created_at);
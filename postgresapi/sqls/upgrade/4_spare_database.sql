@@ -0,0 +1,16 @@
+--
+-- Name: spare_database; Type: TABLE; Schema: public
+--
+
+CREATE TABLE spare_database (
+    name varchar(63) NOT NULL,
+    group_name varchar(63) NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now()
+);
+
+--
+-- Name: spare_database_pkey; Type: CONSTRAINT; Schema: public
+--
+
+ALTER TABLE ONLY spare_database
+    ADD CONSTRAINT spare_database_pkey PRIMARY KEY (name);
@@ -0,0 +1,35 @@
+--
+-- Name: port_allocation; Type: TABLE; Schema: public
+--
+
+CREATE TABLE port_allocation (
+    host varchar(255) NOT NULL,
+    port integer NOT NULL,
+    owner varchar(256) NULL
+);
+
+--
+-- Name: port_allocation_pkey; Type: CONSTRAINT; Schema: public
+--
+
+ALTER TABLE ONLY port_allocation
+    ADD CONSTRAINT port_allocation_pkey PRIMARY KEY (host, port);
+
+--
+-- Name: port_allocation_free_idx; Type: INDEX; Schema: public
+--
+
+CREATE INDEX port_allocation_free_idx ON port_allocation (host, port)
+    WHERE owner IS NULL;
+
+--
+-- Ports already used by dedicated instances and warm containers
+--
+
+INSERT INTO port_allocation (host, port, owner)
+    SELECT DISTINCT ON (host, port) host, port, name FROM instance
+    WHERE host IS NOT NULL AND port IS NOT NULL;
+
+INSERT INTO port_allocation (host, port, owner)
+    SELECT host, port, container_id FROM warm_container
+    ON CONFLICT DO NOTHING;
@@ -0,0 +1,22 @@
+--
+-- Name: instance; Type: TABLE; Schema: public
+--
+-- Shared instances created before this column existed live on the
+-- first configured cluster.
+--
+
+ALTER TABLE instance
+    ADD COLUMN cluster varchar(255) NULL;
+
+CREATE INDEX instance_cluster_idx ON instance (cluster)
+    WHERE plan = 'shared';
+
+--
+-- Name: spare_database; Type: TABLE; Schema: public
+--
+-- Spare databases created before this column existed are on the first
+-- configured cluster as well.
+--
+
+ALTER TABLE spare_database
+    ADD COLUMN cluster varchar(255) NULL;
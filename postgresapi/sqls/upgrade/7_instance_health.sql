@@ -0,0 +1,12 @@
+--
+-- Name: instance; Type: TABLE; Schema: public
+--
+-- Result of the last probe of the health monitor: health is running,
+-- down or unknown, last_seen is the last time the instance was up.
+--
+
+ALTER TABLE instance
+    ADD COLUMN health varchar(16) NULL,
+    ADD COLUMN last_seen timestamp NULL,
+    ADD COLUMN probe_latency double precision NULL,
+    ADD COLUMN checked_at timestamp NULL;
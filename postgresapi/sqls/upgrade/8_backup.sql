@@ -0,0 +1,35 @@
+--
+-- Name: backup; Type: TABLE; Schema: public
+--
+-- Directory dumps kept under BACKUP_DIR/<instance>/<id>. status and
+-- restore_status are pending, running, done or failed; size is in
+-- bytes, duration in seconds, checksum is the SHA-256 of the files and
+-- error the message of the last failed backup or restore.
+--
+
+CREATE TABLE backup (
+    id serial NOT NULL,
+    instance character varying(256) NOT NULL,
+    status varchar(16) NOT NULL DEFAULT 'pending',
+    size bigint NULL,
+    duration double precision NULL,
+    checksum varchar(64) NULL,
+    error text NULL,
+    created_at timestamp NOT NULL DEFAULT now(),
+    finished_at timestamp NULL,
+    restore_status varchar(16) NULL,
+    restored_at timestamp NULL
+);
+
+--
+-- Name: backup_pkey; Type: CONSTRAINT; Schema: public
+--
+
+ALTER TABLE ONLY backup
+    ADD CONSTRAINT backup_pkey PRIMARY KEY (id);
+
+--
+-- Name: backup_instance_idx; Type: INDEX; Schema: public
+--
+
+CREATE INDEX backup_instance_idx ON backup (instance, created_at);
@@ -0,0 +1,10 @@
+--
+-- Name: instance; Type: TABLE; Schema: public
+--
+-- When the instance was created, so that instances left pending by a
+-- lost provisioning task can be told apart. Existing instances get the
+-- time of the upgrade.
+--
+
+ALTER TABLE instance
+    ADD COLUMN created_at timestamp NOT NULL DEFAULT now();
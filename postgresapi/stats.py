@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import logging
+import threading
+
+from flask import current_app as app
+
+from .models import shared_clusters
+
+logger = logging.getLogger(__name__)
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def collect(cluster_manager):
+    """Query the statistics of every database of a cluster and cache them"""
+    entry = {'databases': cluster_manager.database_stats(),
+             'max_connections': cluster_manager.max_connections(),
+             'collected_at': time.time()}
+    with _stats_lock:
+        _stats[(cluster_manager.host, cluster_manager.port)] = entry
+    return entry
+
+
+def cluster_stats(cluster_manager, max_age=None):
+    """Get the cached statistics of a cluster
+
+    They are collected again when older than `max_age` seconds,
+    STATS_MAX_AGE by default.
+
+    """
+    if max_age is None:
+        max_age = app.config['STATS_MAX_AGE']
+    with _stats_lock:
+        entry = _stats.get((cluster_manager.host, cluster_manager.port))
+    if entry is None or time.time() - entry['collected_at'] > max_age:
+        entry = collect(cluster_manager)
+    return entry
+
+
+def instance_stats(instance):
+    """Get the statistics of an instance, or None if its database is gone
+
+    A database missing from cached statistics may have been created
+    since, they are collected again before giving up.
+
+    """
+    cluster_manager = instance.cluster_manager
+    start = time.time()
+    entry = cluster_stats(cluster_manager)
+    if instance.name not in entry['databases'] and \
+            entry['collected_at'] < start:
+        entry = collect(cluster_manager)
+    stats = entry['databases'].get(instance.name)
+    if stats is None:
+        return None
+    stats = dict(stats)
+    stats['collected_at'] = entry['collected_at']
+    return stats
+
+
+def collect_shared():
+    """Collect the statistics of every shared cluster
+
+    Returns the number of clusters collected, a cluster failing does not
+    stop the others.
+
+    """
+    collected = 0
+    for cluster in shared_clusters():
+        try:
+            collect(cluster.cluster_manager)
+            collected += 1
+        except Exception:
+            logger.exception('Collecting the statistics of %s failed',
+                             cluster.name)
+    return collected
+
+
+def clear():
+    with _stats_lock:
+        _stats.clear()
+
+
+_collector_pid = None
+_collector_lock = threading.Lock()
+
+
+def start_collector():
+    """Collect the shared clusters every STATS_INTERVAL seconds in a thread
+
+    The thread is started once per process, when STATS_COLLECTOR_THREAD
+    is set.
+
+    """
+    global _collector_pid
+    with _collector_lock:
+        if _collector_pid == os.getpid():
+            return
+        _collector_pid = os.getpid()
+
+    flask_app = app._get_current_object()
+
+    def run():
+        while True:
+            try:
+                with flask_app.app_context():
+                    collect_shared()
+            except Exception:
+                logger.exception('Collecting the statistics failed')
+            time.sleep(flask_app.config['STATS_INTERVAL'])
+
+    thread = threading.Thread(target=run, name='stats-collector')
+    thread.daemon = True
+    thread.start()
@@ -1,6 +1,24 @@
 # -*- coding: utf-8 -*-
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 from flask import current_app as app
-from .models import Instance
+from psycopg2.extras import execute_values
+from .cache import LRUCache
+from .database import Listener
+from .models import Backup, Instance, WarmContainer, shared_cluster
+
+# Keys of the advisory locks held while the pools are refilled
+WARM_POOL_LOCK = 0x7761726d
+SPARE_POOL_LOCK = 0x73706172
+# Key of the advisory lock held by the health monitor
+HEALTH_MONITOR_LOCK = 0x6865616c
+# Class of the per host advisory locks taken while allocating ports
+PORT_ALLOCATION_LOCK = 0x706f7274
+# Class of the per instance advisory locks held by backups and restores
+BACKUP_LOCK = 0x6261636b
 
 
 class InstanceNotFound(Exception):
@@ -13,28 +31,170 @@ class InstanceAlreadyExists(Exception):
         self.args = ["Instance %s already exists." % name]
 
 
+class BackupNotFound(Exception):
+    def __init__(self, id):
+        self.args = ["Backup %s is not found." % id]
+
+
+class PortRangeExhausted(Exception):
+    def __init__(self, host):
+        self.args = ["No port is left on %s." % host]
+
+
+_missing = object()
+_instance_cache = None
+_instance_cache_lock = threading.Lock()
+_cache_listener = None
+_cache_listener_pid = None
+
+
+def instance_cache():
+    """Get the process-wide cache of instance rows"""
+    global _instance_cache
+    with _instance_cache_lock:
+        if _instance_cache is None:
+            _instance_cache = LRUCache(app.config['INSTANCE_CACHE_SIZE'])
+        return _instance_cache
+
+
+def cache_listener():
+    """Get the listener evicting instances changed by other processes
+
+    It is started on first use, and started again in a forked process.
+    None is returned when INSTANCE_CACHE_CHANNEL is empty.
+
+    """
+    global _cache_listener, _cache_listener_pid
+    channel = app.config['INSTANCE_CACHE_CHANNEL']
+    if not channel:
+        return None
+
+    cache = instance_cache()
+    with _instance_cache_lock:
+        if _cache_listener is None or _cache_listener_pid != os.getpid():
+            def evict(payload):
+                table_name, _, name = payload.partition(':')
+                cache.invalidate((table_name, name))
+
+            _cache_listener = Listener(app.db.connect, channel, evict,
+                                       on_connect=cache.clear)
+            _cache_listener.start()
+            _cache_listener_pid = os.getpid()
+        return _cache_listener
+
+
+def stop_cache_listener():
+    global _cache_listener
+    with _instance_cache_lock:
+        listener, _cache_listener = _cache_listener, None
+    if listener is not None and _cache_listener_pid == os.getpid():
+        listener.stop()
+
+
+def notify_instance_changed(cursor, table_name, name):
+    """Have the other processes evict the instance from their cache
+
+    The notification is sent when the cursor's transaction commits.
+
+    """
+    notify_instances_changed(cursor, table_name, [name])
+
+
+def notify_instances_changed(cursor, table_name, names):
+    """Send the notifications of several instances in one statement"""
+    channel = app.config['INSTANCE_CACHE_CHANNEL']
+    if channel and names:
+        cursor.execute('SELECT pg_notify(%s, payload) '
+                       'FROM unnest(%s::text[]) AS payload',
+                       (channel, ['%s:%s' % (table_name, name)
+                                  for name in names]))
+
+
+@contextmanager
+def advisory_lock(key, name=None):
+    """Try to take an advisory lock on postgresapi's database
+
+    Yields whether the lock was taken. With a `name`, the lock is the one
+    of this name in the class `key`. The lock is held by the borrowed
+    connection, which nested storage calls of the same thread reuse.
+
+    """
+    if name is None:
+        args, params = '%s', (key, )
+    else:
+        args, params = '%s, hashtext(%s)', (key, name)
+    with app.db.borrow():
+        with app.db.autocommit() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)' % args, params)
+            locked = cursor.fetchone()[0]
+        try:
+            yield locked
+        finally:
+            if locked:
+                with app.db.autocommit() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)' % args,
+                                   params)
+
+
 class InstanceStorage(object):
     def __init__(self, table_name='instance'):
         self.table_name = table_name
 
     def instance_by_name(self, name):
-        with app.db.transaction() as cursor:
+        row = self._row_by_name(name)
+        if row is None:
+            raise InstanceNotFound(name=name)
+        return self.instance_from_row(row)
+
+    def _row_by_name(self, name):
+        """Get the row of the instance, from the cache if possible
+
+        Missing instances are cached as well, for a shorter time. The
+        row is not cached if the instance was invalidated while it was
+        being selected, it might be outdated already.
+
+        """
+        cache = instance_cache()
+        key = (self.table_name, name)
+        if not self._cache_usable():
+            return self._select_row(name)
+
+        row = cache.get(key, _missing)
+        if row is not _missing:
+            return row
+
+        generation = cache.generation(key)
+        row = self._select_row(name)
+        if row is None:
+            ttl = app.config['INSTANCE_CACHE_NEGATIVE_TTL']
+        else:
+            ttl = app.config['INSTANCE_CACHE_TTL']
+        if ttl > 0:
+            cache.set(key, row, ttl, generation)
+        return row
+
+    def _cache_usable(self):
+        if app.config['INSTANCE_CACHE_TTL'] <= 0 and \
+                app.config['INSTANCE_CACHE_NEGATIVE_TTL'] <= 0:
+            return False
+        # Changes made by other processes go unnoticed while the
+        # listener is disconnected
+        listener = cache_listener()
+        return listener is None or listener.connected
+
+    def _select_row(self, name):
+        with app.db.transaction(operation='instance_lookup') as cursor:
             cursor.execute(
                 'SELECT name, plan, state, host, port, '
-                'container_id, admin_user, admin_password '
+                'container_id, admin_user, admin_password, cluster '
                 'FROM %s WHERE name=%%s' % self.table_name, (name, ))
-
-            try:
-                return self.instance_from_row(cursor.fetchone())
-
-            except TypeError:
-                raise InstanceNotFound(name=name)
+            return cursor.fetchone()
 
     def find_instances_by_host(self, host):
-        with app.db.transaction() as cursor:
+        with app.db.transaction(operation='instance_lookup') as cursor:
             cursor.execute(
                 'SELECT name, plan, state, host, port, '
-                'container_id, admin_user, admin_password '
+                'container_id, admin_user, admin_password, cluster '
                 'FROM %s WHERE host=%%s' % self.table_name, (host, ))
 
             instances = []
@@ -43,6 +203,107 @@ class InstanceStorage(object):
 
             return instances
 
+    def instances_by_names(self, names):
+        """Get the instances of the given names, ignoring unknown ones"""
+        with app.db.transaction(operation='instance_lookup') as cursor:
+            cursor.execute(
+                'SELECT name, plan, state, host, port, '
+                'container_id, admin_user, admin_password, cluster '
+                'FROM %s WHERE name = ANY(%%s)' % self.table_name,
+                (list(names), ))
+            return [self.instance_from_row(row) for row in cursor]
+
+    def iter_instances(self, after=None, limit=None, plan=None, state=None,
+                       host=None, itersize=1000):
+        """Yield the instances ordered by name
+
+        Only instances named after `after` are listed, at most `limit` of
+        them, so a listing can be resumed from its last name. Rows are
+        fetched from a server-side cursor `itersize` at a time.
+
+        """
+        conditions = []
+        params = []
+        for column, value in (('name >', after), ('plan =', plan),
+                              ('state =', state), ('host =', host)):
+            if value is not None:
+                conditions.append(column + ' %s')
+                params.append(value)
+
+        sql = ('SELECT name, plan, state, host, port, container_id, '
+               'admin_user, admin_password, cluster FROM %s' %
+               self.table_name)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY name'
+        if limit is not None:
+            sql += ' LIMIT %s'
+            params.append(limit)
+
+        with app.db.transaction(cursor_name='iter_instances') as cursor:
+            cursor.itersize = itersize
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield self.instance_from_row(row)
+
+    def count_by_cluster(self, default):
+        """Count the shared instances of each cluster
+
+        Instances without cluster are counted on `default`.
+
+        """
+        with app.db.transaction(operation='instance_count') as cursor:
+            cursor.execute(
+                'SELECT COALESCE(cluster, %%s), count(*) FROM %s '
+                'WHERE plan = \'shared\' GROUP BY 1' % self.table_name,
+                (default, ))
+            return dict(cursor.fetchall())
+
+    def count_by_host(self, plan='dedicated'):
+        with app.db.transaction(operation='instance_count') as cursor:
+            cursor.execute(
+                'SELECT host, count(*) FROM %s WHERE plan = %%s '
+                'AND host IS NOT NULL GROUP BY host' % self.table_name,
+                (plan, ))
+            return dict(cursor.fetchall())
+
+    def record_health(self, results):
+        """Store probe results, a map of name to state and latency"""
+        if not results:
+            return
+        with app.db.transaction(operation='instance_health') as cursor:
+            execute_values(
+                cursor,
+                'UPDATE %s AS i SET health = v.health, '
+                'probe_latency = v.latency, checked_at = now(), '
+                'last_seen = CASE WHEN v.health = \'running\' THEN now() '
+                'ELSE i.last_seen END '
+                'FROM (VALUES %%s) AS v (name, health, latency) '
+                'WHERE i.name = v.name' % self.table_name,
+                [(name, result['state'], result['latency'])
+                 for name, result in results.items()],
+                template='(%s, %s, %s::double precision)')
+
+    def health_by_name(self, name, max_age):
+        """Get the state and the last recorded health of the instance
+
+        `health` is None unless it was recorded less than `max_age`
+        seconds ago.
+
+        """
+        with app.db.transaction(operation='instance_health') as cursor:
+            cursor.execute(
+                'SELECT state, CASE WHEN checked_at > '
+                'now() - %%s * interval \'1 second\' THEN health END, '
+                'last_seen, probe_latency, checked_at '
+                'FROM %s WHERE name = %%s' % self.table_name,
+                (max_age, name))
+            row = cursor.fetchone()
+        if row is None:
+            raise InstanceNotFound(name=name)
+        return dict(zip(('state', 'health', 'last_seen', 'latency',
+                         'checked_at'), row))
+
     def instance_from_row(self, row):
         return Instance(
             name=row[0],
@@ -52,37 +313,355 @@ class InstanceStorage(object):
             port=row[4],
             container_id=row[5],
             username=row[6],
-            password=row[7]
+            password=row[7],
+            cluster=row[8]
         )
 
     def instance_exists(self, name):
-        with app.db.transaction() as cursor:
-            cursor.execute(
-                'SELECT 1 FROM %s WHERE name=%%s' % self.table_name, (name, ))
-            return True if cursor.fetchone() else False
+        return self._row_by_name(name) is not None
+
+    def _upsert_sql(self, values):
+        return ('INSERT INTO %s (name, plan, state, host, port, '
+                'container_id, admin_user, admin_password, cluster) '
+                'VALUES %s ON CONFLICT (name) DO UPDATE SET '
+                'plan = EXCLUDED.plan, state = EXCLUDED.state, '
+                'host = EXCLUDED.host, port = EXCLUDED.port, '
+                'container_id = EXCLUDED.container_id, '
+                'admin_user = EXCLUDED.admin_user, '
+                'admin_password = EXCLUDED.admin_password, '
+                'cluster = EXCLUDED.cluster' % (self.table_name, values))
+
+    def _row_of(self, instance):
+        return (instance.name, instance.plan, instance.state,
+                instance.host, instance.port, instance.container_id,
+                instance.username, instance.password, instance.cluster)
 
     def store(self, instance):
-        with app.db.transaction() as cursor:
-            if self.instance_exists(instance.name):
-                cursor.execute(
-                    'UPDATE %s SET plan = %%s, state = %%s, host = %%s, '
-                    'port = %%s, container_id = %%s, admin_user = %%s, '
-                    'admin_password = %%s WHERE name = %%s' % self.table_name,
-                    (instance.plan, instance.state, instance.host,
-                     instance.port, instance.container_id,
-                     instance.username, instance.password, instance.name)
-                )
-            else:
-                cursor.execute(
-                    'INSERT INTO %s (name, plan, state, host, port, '
-                    'container_id, admin_user, admin_password) VALUES(%%s, '
-                    '%%s, %%s, %%s, %%s, %%s, %%s, %%s)' % self.table_name,
-                    (instance.name, instance.plan, instance.state,
-                     instance.host, instance.port, instance.container_id,
-                     instance.username, instance.password)
-                )
+        """Insert the instance, or update it if it exists"""
+        with app.db.transaction(operation='instance_store') as cursor:
+            cursor.execute(
+                self._upsert_sql('(%s, %s, %s, %s, %s, %s, %s, %s, %s)'),
+                self._row_of(instance))
+            notify_instance_changed(cursor, self.table_name, instance.name)
+        instance_cache().invalidate((self.table_name, instance.name))
+
+    def update(self, instance):
+        """Update the instance, return False if it does not exist"""
+        with app.db.transaction(operation='instance_store') as cursor:
+            cursor.execute(
+                'UPDATE %s SET plan = %%s, state = %%s, host = %%s, '
+                'port = %%s, container_id = %%s, admin_user = %%s, '
+                'admin_password = %%s, cluster = %%s '
+                'WHERE name = %%s' % self.table_name,
+                self._row_of(instance)[1:] + (instance.name, ))
+            updated = cursor.rowcount > 0
+            if updated:
+                notify_instance_changed(cursor, self.table_name,
+                                        instance.name)
+        instance_cache().invalidate((self.table_name, instance.name))
+        return updated
+
+    def store_many(self, instances, page_size=100):
+        """Insert or update several instances at once
+
+        Instances are sent `page_size` per statement, in one transaction.
+        When a name is given more than once, the last instance wins.
+
+        """
+        rows = OrderedDict()
+        for instance in instances:
+            rows[instance.name] = self._row_of(instance)
+        if not rows:
+            return
+
+        with app.db.transaction(operation='instance_store') as cursor:
+            execute_values(cursor, self._upsert_sql('%s'), rows.values(),
+                           page_size=page_size)
+            notify_instances_changed(cursor, self.table_name, list(rows))
+        cache = instance_cache()
+        for name in rows:
+            cache.invalidate((self.table_name, name))
+
+    def fail_pending(self, max_age):
+        """Set instances pending for more than `max_age` seconds to error
+
+        Returns the names of these instances.
+
+        """
+        with app.db.transaction(operation='instance_store') as cursor:
+            cursor.execute(
+                "UPDATE %s SET state = 'error' WHERE state = 'pending' "
+                "AND created_at < now() - %%s * interval '1 second' "
+                "RETURNING name" % self.table_name, (max_age, ))
+            names = [row[0] for row in cursor.fetchall()]
+            notify_instances_changed(cursor, self.table_name, names)
+        cache = instance_cache()
+        for name in names:
+            cache.invalidate((self.table_name, name))
+        return names
 
     def delete_by_name(self, name):
-        with app.db.transaction() as cursor:
+        with app.db.transaction(operation='instance_delete') as cursor:
             cursor.execute(
                 'DELETE FROM %s WHERE name=%%s' % self.table_name, (name, ))
+            notify_instance_changed(cursor, self.table_name, name)
+        instance_cache().invalidate((self.table_name, name))
+
+
+class WarmContainerStorage(object):
+    def __init__(self, table_name='warm_container'):
+        self.table_name = table_name
+
+    def store(self, container):
+        with app.db.transaction(operation='warm_pool') as cursor:
+            cursor.execute(
+                'INSERT INTO %s (container_id, host, port, admin_user, '
+                'admin_password) VALUES (%%s, %%s, %%s, %%s, %%s)' %
+                self.table_name,
+                (container.container_id, container.host, container.port,
+                 container.username, container.password))
+
+    def claim(self, host):
+        """Remove the oldest warm container of the host and return it"""
+        with app.db.transaction(operation='warm_pool') as cursor:
+            cursor.execute(
+                'DELETE FROM %(table)s WHERE container_id = ('
+                'SELECT container_id FROM %(table)s WHERE host = %%s '
+                'ORDER BY created_at LIMIT 1 FOR UPDATE SKIP LOCKED) '
+                'RETURNING container_id, host, port, admin_user, '
+                'admin_password, created_at' % {'table': self.table_name},
+                (host, ))
+            row = cursor.fetchone()
+            return self.container_from_row(row) if row else None
+
+    def claim_container(self, container_id):
+        """Remove the given warm container and return it, if still there"""
+        with app.db.transaction(operation='warm_pool') as cursor:
+            cursor.execute(
+                'DELETE FROM %s WHERE container_id = %%s '
+                'RETURNING container_id, host, port, admin_user, '
+                'admin_password, created_at' % self.table_name,
+                (container_id, ))
+            row = cursor.fetchone()
+            return self.container_from_row(row) if row else None
+
+    def find_all(self):
+        with app.db.transaction(operation='warm_pool') as cursor:
+            cursor.execute(
+                'SELECT container_id, host, port, admin_user, '
+                'admin_password, created_at FROM %s '
+                'ORDER BY host, created_at' % self.table_name)
+            return [self.container_from_row(row) for row in cursor]
+
+    def count_by_host(self):
+        with app.db.transaction(operation='warm_pool') as cursor:
+            cursor.execute(
+                'SELECT host, count(*) FROM %s GROUP BY host' %
+                self.table_name)
+            return dict(cursor.fetchall())
+
+    def container_from_row(self, row):
+        return WarmContainer(
+            container_id=row[0],
+            host=row[1],
+            port=row[2],
+            username=row[3],
+            password=row[4],
+            created_at=row[5]
+        )
+
+    def refill_lock(self):
+        """Try to become the only process refilling the warm pool"""
+        return advisory_lock(WARM_POOL_LOCK)
+
+
+class SpareDatabaseStorage(object):
+    def __init__(self, table_name='spare_database'):
+        self.table_name = table_name
+
+    def store(self, name, group, cluster):
+        with app.db.transaction(operation='spare_pool') as cursor:
+            cursor.execute(
+                'INSERT INTO %s (name, group_name, cluster) '
+                'VALUES (%%s, %%s, %%s)' % self.table_name,
+                (name, group, cluster))
+
+    def claim(self, cluster):
+        """Remove the oldest spare database of the cluster
+
+        Returns (name, group, cluster), or None if there is none left.
+
+        """
+        with app.db.transaction(operation='spare_pool') as cursor:
+            cursor.execute(
+                'DELETE FROM %(table)s WHERE name = ('
+                'SELECT name FROM %(table)s '
+                'WHERE COALESCE(cluster, %%s) = %%s '
+                'ORDER BY created_at LIMIT 1 FOR UPDATE SKIP LOCKED) '
+                'RETURNING name, group_name, COALESCE(cluster, %%s)' %
+                {'table': self.table_name},
+                (self.default_cluster(), cluster, self.default_cluster()))
+            return cursor.fetchone()
+
+    def find_all(self):
+        with app.db.transaction(operation='spare_pool') as cursor:
+            cursor.execute(
+                'SELECT name, group_name, COALESCE(cluster, %%s) FROM %s '
+                'ORDER BY 3, created_at' % self.table_name,
+                (self.default_cluster(), ))
+            return cursor.fetchall()
+
+    def count_by_cluster(self):
+        with app.db.transaction(operation='spare_pool') as cursor:
+            cursor.execute(
+                'SELECT COALESCE(cluster, %%s), count(*) FROM %s '
+                'GROUP BY 1' % self.table_name, (self.default_cluster(), ))
+            return dict(cursor.fetchall())
+
+    def default_cluster(self):
+        """Spares stored before clusters were recorded are on the first"""
+        return shared_cluster().name
+
+    def refill_lock(self):
+        """Try to become the only process refilling the spare databases"""
+        return advisory_lock(SPARE_POOL_LOCK)
+
+
+class PortAllocator(object):
+    """Ports of the dedicated containers, per docker host
+
+    Released ports stay in the table without owner and are handed out
+    again, lowest first, before the range grows.
+
+    """
+
+    # Allocations of a host are serialized by an advisory lock sent in
+    # the same round trip. A free port is taken first; if there is none,
+    # the port following the highest one of the range is inserted.
+    allocate_sql = (
+        'SELECT pg_advisory_xact_lock(%(lock)s, hashtext(%%(host)s)); '
+        'WITH reused AS ('
+        ' UPDATE %(table)s SET owner = %%(owner)s'
+        ' WHERE host = %%(host)s AND port = ('
+        '  SELECT port FROM %(table)s'
+        '  WHERE host = %%(host)s AND owner IS NULL'
+        '  AND port BETWEEN %%(start)s AND %%(end)s'
+        '  ORDER BY port LIMIT 1 FOR UPDATE SKIP LOCKED)'
+        ' RETURNING port'
+        '), fresh AS ('
+        ' INSERT INTO %(table)s (host, port, owner)'
+        ' SELECT %%(host)s, COALESCE(max(port) + 1, %%(start)s), %%(owner)s'
+        ' FROM %(table)s'
+        ' WHERE host = %%(host)s AND port BETWEEN %%(start)s AND %%(end)s'
+        ' HAVING NOT EXISTS (SELECT 1 FROM reused)'
+        ' AND COALESCE(max(port) + 1, %%(start)s) <= %%(end)s'
+        ' ON CONFLICT DO NOTHING'
+        ' RETURNING port'
+        ') SELECT port FROM reused UNION ALL SELECT port FROM fresh')
+
+    def __init__(self, table_name='port_allocation', max_try=5):
+        self.table_name = table_name
+        self.max_try = max_try
+
+    def allocate(self, host, owner, start, end):
+        """Reserve a port of the host between start and end, inclusive"""
+        sql = self.allocate_sql % {'table': self.table_name,
+                                   'lock': PORT_ALLOCATION_LOCK}
+        params = {'host': host, 'owner': owner, 'start': start, 'end': end}
+        for i in range(self.max_try):
+            with app.db.transaction(operation='port_allocation') as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+                if row is not None:
+                    return row[0]
+
+        raise PortRangeExhausted(host=host)
+
+    def count_by_host(self):
+        """Count the ports in use on each host"""
+        with app.db.transaction(operation='port_allocation') as cursor:
+            cursor.execute(
+                'SELECT host, count(*) FROM %s WHERE owner IS NOT NULL '
+                'GROUP BY host' % self.table_name)
+            return dict(cursor.fetchall())
+
+    def transfer(self, host, port, owner):
+        with app.db.transaction(operation='port_allocation') as cursor:
+            cursor.execute(
+                'UPDATE %s SET owner = %%s WHERE host = %%s AND port = %%s' %
+                self.table_name, (owner, host, port))
+
+    def release(self, host, port):
+        with app.db.transaction(operation='port_allocation') as cursor:
+            cursor.execute(
+                'UPDATE %s SET owner = NULL WHERE host = %%s AND port = %%s' %
+                self.table_name, (host, port))
+
+
+class BackupStorage(object):
+    columns = ('id, instance, status, size, duration, checksum, error, '
+               'created_at, finished_at, restore_status, restored_at')
+
+    def __init__(self, table_name='backup'):
+        self.table_name = table_name
+
+    def create(self, instance_name):
+        with app.db.transaction(operation='backup') as cursor:
+            cursor.execute(
+                'INSERT INTO %s (instance) VALUES (%%s) RETURNING %s' %
+                (self.table_name, self.columns), (instance_name, ))
+            return self.backup_from_row(cursor.fetchone())
+
+    def backup_by_id(self, instance_name, id):
+        with app.db.transaction(operation='backup') as cursor:
+            cursor.execute(
+                'SELECT %s FROM %s WHERE instance = %%s AND id = %%s' %
+                (self.columns, self.table_name), (instance_name, id))
+            row = cursor.fetchone()
+        if row is None:
+            raise BackupNotFound(id=id)
+        return self.backup_from_row(row)
+
+    def find_by_instance(self, instance_name):
+        """List the backups of the instance, latest first"""
+        with app.db.transaction(operation='backup') as cursor:
+            cursor.execute(
+                'SELECT %s FROM %s WHERE instance = %%s '
+                'ORDER BY created_at DESC, id DESC' %
+                (self.columns, self.table_name), (instance_name, ))
+            return [self.backup_from_row(row) for row in cursor]
+
+    def start(self, id):
+        with app.db.transaction(operation='backup') as cursor:
+            cursor.execute(
+                "UPDATE %s SET status = 'running' WHERE id = %%s" %
+                self.table_name, (id, ))
+
+    def finish(self, id, size, duration, checksum):
+        with app.db.transaction(operation='backup') as cursor:
+            cursor.execute(
+                "UPDATE %s SET status = 'done', size = %%s, duration = %%s, "
+                "checksum = %%s, error = NULL, finished_at = now() "
+                "WHERE id = %%s" % self.table_name,
+                (size, duration, checksum, id))
+
+    def fail(self, id, error):
+        with app.db.transaction(operation='backup') as cursor:
+            cursor.execute(
+                "UPDATE %s SET status = 'failed', error = %%s, "
+                "finished_at = now() WHERE id = %%s" % self.table_name,
+                (error, id))
+
+    def set_restore_status(self, id, status, error=None):
+        """Record the state of the restore, and its end when over"""
+        with app.db.transaction(operation='backup') as cursor:
+            cursor.execute(
+                'UPDATE %s SET restore_status = %%(status)s, '
+                'error = COALESCE(%%(error)s, error), '
+                'restored_at = CASE WHEN %%(status)s IN (\'done\', '
+                '\'failed\') THEN now() ELSE restored_at END '
+                'WHERE id = %%(id)s' % self.table_name,
+                {'status': status, 'error': error, 'id': id})
+
+    def backup_from_row(self, row):
+        return Backup(*row)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import os
+import logging
+import threading
+from Queue import Queue
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+
+class Task(object):
+    """A function call queued on a worker pool"""
+
+    def __init__(self, fn, args, kwargs, app=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.app = app
+        self.result = None
+        self.exception = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self.result = self.fn(*self.args, **self.kwargs)
+            else:
+                self.result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            logger.exception('Task %r failed', self.fn)
+            self.exception = e
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the task to finish, return False on timeout"""
+        return self._done.wait(timeout)
+
+
+class WorkerPool(object):
+    """A fixed number of daemon threads running queued tasks
+
+    Tasks submitted inside an application context run inside one as
+    well. Threads are started on first use, and started again in a
+    forked process.
+
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = Queue()
+            for i in range(self.size):
+                thread = threading.Thread(
+                    target=self._work, args=(self._queue, ),
+                    name='%s-%d' % (self.name, i))
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self, queue):
+        while True:
+            task = queue.get()
+            try:
+                task.run()
+            finally:
+                queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        app = None
+        if has_app_context():
+            app = current_app._get_current_object()
+        task = Task(fn, args, kwargs, app=app)
+        self._ensure_started()
+        self._queue.put(task)
+        return task
+
+    def join(self):
+        """Block until every submitted task is done"""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, size):
+    """Get the process-wide worker pool with the given name"""
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = WorkerPool(name, size)
+        return _pools[name]
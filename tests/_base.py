@@ -5,10 +5,22 @@ import os
 import sys
 
 import unittest
+from distutils.spawn import find_executable
+
 import psycopg2
 
 from postgresapi import app, manage
 from postgresapi.database import Database
+from postgresapi.models import close_cluster_managers
+from postgresapi.storage import instance_cache
+
+
+def pg_bin_missing(program):
+    """Tell whether a client program of TEST_PG_BIN_DIR, or PATH, is missing"""
+    bin_dir = os.environ.get('TEST_PG_BIN_DIR', '')
+    if bin_dir:
+        return not os.path.exists(os.path.join(bin_dir, program))
+    return find_executable(program) is None
 
 
 class TestCase(unittest.TestCase):
@@ -50,12 +62,22 @@ class TestCase(unittest.TestCase):
             SHARED_ADMIN=user,
             SHARED_ADMIN_PASSWORD=password,
             SHARED_PUBLIC_HOST='db.example.com',
+            PG_BIN_DIR=os.environ.get('TEST_PG_BIN_DIR', ''),
+            STATS_COLLECTOR_THREAD=False,
             SALT='f0dcb6e03d67149f06ca7865a34e2355d619dcf7'))
         self.app = app
         manage.upgrade_db()
+        self.clear_instance_cache()
 
     def tearDown(self):
+        close_cluster_managers()
         manage.downgrade_db()
+        self.clear_instance_cache()
+
+    def clear_instance_cache(self):
+        """Forget instances cached by the tests, their tables are dropped"""
+        with self.app.app_context():
+            instance_cache().clear()
 
     def create_conn(self):
         return psycopg2.connect(
@@ -69,6 +91,7 @@ class TestCase(unittest.TestCase):
             password or self.password, host or self.host, port or self.port)
 
     def _drop_test_db(self):
+        close_cluster_managers()
         db = self.create_db()
         with db.autocommit() as cursor:
             try:
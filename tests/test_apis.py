@@ -8,6 +8,8 @@ except ImportError:
 from base64 import b64encode
 
 from postgresapi import managers
+from postgresapi.models import Instance
+from postgresapi.storage import InstanceStorage
 from . import _base
 
 
@@ -71,6 +73,56 @@ class ApisTestCase(_base.TestCase):
             'PG_USER': 'databaseno90ae84'
         })
 
+    def test_bind_apps_201(self):
+        with self.app.app_context():
+            manager = managers.SharedManager()
+            instance = manager.create_instance('databasenotexist')
+
+        hosts = ['127.0.0.1', '10.0.0.1', '10.0.0.2', '127.0.0.1']
+        rv = self.client.post('/resources/databasenotexist/bind-apps',
+                              data={'app-host': hosts},
+                              headers=self.headers)
+        try:
+            self.assertEqual(rv.status_code, 201)
+            configs = json.loads(rv.data)
+            self.assertEqual(sorted(configs), sorted(set(hosts)))
+            self.assertEqual(configs['127.0.0.1']['PG_USER'],
+                             'databaseno90ae84')
+            self.assertEqual(len(set(c['PG_USER']
+                                     for c in configs.values())), 3)
+
+            db = self.create_db()
+            with db.transaction() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_roles WHERE rolname IN %s",
+                    (tuple(c['PG_USER'] for c in configs.values()), ))
+                self.assertEqual(cursor.fetchone(), (3, ))
+        finally:
+            with self.app.app_context():
+                for host in set(hosts):
+                    try:
+                        instance.drop_user(host)
+                    except Exception:
+                        pass
+
+    def test_bind_apps_400_404_412(self):
+        rv = self.client.post('/resources/databasenotexist/bind-apps',
+                              headers=self.headers)
+        self.assertEqual(rv.status_code, 400)
+        rv = self.client.post('/resources/databasenotexist/bind-apps',
+                              data={'app-host': '127.0.0.1'},
+                              headers=self.headers)
+        self.assertEqual(rv.status_code, 404)
+
+        # stored through the storage, which evicts the cached miss
+        with self.app.app_context():
+            InstanceStorage().store(Instance('databasenotexist', 'shared'))
+        rv = self.client.post('/resources/databasenotexist/bind-apps',
+                              content_type='application/json',
+                              data=json.dumps(['127.0.0.1']),
+                              headers=self.headers)
+        self.assertEqual(rv.status_code, 412)
+
     def test_bind_app_201_case_insensitive(self):
         rv = self.client.post('/resources', data={
             'name': 'DatabaseNotExist'
@@ -119,18 +171,31 @@ class ApisTestCase(_base.TestCase):
         }, headers=self.headers)
         self.assertEqual(rv.status_code, 412)
 
-    def test_bind_app_500(self):
+    def test_bind_app_201_already_bound(self):
         with self.app.app_context():
             manager = managers.SharedManager()
             ins = manager.create_instance('databasenotexist')
             ins.create_user('127.0.0.1')
 
+        rv = self.client.post('/resources/databasenotexist/bind-app', data={
+            'app-host': '127.0.0.1'
+        }, headers=self.headers)
+        self.assertEqual(rv.status_code, 201)
+        self.assertEqual(json.loads(rv.data)['PG_USER'], 'databaseno90ae84')
+
+    def test_bind_app_500(self):
+        # the instance is registered but its database is missing
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO instance (name, state, plan) VALUES "
+                "('databasenotexist', 'running', 'shared')")
+
         rv = self.client.post('/resources/databasenotexist/bind-app', data={
             'app-host': '127.0.0.1'
         }, headers=self.headers)
         self.assertEqual(rv.status_code, 500)
-        self.assertEqual(rv.data.strip(),
-                         'role "databaseno90ae84" already exists')
+        self.assertTrue('"databasenotexist" does not exist' in rv.data)
 
     def test_unbind_app_200(self):
         with self.app.app_context():
@@ -182,6 +247,31 @@ class ApisTestCase(_base.TestCase):
                                 headers=self.headers)
         self.assertEqual(rv.status_code, 200)
 
+    def test_create_destroy_create(self):
+        # the instance cache is on, a cached instance or miss must not
+        # outlive a create or a destroy
+        rv = self.client.delete('/resources/databasenotexist',
+                                headers=self.headers)
+        self.assertEqual(rv.status_code, 404)
+        for i in range(2):
+            rv = self.client.post('/resources', data={
+                'name': 'databasenotexist'
+            }, headers=self.headers)
+            self.assertEqual(rv.status_code, 201)
+            rv = self.client.post('/resources', data={
+                'name': 'databasenotexist'
+            }, headers=self.headers)
+            self.assertEqual(rv.status_code, 500)
+            rv = self.client.get('/resources/databasenotexist/status',
+                                 headers=self.headers)
+            self.assertEqual(rv.status_code, 204)
+            rv = self.client.delete('/resources/databasenotexist',
+                                    headers=self.headers)
+            self.assertEqual(rv.status_code, 200)
+            rv = self.client.get('/resources/databasenotexist/status',
+                                 headers=self.headers)
+            self.assertEqual(rv.status_code, 404)
+
     def test_destroy_404(self):
         rv = self.client.delete('/resources/databasenotexist',
                                 headers=self.headers)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+
+from postgresapi import backups, managers, workers
+from postgresapi.database import CommandError
+from postgresapi.storage import BackupStorage, BACKUP_LOCK
+from . import _base
+
+
+@unittest.skipIf(_base.pg_bin_missing('pg_dump') or
+                 _base.pg_bin_missing('pg_restore'),
+                 'pg_dump or pg_restore is not found')
+class BackupTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(BackupTestCase, self).setUp()
+        self._drop_test_db()
+        self.backup_dir = tempfile.mkdtemp()
+        self.app.config.update(dict(BACKUP_DIR=self.backup_dir,
+                                    BACKUP_JOBS=2))
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password'))
+        }
+        with self.app.app_context():
+            self.instance = managers.SharedManager().create_instance(
+                'databasenotexist')
+        self.db = self.create_db(dbname='databasenotexist')
+        with self.db.transaction() as cursor:
+            cursor.execute('CREATE TABLE article (name varchar(20))')
+            cursor.execute("INSERT INTO article VALUES ('hello')")
+
+    def tearDown(self):
+        self.db.close()
+        super(BackupTestCase, self).tearDown()
+        self._drop_test_db()
+        shutil.rmtree(self.backup_dir)
+
+    def _articles(self):
+        with self.db.transaction() as cursor:
+            cursor.execute('SELECT name FROM article')
+            return cursor.fetchall()
+
+    def test_backup_and_restore(self):
+        with self.app.app_context():
+            backup = backups.create_backup(self.instance)
+            backup = BackupStorage().backup_by_id('databasenotexist',
+                                                  backup.id)
+        self.assertEqual(backup.status, 'done')
+        self.assertTrue(backup.size > 0)
+        self.assertTrue(backup.duration >= 0)
+        self.assertEqual(len(backup.checksum), 64)
+        path = os.path.join(self.backup_dir, 'databasenotexist',
+                            str(backup.id))
+        self.assertTrue(os.path.exists(os.path.join(path, 'toc.dat')))
+        self.assertEqual(backups.directory_digest(path),
+                         (backup.size, backup.checksum))
+
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE article SET name = 'changed'")
+        with self.app.app_context():
+            backups.restore_backup(self.instance, backup)
+            backup = BackupStorage().backup_by_id('databasenotexist',
+                                                  backup.id)
+        self.assertEqual(self._articles(), [('hello', )])
+        self.assertEqual(backup.restore_status, 'done')
+        self.assertTrue(backup.restored_at is not None)
+
+    def test_restore_corrupted(self):
+        with self.app.app_context():
+            backup = backups.create_backup(self.instance)
+            backup = BackupStorage().backup_by_id('databasenotexist',
+                                                  backup.id)
+            path = os.path.join(self.backup_dir, 'databasenotexist',
+                                str(backup.id))
+            with open(os.path.join(path, 'toc.dat'), 'ab') as fp:
+                fp.write('garbage')
+            self.assertRaises(backups.BackupCorrupted,
+                              backups.restore_backup, self.instance, backup)
+            backup = BackupStorage().backup_by_id('databasenotexist',
+                                                  backup.id)
+        self.assertEqual(backup.restore_status, 'failed')
+        self.assertTrue('does not match' in backup.error)
+
+    def test_backup_failed(self):
+        self.app.config['SHARED_ADMIN'] = 'unknownuser'
+        try:
+            with self.app.app_context():
+                self.assertRaises(CommandError, backups.create_backup,
+                                  self.instance)
+                backup, = BackupStorage().find_by_instance('databasenotexist')
+                self.assertRaises(backups.BackupNotDone,
+                                  backups.restore_backup, self.instance,
+                                  backup)
+        finally:
+            self.app.config['SHARED_ADMIN'] = self.user
+        self.assertEqual(backup.status, 'failed')
+        self.assertTrue('unknownuser' in backup.error)
+        self.assertEqual(os.listdir(os.path.join(self.backup_dir,
+                                                 'databasenotexist')), [])
+
+    def test_api(self):
+        rv = self.client.post('/resources/databasenotexist/backups',
+                              headers=self.headers)
+        self.assertEqual(rv.status_code, 202)
+        backup_id = json.loads(rv.data)['id']
+        workers.get_pool('backup', 1).join()
+
+        rv = self.client.get('/resources/databasenotexist/backups',
+                             headers=self.headers)
+        self.assertEqual(rv.status_code, 200)
+        backup, = json.loads(rv.data)['backups']
+        self.assertEqual(backup['id'], backup_id)
+        self.assertEqual(backup['status'], 'done')
+        self.assertEqual(backup['restore_status'], None)
+
+        with self.db.transaction() as cursor:
+            cursor.execute('DELETE FROM article')
+        rv = self.client.post('/resources/databasenotexist/backups/%d/'
+                              'restore' % backup_id, headers=self.headers)
+        self.assertEqual(rv.status_code, 202)
+        workers.get_pool('backup', 1).join()
+        self.assertEqual(self._articles(), [('hello', )])
+
+        rv = self.client.get('/resources/databasenotexist/backups',
+                             headers=self.headers)
+        self.assertEqual(json.loads(rv.data)['backups'][0]['restore_status'],
+                         'done')
+
+    def test_one_at_a_time(self):
+        with self.app.app_context():
+            backup = backups.create_backup(self.instance)
+            backup = BackupStorage().backup_by_id('databasenotexist',
+                                                  backup.id)
+            pending = BackupStorage().create('databasenotexist')
+
+        conn = self.create_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT pg_advisory_lock(%s, hashtext(%s))',
+                           (BACKUP_LOCK, 'databasenotexist'))
+            rv = self.client.post('/resources/databasenotexist/backups',
+                                  headers=self.headers)
+            self.assertEqual(rv.status_code, 409)
+            self.assertTrue('already running' in rv.data)
+            rv = self.client.post('/resources/databasenotexist/backups/%d/'
+                                  'restore' % backup.id,
+                                  headers=self.headers)
+            self.assertEqual(rv.status_code, 409)
+            self.assertTrue('already running' in rv.data)
+
+            # a queued backup gives up as well
+            with self.app.app_context():
+                self.assertRaises(backups.BackupInProgress,
+                                  backups.run_backup, self.instance, pending)
+                pending = BackupStorage().backup_by_id('databasenotexist',
+                                                       pending.id)
+            self.assertEqual(pending.status, 'failed')
+        finally:
+            conn.close()
+
+        with self.app.app_context():
+            backups.restore_backup(self.instance, backup)
+        self.assertEqual(self._articles(), [('hello', )])
+
+    def test_api_404(self):
+        rv = self.client.post('/resources/unknowndb/backups',
+                              headers=self.headers)
+        self.assertEqual(rv.status_code, 404)
+        rv = self.client.post('/resources/databasenotexist/backups/1/'
+                              'restore', headers=self.headers)
+        self.assertEqual(rv.status_code, 404)
+        rv = self.client.get('/resources/unknowndb/backups',
+                             headers=self.headers)
+        self.assertEqual(json.loads(rv.data), {'backups': []})
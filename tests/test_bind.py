@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import psycopg2
-
 from postgresapi import managers, storage
 from . import _base
 
@@ -42,7 +40,15 @@ class BindTestCase(_base.TestCase):
             s = storage.InstanceStorage()
             instance = s.instance_by_name('databasenotexist')
 
-            self.assertRaises(
-                psycopg2.ProgrammingError,
-                instance.create_user,
-                '127.0.0.1')
+            # the existing role is given a password and the grants
+            user, password = instance.create_user('127.0.0.1')
+            self.assertEqual(instance.create_user('127.0.0.1'),
+                             (user, password))
+
+        user_db = self.create_db(dbname='databasenotexist', user=user,
+                                 password=password)
+        with user_db.transaction() as cursor:
+            cursor.execute("SELECT pg_has_role('databaseno_group', "
+                           "'MEMBER')")
+            self.assertEqual(cursor.fetchone(), (True, ))
+        user_db.close()
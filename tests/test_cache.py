@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import unittest
+
+import mock
+
+from base64 import b64encode
+
+from postgresapi.cache import LRUCache
+from postgresapi.models import Instance
+from postgresapi.storage import (InstanceStorage, InstanceNotFound,
+                                 instance_cache, cache_listener,
+                                 stop_cache_listener)
+from . import _base
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(10)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1, 60)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_cached_none(self):
+        cache = LRUCache(10)
+        missing = object()
+        cache.set('a', None, 60)
+        self.assertIsNone(cache.get('a', missing))
+
+    def test_expire(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, 0.05)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.invalidate('a')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertIsNone(cache.get('b'))
+
+    def test_set_after_invalidate(self):
+        cache = LRUCache(10)
+        generation = cache.generation('a')
+        cache.invalidate('a')
+        cache.set('a', 1, 60, generation)
+        self.assertIsNone(cache.get('a'))
+
+        generation = cache.generation('a')
+        cache.clear()
+        cache.set('a', 1, 60, generation)
+        self.assertIsNone(cache.get('a'))
+
+        cache.set('a', 1, 60, cache.generation('a'))
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_generations_bounded(self):
+        cache = LRUCache(2)
+        generation = cache.generation('a')
+        for key in 'bcd':
+            cache.invalidate(key)
+        self.assertLessEqual(len(cache._generations), 2)
+        cache.set('a', 1, 60, generation)
+        self.assertIsNone(cache.get('a'))
+
+
+class InstanceCacheTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(InstanceCacheTestCase, self).setUp()
+        self.defaults = dict(
+            (key, self.app.config[key]) for key in (
+                'INSTANCE_CACHE_TTL', 'INSTANCE_CACHE_NEGATIVE_TTL',
+                'INSTANCE_CACHE_CHANNEL'))
+        self.app.config.update(dict(INSTANCE_CACHE_TTL=60,
+                                    INSTANCE_CACHE_NEGATIVE_TTL=60,
+                                    INSTANCE_CACHE_CHANNEL=''))
+        instance_cache().clear()
+
+    def tearDown(self):
+        stop_cache_listener()
+        instance_cache().clear()
+        self.app.config.update(self.defaults)
+        super(InstanceCacheTestCase, self).tearDown()
+
+    def _set_state(self, name, state):
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute('UPDATE instance SET state = %s WHERE name = %s',
+                           (state, name))
+        db.close()
+
+    def test_cached(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.store(Instance('cached', 'shared', state='running'))
+            self.assertEqual(storage.instance_by_name('cached').state,
+                             'running')
+
+            self._set_state('cached', 'error')
+            self.assertEqual(storage.instance_by_name('cached').state,
+                             'running')
+            self.assertTrue(storage.instance_exists('cached'))
+
+    def test_store_invalidates(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            instance = Instance('cached', 'shared', state='pending')
+            storage.store(instance)
+            storage.instance_by_name('cached')
+
+            instance.state = 'running'
+            storage.store(instance)
+            self.assertEqual(storage.instance_by_name('cached').state,
+                             'running')
+
+    def test_negative_cache(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            self.assertFalse(storage.instance_exists('cached'))
+
+            db = self.create_db()
+            with db.transaction() as cursor:
+                cursor.execute("INSERT INTO instance (name, plan, state) "
+                               "VALUES ('cached', 'shared', 'running')")
+            db.close()
+            self.assertFalse(storage.instance_exists('cached'))
+
+            storage.store(Instance('cached', 'shared', state='running'))
+            self.assertTrue(storage.instance_exists('cached'))
+
+    def test_invalidated_during_lookup(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            instance = Instance('cached', 'shared', state='pending')
+            storage.store(instance)
+            select_row = storage._select_row
+
+            def racing_select_row(name):
+                row = select_row(name)
+                # updated after the row was selected, before it is cached
+                instance.state = 'running'
+                storage.store(instance)
+                return row
+
+            with mock.patch.object(storage, '_select_row',
+                                   racing_select_row):
+                self.assertEqual(storage.instance_by_name('cached').state,
+                                 'pending')
+            self.assertEqual(storage.instance_by_name('cached').state,
+                             'running')
+
+    def test_delete_invalidates(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.store(Instance('cached', 'shared', state='running'))
+            self.assertTrue(storage.instance_exists('cached'))
+
+            storage.delete_by_name('cached')
+            self.assertFalse(storage.instance_exists('cached'))
+            self.assertRaises(InstanceNotFound,
+                              storage.instance_by_name, 'cached')
+
+    def test_returns_copies(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.store(Instance('cached', 'shared', state='running'))
+            storage.instance_by_name('cached').state = 'error'
+            self.assertEqual(storage.instance_by_name('cached').state,
+                             'running')
+
+    def test_stats(self):
+        before = instance_cache().stats()
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.instance_exists('cached')
+            storage.instance_exists('cached')
+
+        rv = self.app.test_client().get('/admin/cache', headers={
+            'Authorization': 'Basic ' + b64encode('admin:password')})
+        self.assertEqual(rv.status_code, 200)
+        stats = json.loads(rv.data)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def _wait_listening(self):
+        listener = cache_listener()
+        for i in xrange(100):
+            if listener.connected:
+                return listener
+            time.sleep(0.05)
+        self.fail('The cache listener did not connect')
+
+    def _wait_evicted(self, storage, name, state):
+        for i in xrange(100):
+            if storage.instance_by_name(name).state == state:
+                return
+            time.sleep(0.05)
+        self.fail('%s was not evicted' % name)
+
+    def test_evicted_by_other_process(self):
+        self.app.config['INSTANCE_CACHE_CHANNEL'] = 'postgresapi_test'
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.store(Instance('cached', 'shared', state='pending'))
+            self._wait_listening()
+            self.assertEqual(storage.instance_by_name('cached').state,
+                             'pending')
+
+            # as another process would do it
+            db = self.create_db()
+            with db.transaction() as cursor:
+                cursor.execute("UPDATE instance SET state = 'running' "
+                               "WHERE name = 'cached'")
+                cursor.execute("SELECT pg_notify('postgresapi_test', "
+                               "'instance:cached')")
+            db.close()
+            self._wait_evicted(storage, 'cached', 'running')
+
+    def test_not_cached_while_disconnected(self):
+        self.app.config['INSTANCE_CACHE_CHANNEL'] = 'postgresapi_test'
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.store(Instance('cached', 'shared', state='pending'))
+            listener = self._wait_listening()
+            listener.connected = False
+            self._set_state('cached', 'running')
+            self.assertEqual(storage.instance_by_name('cached').state,
+                             'running')
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import json
+from base64 import b64encode
+
+from postgresapi import capacity, managers, scheduler, stats
+from postgresapi.models import Instance, SharedCluster
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+GB = 1024 ** 3
+
+
+class CapacityTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(CapacityTestCase, self).setUp()
+        self._drop_test_db()
+        stats.clear()
+        with self.app.app_context():
+            managers.SharedManager().create_instance('databasenotexist')
+            storage = InstanceStorage()
+            for name, host, port in [('i1', 'h1', 40000),
+                                     ('i2', 'h1', 40001),
+                                     ('i3', 'h2', 40000)]:
+                storage.store(Instance(name, 'dedicated', state='running',
+                                       host=host, port=port))
+
+    def tearDown(self):
+        stats.clear()
+        self.app.config.update(DEDICATED_MEMORY=0)
+        super(CapacityTestCase, self).tearDown()
+        self._drop_test_db()
+
+    def test_shared_report(self):
+        with self.app.app_context():
+            cluster, unreachable = capacity.shared_report([
+                SharedCluster('default', host=self.host, port=self.port,
+                              admin=self.user, password=self.password,
+                              capacity=4),
+                SharedCluster('down', host=self.host, port=1)])
+        self.assertEqual(cluster['instances'], 1)
+        self.assertEqual(cluster['instance_usage'], 0.25)
+        self.assertTrue(cluster['reachable'])
+        self.assertTrue(cluster['databases'] >= 2)
+        self.assertTrue(cluster['size'] > 0)
+        self.assertTrue(cluster['connections'] >= 1)
+        self.assertTrue(cluster['max_connections'] > 0)
+        self.assertEqual(cluster['connection_usage'],
+                         float(cluster['connections']) /
+                         cluster['max_connections'])
+
+        self.assertEqual(unreachable['instances'], 0)
+        self.assertFalse(unreachable['reachable'])
+        self.assertEqual(unreachable['size'], None)
+
+    def test_dedicated_report(self):
+        self.app.config['DEDICATED_MEMORY'] = GB
+        info = {'h1': {'MemTotal': 8 * GB, 'NCPU': 4}}
+        with self.app.app_context():
+            hosts = capacity.dedicated_report(scheduler.DockerScheduler(
+                hosts=['tcp://h1:4243', 'tcp://h2:4243'],
+                info=lambda url: info.get(scheduler.extract_hostname(url))))
+        h1, h2 = hosts
+        self.assertEqual(h1['host'], 'h1')
+        self.assertEqual(h1['instances'], 2)
+        self.assertEqual(h1['memory_usage'], 0.25)
+        self.assertEqual(h1['cpus'], 4)
+        self.assertTrue(h1['reachable'])
+        self.assertEqual(h2['instances'], 1)
+        self.assertFalse(h2['reachable'])
+        self.assertEqual(h2['memory_usage'], None)
+
+    def test_admin_capacity(self):
+        client = self.app.test_client()
+        rv = client.get('/admin/capacity', headers={
+            'Authorization': 'Basic ' + b64encode('admin:password')})
+        self.assertEqual(rv.status_code, 200)
+        report = json.loads(rv.data)
+        self.assertEqual([cluster['name'] for cluster in report['shared']],
+                         ['default'])
+        self.assertEqual(report['shared'][0]['instances'], 1)
+        self.assertEqual(report['dedicated'], [])
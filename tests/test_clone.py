@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from base64 import b64encode
+
+from postgresapi import managers
+from postgresapi.models import Instance
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+
+class CloneTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(CloneTestCase, self).setUp()
+        self._drop_test_db()
+        self._drop_test_user()
+        self._drop_clone()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password'))
+        }
+        with self.app.app_context():
+            manager = managers.SharedManager()
+            self.instance = manager.create_instance('databasenotexist')
+            self.username, password = self.instance.create_user('127.0.0.1')
+
+        user_db = self.create_db(dbname='databasenotexist',
+                                 user=self.username, password=password)
+        with user_db.transaction() as cursor:
+            cursor.execute('CREATE TABLE article (name varchar(20))')
+            cursor.execute("INSERT INTO article VALUES ('hello')")
+        user_db.close()
+
+    def tearDown(self):
+        with self.app.app_context():
+            self.instance.drop_user('127.0.0.1')
+        super(CloneTestCase, self).tearDown()
+        self._drop_clone()
+        self._drop_test_db()
+        self._drop_test_user()
+
+    def _drop_clone(self):
+        db = self.create_db()
+        with db.autocommit() as cursor:
+            for sql in ('DROP DATABASE databaseclone',
+                        'DROP ROLE databasecl_group'):
+                try:
+                    cursor.execute(sql)
+                except:
+                    pass
+        db.close()
+
+    def _clone(self, name='databasenotexist', clone='databaseclone'):
+        return self.client.post('/resources/%s/clone' % name,
+                                data={'name': clone}, headers=self.headers)
+
+    def test_clone(self):
+        rv = self._clone()
+        self.assertEqual(rv.status_code, 201)
+
+        with self.app.app_context():
+            clone = InstanceStorage().instance_by_name('databaseclone')
+        self.assertEqual(clone.plan, 'shared')
+        self.assertEqual(clone.state, 'running')
+        self.assertEqual(clone.cluster, self.instance.cluster)
+
+        db = self.create_db(dbname='databaseclone')
+        with db.transaction() as cursor:
+            cursor.execute('SELECT name FROM article')
+            self.assertEqual(cursor.fetchall(), [('hello', )])
+            cursor.execute("SELECT tableowner FROM pg_tables "
+                           "WHERE tablename = 'article'")
+            self.assertEqual(cursor.fetchone(), ('databasecl_group', ))
+            cursor.execute("SELECT datname, pg_get_userbyid(datdba), "
+                           "datallowconn FROM pg_database WHERE datname IN "
+                           "('databasenotexist', 'databaseclone') "
+                           "ORDER BY datname")
+            self.assertEqual(cursor.fetchall(), [
+                ('databaseclone', 'databasecl_group', True),
+                ('databasenotexist', 'databaseno_group', True)])
+        db.close()
+
+        # the source is left untouched
+        db = self.create_db(dbname='databasenotexist')
+        with db.transaction() as cursor:
+            cursor.execute("SELECT tableowner FROM pg_tables "
+                           "WHERE tablename = 'article'")
+            self.assertEqual(cursor.fetchone(), (self.username, ))
+        db.close()
+
+        rv = self._clone()
+        self.assertEqual(rv.status_code, 500)
+        self.assertTrue('already exists' in rv.data)
+
+        with self.app.app_context():
+            managers.SharedManager().delete_instance(clone)
+
+    def test_clone_terminates_sessions(self):
+        db = self.create_db(dbname='databasenotexist')
+        db.connection()
+        try:
+            rv = self._clone()
+            self.assertEqual(rv.status_code, 201)
+            self.assertFalse(db.ping())
+        finally:
+            db.close()
+        with self.app.app_context():
+            managers.SharedManager().delete_instance(
+                Instance('databaseclone', 'shared'))
+
+    def test_clone_waits_for_sessions(self):
+        self.app.config.update(dict(CLONE_TERMINATE_SESSIONS=False,
+                                    CLONE_WAIT_TIMEOUT=0.5))
+        # idle sessions of the admin user are terminated anyway
+        conn = self.create_db(dbname='databasenotexist',
+                              user=self.username).connection()
+        try:
+            rv = self._clone()
+        finally:
+            conn.close()
+            self.app.config.update(dict(CLONE_TERMINATE_SESSIONS=True,
+                                        CLONE_WAIT_TIMEOUT=30))
+        self.assertEqual(rv.status_code, 409)
+        self.assertTrue('still used by 1 session' in rv.data)
+
+        # connections refused during the wait are allowed again
+        db = self.create_db(dbname='databasenotexist')
+        self.assertTrue(db.ping())
+        db.close()
+
+        with self.app.app_context():
+            self.assertFalse(
+                InstanceStorage().instance_exists('databaseclone'))
+
+    def test_clone_cluster_full(self):
+        config = self.app.config
+        config['SHARED_CLUSTERS'] = [{
+            'name': self.instance.cluster, 'host': config['SHARED_HOST'],
+            'port': config['SHARED_PORT'], 'admin': config['SHARED_ADMIN'],
+            'password': config['SHARED_ADMIN_PASSWORD'], 'capacity': 1}]
+        try:
+            rv = self._clone()
+        finally:
+            config['SHARED_CLUSTERS'] = []
+        self.assertEqual(rv.status_code, 409)
+
+        with self.app.app_context():
+            self.assertFalse(
+                InstanceStorage().instance_exists('databaseclone'))
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database "
+                           "WHERE datname = 'databaseclone'")
+            self.assertIsNone(cursor.fetchone())
+        db.close()
+
+    def test_clone_400_404(self):
+        rv = self.client.post('/resources/databasenotexist/clone',
+                              headers=self.headers)
+        self.assertEqual(rv.status_code, 400)
+        rv = self._clone(name='unknowndb')
+        self.assertEqual(rv.status_code, 404)
+
+        with self.app.app_context():
+            InstanceStorage().store(Instance('dedicateddb', 'dedicated',
+                                             state='running'))
+        rv = self._clone(name='dedicateddb')
+        self.assertEqual(rv.status_code, 400)
@@ -1,18 +1,127 @@
 # -*- coding: utf-8 -*-
 
-from postgresapi import managers
+import time
+import socket
+import threading
+
+import mock
+
+from postgresapi import managers, models, scheduler, storage, workers
+from postgresapi.database import get_breaker
 from . import _base
 
 
+class FakeDockerClient(object):
+    base_url = 'tcp://127.0.0.1:4243'
+
+    def __init__(self):
+        self.started = []
+        self.can_start = threading.Event()
+
+    def create_container(self, image, **kwargs):
+        return {'Id': 'f00ba7'}
+
+    def start(self, container_id, **kwargs):
+        self.can_start.wait(5)
+        self.started.append(container_id)
+        raise managers.DockerContainerError('container failed to start')
+
+
+class RunningDockerClient(FakeDockerClient):
+    """Start containers as a role and a database of the test server"""
+
+    def __init__(self, db):
+        super(RunningDockerClient, self).__init__()
+        self.db = db
+
+    def create_container(self, image, environment=None, **kwargs):
+        self.environment = environment
+        return {'Id': 'c0ffee'}
+
+    def start(self, container_id, **kwargs):
+        self.can_start.wait(5)
+        self.started.append(container_id)
+        user = self.environment['POSTGRES_USER']
+        with self.db.autocommit() as cursor:
+            cursor.execute('CREATE ROLE %s WITH SUPERUSER LOGIN '
+                           'PASSWORD %%s' % user,
+                           (self.environment['POSTGRES_PASSWORD'], ))
+            cursor.execute('CREATE DATABASE %s OWNER %s' % (user, user))
+
+
+class LateServer(object):
+    """Forward a free port to the test server, once started"""
+
+    def __init__(self, host, port):
+        self.target = (host, port)
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.listener = None
+
+    def start(self):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', self.port))
+        self.listener.listen(5)
+        self._spawn(self._accept)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.shutdown(socket.SHUT_RDWR)
+            self.listener.close()
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except socket.error:
+                return
+            server = socket.create_connection(self.target)
+            self._spawn(self._pipe, client, server)
+            self._spawn(self._pipe, server, client)
+
+    def _pipe(self, source, destination):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                destination.sendall(data)
+            destination.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+
 class CreateTestCase(_base.TestCase):
 
     def setUp(self):
         super(CreateTestCase, self).setUp()
         self._drop_test_db()
+        self._drop_warm_user()
 
     def tearDown(self):
         super(CreateTestCase, self).tearDown()
         self._drop_test_db()
+        self._drop_warm_user()
+
+    def _dedicated_manager(self, client):
+        manager = managers.DedicatedManager()
+        manager.client = lambda host=None: client
+        manager.scheduler = scheduler.DockerScheduler(
+            hosts=[client.base_url], info=lambda url: {})
+        return manager
+
+    def _drop_warm_user(self):
+        db = self.create_db()
+        with db.autocommit() as cursor:
+            cursor.execute('DROP ROLE IF EXISTS warmtest')
 
     def test_success(self):
         with self.app.app_context():
@@ -21,9 +130,81 @@ class CreateTestCase(_base.TestCase):
 
         db = self.create_db()
         with db.transaction() as cursor:
-            cursor.execute('SELECT name, state, plan FROM instance')
+            cursor.execute('SELECT name, state, plan, cluster FROM instance')
             self.assertEqual(cursor.fetchall(),
-                             [('databasenotexist', 'running', 'shared')])
+                             [('databasenotexist', 'running', 'shared',
+                               'default')])
+
+    def test_spare_database(self):
+        self.app.config['SHARED_SPARE_POOL_SIZE'] = 1
+        try:
+            with self.app.app_context():
+                manager = managers.SharedManager()
+                self.assertEqual(manager.refill_spare_databases(), 1)
+                self.assertEqual(manager.refill_spare_databases(), 0)
+                spare, group, cluster = manager.spare_storage.find_all()[0]
+                self.assertEqual(cluster, 'default')
+
+                manager.create_instance('databasenotexist')
+                workers.get_pool('provisioning', 1).join()
+                self.assertEqual(manager.spare_storage.count_by_cluster(),
+                                 {'default': 1})
+                self.assertNotEqual(manager.spare_storage.find_all()[0][0],
+                                    spare)
+
+            db = self.create_db()
+            with db.transaction() as cursor:
+                cursor.execute(
+                    "SELECT rolname FROM pg_database d JOIN pg_roles r "
+                    "ON r.oid = d.datdba WHERE datname = 'databasenotexist'")
+                self.assertEqual(cursor.fetchall(), [('databaseno_group',)])
+                cursor.execute(
+                    "SELECT 1 FROM pg_database WHERE datname = %s", (spare, ))
+                self.assertEqual(cursor.fetchall(), [])
+        finally:
+            with self.app.app_context():
+                managers.SharedManager().drain_spare_databases()
+            self.app.config['SHARED_SPARE_POOL_SIZE'] = 0
+
+    def test_spare_database_without_cluster(self):
+        db = self.create_db()
+        with db.autocommit() as cursor:
+            cursor.execute('CREATE ROLE spare_old_group WITH NOLOGIN')
+            cursor.execute('CREATE DATABASE spare_old OWNER spare_old_group')
+            cursor.execute("INSERT INTO spare_database (name, group_name) "
+                           "VALUES ('spare_old', 'spare_old_group')")
+
+        with self.app.app_context():
+            manager = managers.SharedManager()
+            self.assertEqual(manager.spare_storage.count_by_cluster(),
+                             {'default': 1})
+            self.assertEqual(manager.spare_storage.find_all(),
+                             [('spare_old', 'spare_old_group', 'default')])
+            self.assertEqual(manager.drain_spare_databases(), ['spare_old'])
+
+        with db.transaction() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database "
+                           "WHERE datname = 'spare_old'")
+            self.assertEqual(cursor.fetchall(), [])
+
+    def test_spare_database_failed(self):
+        self.app.config.update(dict(SHARED_SPARE_POOL_SIZE=1,
+                                    SHARED_SPARE_TEMPLATE='templatenotexist'))
+        try:
+            with self.app.app_context():
+                manager = managers.SharedManager()
+                self.assertEqual(manager.refill_spare_databases(), 0)
+                self.assertEqual(manager.spare_storage.find_all(), [])
+        finally:
+            self.app.config.update(dict(SHARED_SPARE_POOL_SIZE=0,
+                                        SHARED_SPARE_TEMPLATE='template1'))
+
+        # the group role of the spare is dropped with it
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute("SELECT rolname FROM pg_roles "
+                           "WHERE rolname LIKE 'spare\\_%'")
+            self.assertEqual(cursor.fetchall(), [])
 
     def test_already_exists(self):
         db = self.create_db()
@@ -46,3 +227,117 @@ class CreateTestCase(_base.TestCase):
             self.assertRaises(managers.InstanceAlreadyExists,
                               manager.create_instance,
                               'databasenotexist')
+
+    def test_dedicated_provisioned_in_background(self):
+        client = FakeDockerClient()
+        with self.app.app_context():
+            manager = self._dedicated_manager(client)
+            manager.create_instance('databasenotexist')
+            instance = storage.InstanceStorage().instance_by_name(
+                'databasenotexist')
+            self.assertEqual(instance.state, 'pending')
+
+            client.can_start.set()
+            workers.get_pool('provisioning', 1).join()
+            self.assertEqual(client.started, ['f00ba7'])
+            instance = storage.InstanceStorage().instance_by_name(
+                'databasenotexist')
+            self.assertEqual(instance.state, 'error')
+
+    def test_dedicated_provisioned_and_running(self):
+        self.app.config['DEDICATED_PORT_RANGES'] = {
+            '127.0.0.1': [self.port, self.port]}
+        client = RunningDockerClient(self.create_db())
+        try:
+            with self.app.app_context():
+                manager = self._dedicated_manager(client)
+                manager.create_instance('databasenotexist')
+                instance = storage.InstanceStorage().instance_by_name(
+                    'databasenotexist')
+                self.assertEqual(instance.state, 'pending')
+
+                client.can_start.set()
+                workers.get_pool('provisioning', 1).join()
+                self.assertEqual(client.started, ['c0ffee'])
+                instance = storage.InstanceStorage().instance_by_name(
+                    'databasenotexist')
+                self.assertEqual(instance.state, 'running')
+                self.assertEqual(instance.port, self.port)
+                self.assertTrue(instance.is_up())
+        finally:
+            self.app.config['DEDICATED_PORT_RANGES'] = {}
+            self._drop_test_db()
+            db = self.create_db()
+            with db.autocommit() as cursor:
+                cursor.execute('DROP DATABASE IF EXISTS databaseno90ae84')
+            self._drop_test_user()
+
+    def test_dedicated_waits_for_a_late_server(self):
+        server = LateServer(self.host, self.port)
+        container = models.WarmContainer(
+            container_id='c0ffee', host='127.0.0.1', port=server.port,
+            username=self.user, password=self.password)
+        threshold = self.app.config['CLUSTER_BREAKER_THRESHOLD']
+        tries = []
+        sleep = time.sleep
+
+        def wait(seconds):
+            tries.append(seconds)
+            if len(tries) == threshold + 1:
+                server.start()
+            sleep(0.01)
+
+        try:
+            with self.app.app_context(), \
+                    mock.patch.object(managers.time, 'sleep', wait):
+                manager = managers.DedicatedManager()
+                # refused connections of a starting server are not failures
+                self.assertTrue(manager.is_up(container,
+                                              max_try=threshold + 3))
+                self.assertEqual(len(tries), threshold + 1)
+                self.assertEqual(
+                    get_breaker('127.0.0.1', server.port).state, 'closed')
+                self.assertTrue(container.cluster_manager.is_up(self.user))
+        finally:
+            server.stop()
+
+    def test_dedicated_client_for(self):
+        client = FakeDockerClient()
+        with self.app.app_context():
+            manager = managers.DedicatedManager()
+            manager.scheduler = scheduler.DockerScheduler(
+                hosts=['tcp://h1:4243', 'tcp://h2:4243'], info=lambda url: {})
+            manager.client = lambda host=None: (host, client)
+            self.assertEqual(manager.client_for('h2'),
+                             ('tcp://h2:4243', client))
+            self.assertEqual(manager.client_for(None), (None, client))
+            self.assertRaises(managers.DockerHostNotConfigured,
+                              manager.client_for, 'h3')
+
+    def test_dedicated_claims_warm_container(self):
+        db = self.create_db()
+        with db.autocommit() as cursor:
+            cursor.execute("CREATE ROLE warmtest WITH SUPERUSER LOGIN "
+                           "PASSWORD 'warmpass'")
+
+        client = FakeDockerClient()
+        with self.app.app_context():
+            warm_storage = storage.WarmContainerStorage()
+            warm_storage.store(models.WarmContainer(
+                container_id='c0ffee', host='127.0.0.1', port=self.port,
+                username='warmtest', password='warmpass'))
+            self.assertEqual(warm_storage.count_by_host(), {'127.0.0.1': 1})
+
+            manager = self._dedicated_manager(client)
+            instance = manager.create_instance('databasenotexist')
+            self.assertEqual(instance.container_id, 'c0ffee')
+            self.assertEqual(instance.username, 'warmtest')
+            self.assertEqual(warm_storage.find_all(), [])
+
+            workers.get_pool('provisioning', 1).join()
+            self.assertEqual(client.started, [])
+            instance = storage.InstanceStorage().instance_by_name(
+                'databasenotexist')
+            self.assertEqual(instance.state, 'running')
+            self.assertEqual(instance.port, self.port)
+            self.assertTrue(instance.is_up())
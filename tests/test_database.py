@@ -1,7 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import json
+import time
+import select
+import logging
+import threading
 import psycopg2
+
+import mock
+
+from base64 import b64encode
+
 from postgresapi import plans
+from postgresapi.database import (ConnectionPool, PoolTimeout, Database,
+                                  CircuitBreaker, CircuitOpen,
+                                  ConnectionLimit, Listener, tracer,
+                                  redact, slow_logger)
+from postgresapi.models import get_cluster_manager
 from postgresapi.models import canonicalize_db_name
 
 from . import _base
@@ -120,6 +135,338 @@ class DatabaseTestCase(_base.TestCase):
                 cursor1.fetchall(),
                 [(1,), (2,), (3,), (4,), (5,)])
 
+    def test_pool_checkout(self):
+        pool = ConnectionPool(self.create_conn, minconn=1, maxconn=2,
+                              timeout=0.1)
+        try:
+            self.assertEqual(pool.size, 1)
+            with pool.connection() as conn0:
+                with pool.connection() as conn1:
+                    self.assertTrue(conn0 is conn1)
+                conn2 = pool.getconn()
+                self.assertFalse(conn0 is conn2)
+                self.assertEqual(pool.size, 2)
+                self.assertRaises(PoolTimeout, pool.getconn)
+                pool.putconn(conn2)
+            self.assertTrue(pool.getconn() in (conn0, conn2))
+        finally:
+            pool.closeall()
+
+    def test_pool_health_check(self):
+        pool = ConnectionPool(self.create_conn, maxconn=1,
+                              check_interval=0)
+        try:
+            conn = pool.getconn()
+            pid = conn.get_backend_pid()
+            pool.putconn(conn)
+
+            killer = self.create_conn()
+            cursor = killer.cursor()
+            cursor.execute('SELECT pg_terminate_backend(%s)', (pid, ))
+            killer.commit()
+            killer.close()
+
+            conn = pool.getconn()
+            self.assertNotEqual(conn.get_backend_pid(), pid)
+            self.assertEqual(pool.size, 1)
+            pool.putconn(conn)
+        finally:
+            pool.closeall()
+
+    def test_pool_closed_checkin(self):
+        pool = ConnectionPool(self.create_conn, maxconn=2,
+                              check_interval=3600)
+        try:
+            conn0, conn1 = pool.getconn(), pool.getconn()
+            pids = [conn0.get_backend_pid(), conn1.get_backend_pid()]
+            pool.putconn(conn1)
+
+            killer = self.create_conn()
+            cursor = killer.cursor()
+            cursor.execute('SELECT pg_terminate_backend(pid) '
+                           'FROM unnest(%s) AS pid', (pids, ))
+            killer.commit()
+            killer.close()
+
+            self.assertRaises(psycopg2.OperationalError,
+                              conn0.cursor().execute, 'SELECT 1')
+            self.assertTrue(conn0.closed)
+            pool.putconn(conn0)
+
+            # the other idle connection is pinged, though it was just used
+            conn = pool.getconn()
+            self.assertFalse(conn.get_backend_pid() in pids)
+            self.assertEqual(pool.size, 1)
+            pool.putconn(conn)
+        finally:
+            pool.closeall()
+
+    def test_pool_max_lifetime(self):
+        pool = ConnectionPool(self.create_conn, maxconn=1, max_lifetime=0)
+        try:
+            conn = pool.getconn()
+            pool.putconn(conn)
+            self.assertTrue(conn.closed)
+            self.assertEqual(pool.size, 0)
+        finally:
+            pool.closeall()
+
+    def test_pool_evict_idle(self):
+        pool = ConnectionPool(self.create_conn, minconn=1, maxconn=2,
+                              idle_timeout=0)
+        try:
+            conn0, conn1 = pool.getconn(), pool.getconn()
+            pool.putconn(conn0)
+            pool.putconn(conn1)
+            pool.evict_idle()
+            self.assertEqual(pool.size, 1)
+            self.assertTrue(conn0.closed)
+            self.assertFalse(conn1.closed)
+        finally:
+            pool.closeall()
+
+    def test_connection_limit(self):
+        limit = ConnectionLimit(1, timeout=0.1)
+        pool0 = ConnectionPool(self.create_conn, maxconn=2, limit=limit)
+        pool1 = ConnectionPool(self.create_conn, maxconn=2, limit=limit)
+        try:
+            conn0 = pool0.getconn()
+            pool0.putconn(conn0)
+            # the idle connection of the other pool makes room
+            conn1 = pool1.getconn()
+            self.assertTrue(conn0.closed)
+            self.assertEqual((pool0.size, pool1.size, limit.size), (0, 1, 1))
+            self.assertRaises(PoolTimeout, pool0.getconn)
+            self.assertEqual(pool0.size, 0)
+            pool1.putconn(conn1)
+        finally:
+            pool0.closeall()
+            pool1.closeall()
+        self.assertEqual(limit.size, 0)
+
+    def test_cluster_oneoff(self):
+        with self.app.app_context():
+            manager = get_cluster_manager(self.host, self.port, self.user,
+                                          self.password)
+            size = manager.limit.size
+            self.assertTrue(self.database in manager.database_stats())
+            self.assertTrue(manager.max_connections() > 0)
+            # no connection is kept
+            self.assertEqual(manager.dbs, {})
+            self.assertEqual(manager.limit.size, size)
+
+    def test_listener_keepalive(self):
+        received = threading.Event()
+        payloads = []
+        real_select = select.select
+
+        def callback(payload):
+            payloads.append(payload)
+            received.set()
+
+        def timed_out_select(rlist, wlist, xlist, timeout):
+            if payloads or not rlist:
+                return real_select(rlist, wlist, xlist, timeout)
+            select.select = real_select
+            conn = self.create_conn()
+            conn.autocommit = True
+            conn.cursor().execute("NOTIFY test_keepalive, 'late'")
+            conn.close()
+            # the notification is waiting on the socket, as if it came
+            # right after select() gave up
+            time.sleep(0.2)
+            return [], [], []
+
+        listener = Listener(self.create_conn, 'test_keepalive', callback,
+                            poll_interval=1)
+        with mock.patch.object(select, 'select', timed_out_select):
+            listener.start()
+            try:
+                # read along with the keepalive, not left for later
+                self.assertTrue(received.wait(0.8))
+                self.assertEqual(payloads, ['late'])
+            finally:
+                listener.stop()
+
+    def test_cluster_manager_registry(self):
+        with self.app.app_context():
+            manager = get_cluster_manager(self.host, self.port, self.user,
+                                          self.password)
+            self.assertTrue(manager is get_cluster_manager(
+                self.host, self.port, self.user, self.password))
+            self.assertTrue(manager.is_up(self.database))
+            conn = manager.db(self.database).pool.getconn()
+            manager.db(self.database).pool.putconn(conn)
+            self.assertTrue(manager.is_up(self.database))
+            with manager.db(self.database).pool.connection() as reused:
+                self.assertTrue(reused is conn)
+
+            other = get_cluster_manager(self.host, self.port, self.user,
+                                        self.password + 'changed')
+            self.assertFalse(other is manager)
+            self.assertTrue(conn.closed)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker('localhost', 1, threshold=2,
+                                 reset_timeout=0.1)
+        db = Database('postgres', self.user, self.password, 'localhost', 1,
+                      breaker=breaker)
+        for i in xrange(2):
+            self.assertEqual(breaker.state, 'closed')
+            self.assertRaises(psycopg2.OperationalError, db.connect)
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(CircuitOpen, db.connect)
+        self.assertFalse(db.ping())
+
+        time.sleep(0.1)
+        self.assertEqual(breaker.state, 'half-open')
+        breaker.before()
+        # only one trial connection is let through
+        self.assertRaises(CircuitOpen, breaker.before)
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+
+        time.sleep(0.1)
+        db.port = self.port
+        self.assertTrue(db.ping())
+        self.assertEqual(breaker.to_dict(), {'state': 'closed',
+                                             'failures': 0,
+                                             'opened_at': None})
+
+    def test_circuit_breaker_auth_errors(self):
+        breaker = CircuitBreaker(self.host, self.port, threshold=1)
+        db = Database('databasenotexist', self.user, self.password,
+                      self.host, self.port, breaker=breaker)
+        self.assertRaises(psycopg2.OperationalError, db.connect)
+        # the server answered, it is not unreachable
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_pool_circuit_breaker(self):
+        breaker = CircuitBreaker(self.host, self.port, threshold=1,
+                                 reset_timeout=0.1)
+        db = Database(self.database, self.user, self.password, self.host,
+                      self.port, breaker=breaker)
+        db.pool = ConnectionPool(db.connect, maxconn=1, check_interval=0,
+                                 breaker=breaker)
+        try:
+            with db.transaction() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                pid = cursor.fetchone()[0]
+            killer = self.create_conn()
+            cursor = killer.cursor()
+            cursor.execute('SELECT pg_terminate_backend(%s)', (pid, ))
+            killer.commit()
+
+            # the failed ping of the idle connection opens the breaker
+            self.assertRaises(CircuitOpen, db.pool.getconn)
+            self.assertEqual(breaker.state, 'open')
+            self.assertEqual(db.pool.size, 0)
+
+            time.sleep(0.1)
+            with db.transaction() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                pid = cursor.fetchone()[0]
+            self.assertEqual(breaker.state, 'closed')
+
+            # so does a statement losing its connection
+            def select():
+                with db.transaction() as cursor:
+                    cursor.execute('SELECT 1')
+            cursor = killer.cursor()
+            cursor.execute('SELECT pg_terminate_backend(%s)', (pid, ))
+            killer.commit()
+            killer.close()
+            db.pool.check_interval = 3600
+            self.assertRaises(psycopg2.OperationalError, select)
+            self.assertEqual(breaker.state, 'open')
+        finally:
+            db.pool.closeall()
+
+    def test_keepalives(self):
+        db = self.create_db()
+        db.keepalives = {'keepalives_idle': 30, 'keepalives_interval': 10,
+                         'keepalives_count': 0, 'tcp_user_timeout': 0}
+        conn = db.connect()
+        try:
+            params = conn.get_dsn_parameters()
+            self.assertEqual(params['keepalives_idle'], '30')
+            self.assertEqual(params['keepalives_interval'], '10')
+            self.assertFalse('keepalives_count' in params)
+        finally:
+            conn.close()
+
+    def test_cluster_breakers(self):
+        self.app.config['CLUSTER_BREAKER_THRESHOLD'] = 1
+        try:
+            with self.app.app_context():
+                manager = get_cluster_manager('localhost', 1, self.user,
+                                              self.password)
+                self.assertFalse(manager.is_up('postgres'))
+                self.assertRaises(CircuitOpen, manager.db().connect)
+        finally:
+            self.app.config['CLUSTER_BREAKER_THRESHOLD'] = 5
+
+        rv = self.app.test_client().get('/admin/breakers', headers={
+            'Authorization': 'Basic ' + b64encode('admin:password')})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(json.loads(rv.data)['localhost:1']['state'],
+                         'open')
+
+    def test_tracing(self):
+        db = self.create_db()
+        tracer.start()
+        try:
+            with db.transaction() as cursor:
+                cursor.execute("SELECT 'secret', %s", ('password', ))
+            with db.autocommit() as cursor:
+                cursor.execute("SELECT 'it''s', 1")
+            traces = tracer.traces()
+        finally:
+            tracer.stop()
+        self.assertEqual([t['sql'] for t in traces],
+                         ['SELECT ?, %s', 'SELECT ?, 1'])
+        self.assertEqual(traces[0]['host'], self.host)
+        self.assertEqual(traces[0]['database'], self.database)
+        self.assertTrue(traces[0]['duration'] >= 0)
+        self.assertEqual(tracer.traces(), [])
+        self.assertEqual(redact('x' * 10, limit=4), 'xxxx...')
+
+    def test_slow_log(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        slow_logger.addHandler(handler)
+        threshold, tracer.slow_threshold = tracer.slow_threshold, 0.05
+        try:
+            with self.create_db().transaction() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.execute("SELECT pg_sleep(0.1), 'secret'")
+        finally:
+            tracer.slow_threshold = threshold
+            slow_logger.removeHandler(handler)
+        self.assertEqual(len(records), 1)
+        message = records[0].getMessage()
+        self.assertTrue('SELECT pg_sleep(0.1), ?' in message)
+        self.assertFalse('secret' in message)
+
+    def test_trace_header(self):
+        headers = {'Authorization': 'Basic ' + b64encode('admin:password'),
+                   'X-Debug-Trace': '1'}
+        client = self.app.test_client()
+        rv = client.get('/resources/databasenotexist/status',
+                        headers=headers)
+        self.assertFalse('X-Debug-Trace' in rv.headers)
+
+        self.app.config['TRACE_HEADER'] = True
+        try:
+            rv = client.get('/resources/databasenotexist/status',
+                            headers=headers)
+        finally:
+            self.app.config['TRACE_HEADER'] = False
+        traces = json.loads(rv.headers['X-Debug-Trace'])
+        self.assertEqual(len(traces), 1)
+        self.assertTrue(traces[0]['sql'].startswith('SELECT state'))
+
     def test_canonicalize_db_name(self):
         with self.app.app_context():
             self.assertEqual(
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+import zlib
+import unittest
+from base64 import b64encode
+
+from postgresapi import database, managers
+from postgresapi.models import Instance
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+
+@unittest.skipIf(_base.pg_bin_missing('pg_dump'), 'pg_dump is not found')
+class ExportTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self._drop_test_db()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password'))
+        }
+        with self.app.app_context():
+            self.instance = managers.SharedManager().create_instance(
+                'databasenotexist')
+        db = self.create_db(dbname='databasenotexist')
+        with db.transaction() as cursor:
+            cursor.execute('CREATE TABLE article (name varchar(20))')
+            cursor.execute("INSERT INTO article VALUES ('hello')")
+        db.close()
+
+    def tearDown(self):
+        super(ExportTestCase, self).tearDown()
+        self._drop_test_db()
+
+    def _export(self, name='databasenotexist', **params):
+        return self.client.get('/resources/%s/export' % name,
+                               query_string=params, headers=self.headers)
+
+    def test_export_plain(self):
+        rv = self._export()
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.headers['Content-Disposition'],
+                         'attachment; filename="databasenotexist.sql"')
+        self.assertTrue('CREATE TABLE public.article' in rv.data)
+        self.assertTrue('hello' in rv.data)
+
+    def test_export_custom_gzip(self):
+        rv = self._export(format='custom', compress='gzip')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.headers['Content-Disposition'],
+                         'attachment; filename="databasenotexist.dump.gz"')
+        dump = zlib.decompress(rv.data, 16 + zlib.MAX_WBITS)
+        self.assertTrue(dump.startswith('PGDMP'))
+
+    @unittest.skipIf(database.zstandard is None, 'zstandard is missing')
+    def test_export_zstd(self):
+        rv = self._export(compress='zstd')
+        self.assertEqual(rv.status_code, 200)
+        dump = database.zstandard.ZstdDecompressor().decompressobj() \
+            .decompress(rv.data)
+        self.assertTrue('hello' in dump)
+
+    def test_export_400_404_412(self):
+        self.assertEqual(self._export(format='tar').status_code, 400)
+        self.assertEqual(self._export(compress='bzip2').status_code, 400)
+        self.assertEqual(self._export(name='unknowndb').status_code, 404)
+
+        with self.app.app_context():
+            InstanceStorage().store(Instance('pendingdb', 'shared'))
+        self.assertEqual(self._export(name='pendingdb').status_code, 412)
+
+    def test_export_500(self):
+        self.app.config['SHARED_ADMIN'] = 'unknownuser'
+        try:
+            rv = self._export()
+        finally:
+            self.app.config['SHARED_ADMIN'] = self.user
+        self.assertEqual(rv.status_code, 500)
+        self.assertTrue('unknownuser' in rv.data)
+
+    def test_export_is_cancelled(self):
+        with self.app.app_context():
+            chunks = self.instance.export(
+                pg_dump=os.path.join(self.app.config['PG_BIN_DIR'],
+                                     'pg_dump'),
+                chunk_size=16)
+        self.assertEqual(len(next(chunks)), 16)
+        chunks.close()
+        self.assertRaises(StopIteration, next, chunks)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import unittest
+from base64 import b64encode
+from StringIO import StringIO
+
+from postgresapi import managers
+from postgresapi.models import Instance
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+
+class ImportTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(ImportTestCase, self).setUp()
+        self._drop_test_db()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password'))
+        }
+        with self.app.app_context():
+            self.instance = managers.SharedManager().create_instance(
+                'databasenotexist')
+        self.db = self.create_db(dbname='databasenotexist')
+        with self.db.transaction() as cursor:
+            cursor.execute('CREATE TABLE "Article" (id integer, '
+                           'name varchar(20))')
+            cursor.execute('ALTER TABLE "Article" OWNER TO databaseno_group')
+
+    def tearDown(self):
+        self.db.close()
+        super(ImportTestCase, self).tearDown()
+        self._drop_test_db()
+
+    def _import(self, data, name='databasenotexist', **params):
+        return self.client.post('/resources/%s/import' % name,
+                                query_string=params, data=data,
+                                headers=self.headers)
+
+    def _articles(self):
+        with self.db.transaction() as cursor:
+            cursor.execute('SELECT id, name FROM "Article" ORDER BY id')
+            return cursor.fetchall()
+
+    def test_import_csv(self):
+        rv = self._import('id,name\n1,hello\n2,"a, b"\n', table='Article',
+                          header='true')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(json.loads(rv.data), {'rows': 2})
+        self.assertEqual(self._articles(), [(1, 'hello'), (2, 'a, b')])
+
+        rv = self._import('world\n', table='public.Article', columns='name')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(self._articles()[-1], (None, 'world'))
+
+    def test_import_csv_as_group(self):
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                'CREATE FUNCTION article_user() RETURNS trigger AS $$ '
+                'BEGIN NEW.name := current_user; RETURN NEW; END '
+                '$$ LANGUAGE plpgsql; '
+                'CREATE TRIGGER article_user BEFORE INSERT ON "Article" '
+                'FOR EACH ROW EXECUTE PROCEDURE article_user()')
+        rv = self._import('1,hello\n', table='Article')
+        self.assertEqual(rv.status_code, 200)
+        # triggers of the apps do not run as the admin
+        self.assertEqual(self._articles(), [(1, 'databaseno_group')])
+
+        with self.db.transaction() as cursor:
+            cursor.execute('CREATE TABLE secret (name varchar(20))')
+        rv = self._import('hello\n', table='secret')
+        self.assertEqual(rv.status_code, 400)
+        self.assertTrue('permission denied' in rv.data)
+
+    def test_import_csv_in_chunks(self):
+        data = ''.join('%d,name%d\n' % (i, i) for i in range(1000))
+        with self.app.app_context():
+            rows = self.instance.import_csv('Article', StringIO(data),
+                                            chunk_size=100)
+        self.assertEqual(rows, 1000)
+        self.assertEqual(len(self._articles()), 1000)
+
+    def test_import_csv_400(self):
+        rv = self._import('1,hello\n')
+        self.assertEqual(rv.status_code, 400)
+        rv = self._import('1,hello\n', table='Article', format='xml')
+        self.assertEqual(rv.status_code, 400)
+        rv = self._import('1,hello\n', table='article; DROP TABLE x')
+        self.assertEqual(rv.status_code, 400)
+        self.assertTrue('does not exist' in rv.data)
+        # the whole load is rolled back on bad rows
+        rv = self._import('1,hello\nnot a number,world\n', table='Article')
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(self._articles(), [])
+
+    def test_import_404_412(self):
+        rv = self._import('1,hello\n', name='unknowndb', table='Article')
+        self.assertEqual(rv.status_code, 404)
+        with self.app.app_context():
+            InstanceStorage().store(Instance('pendingdb', 'shared'))
+        rv = self._import('1,hello\n', name='pendingdb', table='Article')
+        self.assertEqual(rv.status_code, 412)
+
+    @unittest.skipIf(_base.pg_bin_missing('pg_dump') or
+                     _base.pg_bin_missing('pg_restore'),
+                     'pg_dump or pg_restore is not found')
+    def test_import_custom(self):
+        with self.db.transaction() as cursor:
+            cursor.execute("CREATE TABLE article (name varchar(20)); "
+                           "INSERT INTO article VALUES ('hello')")
+        with self.app.app_context():
+            pg_dump = os.path.join(self.app.config['PG_BIN_DIR'], 'pg_dump')
+            dump = ''.join(self.instance.export(format='custom',
+                                                pg_dump=pg_dump))
+        with self.db.transaction() as cursor:
+            cursor.execute('DROP TABLE article, "Article"')
+
+        rv = self._import(dump, format='custom')
+        self.assertEqual(rv.status_code, 204, rv.data)
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT name FROM article")
+            self.assertEqual(cursor.fetchall(), [('hello', )])
+            cursor.execute("SELECT tableowner FROM pg_tables "
+                           "WHERE tablename = 'article'")
+            self.assertEqual(cursor.fetchone(), ('databaseno_group', ))
+
+        # objects already there make the whole restore fail
+        rv = self._import(dump, format='custom')
+        self.assertEqual(rv.status_code, 500)
+        self.assertTrue('already exists' in rv.data)
+
+        rv = self._import('not a dump', format='custom')
+        self.assertEqual(rv.status_code, 500)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from base64 import b64encode
+
+import mock
+import psycopg2
+
+from postgresapi.models import Instance
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+
+class ListTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(ListTestCase, self).setUp()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password'))
+        }
+        with self.app.app_context():
+            InstanceStorage().store_many([
+                Instance('db%02d' % i, 'shared', state='running')
+                for i in xrange(10)
+            ] + [
+                Instance('dedicated', 'dedicated', state='pending',
+                         host='10.0.0.1', port=40112, username='admin',
+                         password='secret')
+            ])
+
+    def _list(self, query=''):
+        rv = self.client.get('/resources' + query, headers=self.headers)
+        self.assertEqual(rv.status_code, 200)
+        return json.loads(rv.data)
+
+    def test_list(self):
+        listing = self._list()
+        names = [i['name'] for i in listing['instances']]
+        self.assertEqual(names, ['db%02d' % i for i in xrange(10)] +
+                         ['dedicated'])
+        self.assertIsNone(listing['next'])
+        self.assertEqual(listing['instances'][-1], {
+            'name': 'dedicated', 'plan': 'dedicated', 'state': 'pending',
+            'host': '10.0.0.1', 'port': 40112, 'cluster': None})
+
+    def test_pages(self):
+        names = []
+        after = ''
+        pages = 0
+        while after is not None:
+            listing = self._list('?limit=4&after=' + after)
+            names.extend(i['name'] for i in listing['instances'])
+            after = listing['next']
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(names), 11)
+        self.assertEqual(names, sorted(names))
+
+    def test_filters(self):
+        listing = self._list('?plan=dedicated')
+        self.assertEqual([i['name'] for i in listing['instances']],
+                         ['dedicated'])
+        listing = self._list('?state=running&host=10.0.0.1')
+        self.assertEqual(listing['instances'], [])
+        listing = self._list('?host=10.0.0.1')
+        self.assertEqual(len(listing['instances']), 1)
+
+    def test_400(self):
+        for query in ('?limit=0', '?limit=a', '?state=stopped',
+                      '?plan=bogus'):
+            rv = self.client.get('/resources' + query, headers=self.headers)
+            self.assertEqual(rv.status_code, 400)
+
+    def test_500(self):
+        def iter_instances(*args, **kwargs):
+            raise psycopg2.OperationalError('server closed the connection')
+            yield
+
+        with mock.patch.object(InstanceStorage, 'iter_instances',
+                               iter_instances):
+            rv = self.client.get('/resources', headers=self.headers)
+        # rather than a 200 with a truncated listing
+        self.assertEqual(rv.status_code, 500)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from base64 import b64encode
+
+from postgresapi import managers
+from postgresapi.database import ConnectionPool, Database
+from . import _base
+
+
+class MetricsTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self._drop_test_db()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password'))
+        }
+
+    def tearDown(self):
+        super(MetricsTestCase, self).tearDown()
+        self._drop_test_db()
+
+    def _metrics(self):
+        rv = self.client.get('/metrics', headers=self.headers)
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.content_type.startswith('text/plain'))
+        samples = {}
+        for line in rv.data.splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def _sample(self, samples, name, **labels):
+        key = '%s{%s}' % (name, ','.join(
+            '%s="%s"' % item for item in sorted(labels.items())))
+        return samples.get(key, 0)
+
+    def test_requests(self):
+        before = self._metrics()
+        self.client.get('/plans', headers=self.headers)
+        self.client.get('/resources/databasenotexist/status',
+                        headers=self.headers)
+        after = self._metrics()
+
+        name = 'postgresapi_http_requests_total'
+        labels = dict(method='GET', route='/plans', status='200')
+        self.assertEqual(self._sample(after, name, **labels) -
+                         self._sample(before, name, **labels), 1)
+        labels = dict(method='GET', route='/resources/<name>/status',
+                      status='404')
+        self.assertEqual(self._sample(after, name, **labels) -
+                         self._sample(before, name, **labels), 1)
+
+        name = 'postgresapi_http_request_duration_seconds_count'
+        labels = dict(method='GET', route='/plans')
+        self.assertEqual(self._sample(after, name, **labels) -
+                         self._sample(before, name, **labels), 1)
+
+    def test_sql_and_provisioning(self):
+        before = self._metrics()
+        with self.app.app_context():
+            managers.SharedManager().create_instance('databasenotexist')
+        after = self._metrics()
+
+        for name, labels in (
+                ('postgresapi_sql_duration_seconds_count',
+                 dict(operation='create_database')),
+                ('postgresapi_sql_duration_seconds_count',
+                 dict(operation='instance_store')),
+                ('postgresapi_provisioning_duration_seconds_count',
+                 dict(plan='shared', result='running'))):
+            self.assertEqual(self._sample(after, name, **labels) -
+                             self._sample(before, name, **labels), 1)
+
+    def test_pool(self):
+        pool = ConnectionPool(self.create_conn, maxconn=2, name='test')
+        try:
+            conn = pool.getconn()
+            samples = self._metrics()
+            name = 'postgresapi_pool_connections'
+            self.assertEqual(
+                self._sample(samples, name, pool='test', state='open'), 1)
+            self.assertEqual(
+                self._sample(samples, name, pool='test', state='in_use'), 1)
+            self.assertEqual(self._sample(
+                samples, 'postgresapi_pool_wait_seconds_count', pool='test'),
+                1)
+
+            pool.putconn(conn)
+            samples = self._metrics()
+            self.assertEqual(
+                self._sample(samples, name, pool='test', state='open'), 1)
+            self.assertEqual(
+                self._sample(samples, name, pool='test', state='in_use'), 0)
+        finally:
+            pool.closeall()
+        samples = self._metrics()
+        self.assertEqual(
+            self._sample(samples, name, pool='test', state='open'), 0)
+
+    def test_sql_duration_of_server_side_cursor(self):
+        db = Database(self.database, self.user, self.password, self.host,
+                      self.port)
+        name = 'postgresapi_sql_duration_seconds_sum'
+        before = self._metrics()
+        with db.transaction(cursor_name='rows', operation='test') as cursor:
+            cursor.itersize = 1
+            cursor.execute('SELECT generate_series(1, 3)')
+            for row in cursor:
+                # the time spent on the rows is not the server's
+                time.sleep(0.1)
+        after = self._metrics()
+        db.close()
+        self.assertEqual(row, (3, ))
+        self.assertTrue(self._sample(after, name, operation='test') -
+                        self._sample(before, name, operation='test') < 0.1)
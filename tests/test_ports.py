@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from postgresapi import storage
+from . import _base
+
+
+class PortAllocatorTestCase(_base.TestCase):
+
+    def test_allocate(self):
+        with self.app.app_context():
+            ports = storage.PortAllocator()
+            self.assertEqual(ports.allocate('h1', 'a', 40000, 40002), 40000)
+            self.assertEqual(ports.allocate('h1', 'b', 40000, 40002), 40001)
+            self.assertEqual(ports.allocate('h2', 'c', 40000, 40002), 40000)
+            self.assertEqual(ports.allocate('h1', 'd', 40000, 40002), 40002)
+            self.assertRaises(storage.PortRangeExhausted,
+                              ports.allocate, 'h1', 'e', 40000, 40002)
+
+    def test_reuse_released(self):
+        with self.app.app_context():
+            ports = storage.PortAllocator()
+            for owner in 'abcd':
+                ports.allocate('h1', owner, 40000, 40010)
+            ports.release('h1', 40002)
+            ports.release('h1', 40001)
+            self.assertEqual(ports.allocate('h1', 'e', 40000, 40010), 40001)
+            self.assertEqual(ports.allocate('h1', 'f', 40000, 40010), 40002)
+            self.assertEqual(ports.allocate('h1', 'g', 40000, 40010), 40004)
+
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute('SELECT port, owner FROM port_allocation '
+                           'ORDER BY port')
+            self.assertEqual(cursor.fetchall(), [
+                (40000, 'a'), (40001, 'e'), (40002, 'f'), (40003, 'd'),
+                (40004, 'g')])
+
+    def test_transfer(self):
+        with self.app.app_context():
+            ports = storage.PortAllocator()
+            port = ports.allocate('h1', 'warm', 40000, 40010)
+            ports.transfer('h1', port, 'instance')
+
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute('SELECT owner FROM port_allocation')
+            self.assertEqual(cursor.fetchall(), [('instance',)])
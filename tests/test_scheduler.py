@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from postgresapi import scheduler
+from postgresapi.models import (SharedCluster, Instance,
+                                InvalidInstanceConfiguration)
+from . import _base
+
+GB = 1024 ** 3
+
+
+class SchedulerTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(SchedulerTestCase, self).setUp()
+        self.app.config.update(DEDICATED_PORT_RANGES={
+            'h3': [40000, 40001]})
+        db = self.create_db()
+        with db.transaction() as cursor:
+            for name, host, port in [('i1', 'h1', 40000),
+                                     ('i2', 'h1', 40001),
+                                     ('i3', 'h2', 40000),
+                                     ('i4', 'h3', 40000),
+                                     ('i5', 'h3', 40001)]:
+                cursor.execute(
+                    "INSERT INTO instance (name, state, plan, host, port) "
+                    "VALUES (%s, 'running', 'dedicated', %s, %s)",
+                    (name, host, port))
+                cursor.execute(
+                    "INSERT INTO port_allocation (host, port, owner) "
+                    "VALUES (%s, %s, %s)", (host, port, name))
+
+    def tearDown(self):
+        self.app.config.update(DEDICATED_PORT_RANGES={}, DEDICATED_MEMORY=0)
+        super(SchedulerTestCase, self).tearDown()
+
+    def _scheduler(self, info):
+        return scheduler.DockerScheduler(
+            hosts=['tcp://h1:4243', 'tcp://h2:4243', 'tcp://h3:4243'],
+            info=lambda url: info.get(scheduler.extract_hostname(url)))
+
+    def test_least_instances(self):
+        with self.app.app_context():
+            s = self._scheduler({'h1': {}, 'h2': {}, 'h3': {}})
+            loads = dict((load.hostname, load) for load in s.loads())
+            self.assertEqual(loads['h1'].instances, 2)
+            self.assertEqual(loads['h3'].free_ports, 0)
+            self.assertEqual(s.choose(), 'tcp://h2:4243')
+            self.assertEqual(s.url_of('h1'), 'tcp://h1:4243')
+
+    def test_unreachable_host(self):
+        with self.app.app_context():
+            s = self._scheduler({'h1': {}, 'h3': {}})
+            self.assertEqual(s.choose(), 'tcp://h1:4243')
+
+    def test_memory(self):
+        self.app.config['DEDICATED_MEMORY'] = GB
+        with self.app.app_context():
+            s = self._scheduler({'h1': {'MemTotal': 8 * GB},
+                                 'h2': {'MemTotal': 1 * GB},
+                                 'h3': {'MemTotal': 8 * GB}})
+            self.assertEqual(s.choose(), 'tcp://h1:4243')
+
+    def test_no_host_available(self):
+        with self.app.app_context():
+            s = self._scheduler({'h3': {}})
+            self.assertRaises(scheduler.NoHostAvailable, s.choose)
+
+
+class SharedSchedulerTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(SharedSchedulerTestCase, self).setUp()
+        db = self.create_db()
+        with db.transaction() as cursor:
+            for name, cluster in [('i1', None), ('i2', 'pg1'),
+                                  ('i3', 'pg2'), ('i4', 'pg2'),
+                                  ('i5', 'pg3')]:
+                cursor.execute(
+                    "INSERT INTO instance (name, state, plan, cluster) "
+                    "VALUES (%s, 'running', 'shared', %s)", (name, cluster))
+
+    def tearDown(self):
+        self.app.config['SHARED_CLUSTERS'] = []
+        super(SharedSchedulerTestCase, self).tearDown()
+
+    def test_least_loaded(self):
+        clusters = [SharedCluster('pg1'),
+                    SharedCluster('pg2', weight=4),
+                    SharedCluster('pg3', capacity=1)]
+        with self.app.app_context():
+            s = scheduler.SharedScheduler(clusters)
+            self.assertEqual([count for cluster, count in s.loads()],
+                             [2, 2, 1])
+            self.assertEqual(s.choose().name, 'pg2')
+
+    def test_no_cluster_available(self):
+        clusters = [SharedCluster('pg1', capacity=2),
+                    SharedCluster('pg2', weight=0)]
+        with self.app.app_context():
+            s = scheduler.SharedScheduler(clusters)
+            self.assertRaises(scheduler.NoClusterAvailable, s.choose)
+
+    def test_instance_routing(self):
+        self.app.config['SHARED_CLUSTERS'] = [
+            {'name': 'pg1', 'host': 'pg1.example.com'},
+            {'name': 'pg2', 'host': 'pg2.example.com', 'port': 5433,
+             'public_host': 'db2.example.com'}]
+        with self.app.app_context():
+            instance = Instance('i3', 'shared', cluster='pg2')
+            self.assertEqual(instance.get_public_host(), 'db2.example.com')
+            self.assertEqual(instance.get_port(), 5433)
+            instance = Instance('i1', 'shared')
+            self.assertEqual(instance.get_public_host(), 'pg1.example.com')
+            instance = Instance('i6', 'shared', cluster='pg3')
+            self.assertRaises(InvalidInstanceConfiguration,
+                              instance.get_port)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import json
+from base64 import b64encode
+
+import mock
+
+from postgresapi import managers, stats
+from postgresapi.models import Instance, shared_cluster_manager
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+
+class StatsTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(StatsTestCase, self).setUp()
+        self._drop_test_db()
+        stats.clear()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password'))
+        }
+        with self.app.app_context():
+            managers.SharedManager().create_instance('databasenotexist')
+        db = self.create_db(dbname='databasenotexist')
+        with db.transaction() as cursor:
+            cursor.execute('CREATE TABLE article (name varchar(20))')
+            cursor.execute("INSERT INTO article VALUES ('hello')")
+            cursor.execute('SELECT * FROM article')
+        db.close()
+
+    def tearDown(self):
+        stats.clear()
+        super(StatsTestCase, self).tearDown()
+        self._drop_test_db()
+
+    def _stats(self, name='databasenotexist'):
+        return self.client.get('/resources/%s/stats' % name,
+                               headers=self.headers)
+
+    def test_stats(self):
+        rv = self._stats()
+        self.assertEqual(rv.status_code, 200)
+        result = json.loads(rv.data)
+        self.assertEqual(sorted(result.keys()), [
+            'cache_hit_ratio', 'collected_at', 'commits', 'connections',
+            'rollbacks', 'size', 'tuples_deleted', 'tuples_fetched',
+            'tuples_inserted', 'tuples_returned', 'tuples_updated'])
+        self.assertTrue(result['size'] > 0)
+        self.assertTrue(result['connections'] >= 0)
+
+    def test_stats_are_cached(self):
+        with self.app.app_context():
+            cluster_manager = shared_cluster_manager()
+            with mock.patch.object(cluster_manager, 'database_stats',
+                                   wraps=cluster_manager.database_stats) \
+                    as database_stats:
+                self.assertEqual(stats.collect_shared(), 1)
+                self.assertEqual(database_stats.call_count, 1)
+                for i in range(3):
+                    self.assertEqual(self._stats().status_code, 200)
+                self.assertEqual(database_stats.call_count, 1)
+
+                self.app.config['STATS_MAX_AGE'] = 0
+                try:
+                    self.assertEqual(self._stats().status_code, 200)
+                finally:
+                    self.app.config['STATS_MAX_AGE'] = 120
+                self.assertEqual(database_stats.call_count, 2)
+
+    def test_stats_of_a_new_database(self):
+        with self.app.app_context():
+            cluster_manager = shared_cluster_manager()
+            with mock.patch.object(cluster_manager, 'database_stats',
+                                   wraps=cluster_manager.database_stats) \
+                    as database_stats:
+                stats.collect_shared()
+                # as if the database was created after the collection
+                del stats.cluster_stats(cluster_manager)['databases'][
+                    'databasenotexist']
+                self.assertEqual(self._stats().status_code, 200)
+                self.assertEqual(database_stats.call_count, 2)
+                self.assertEqual(self._stats().status_code, 200)
+                self.assertEqual(database_stats.call_count, 2)
+
+    def test_stats_404_412(self):
+        self.assertEqual(self._stats('unknowndb').status_code, 404)
+        with self.app.app_context():
+            InstanceStorage().store(Instance('pendingdb', 'shared'))
+            InstanceStorage().store(Instance('gonedb', 'shared',
+                                             state='running'))
+        self.assertEqual(self._stats('pendingdb').status_code, 412)
+        rv = self._stats('gonedb')
+        self.assertEqual(rv.status_code, 404)
+        self.assertTrue('Database' in rv.data)
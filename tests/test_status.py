@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+from base64 import b64encode
+
+from postgresapi import health, managers, storage
+from postgresapi.models import Instance
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+
+class SlowInstance(Instance):
+
+    def is_up(self, database=None):
+        time.sleep(1)
+        return True
+
+
+class HealthTestCase(_base.TestCase):
+
+    def test_probe(self):
+        with self.app.app_context():
+            self.assertEqual(health.probe(Instance('db', 'shared')),
+                             {'state': 'pending', 'latency': None})
+            result = health.probe(Instance('postgres', 'shared',
+                                           state='running'))
+            self.assertEqual(result['state'], 'running')
+            self.assertTrue(result['latency'] >= 0)
+
+            result = health.probe(Instance('dbnotexist', 'shared',
+                                           state='running'))
+            self.assertEqual(result['state'], 'down')
+
+            # an invalid dedicated instance is down as well
+            result = health.probe(Instance('dbnotexist', 'dedicated',
+                                           state='running'))
+            self.assertEqual(result['state'], 'down')
+
+    def test_probe_all_concurrently(self):
+        self.app.config['HEALTH_WORKERS'] = 8
+        with self.app.app_context():
+            instances = [SlowInstance('db%d' % i, 'shared', state='running')
+                         for i in xrange(8)]
+            start = time.time()
+            results = health.probe_all(instances, timeout=5)
+            self.assertTrue(time.time() - start < 3)
+        self.assertEqual(sorted(results), ['db%d' % i for i in xrange(8)])
+        for result in results.values():
+            self.assertEqual(result['state'], 'running')
+
+    def test_probe_all_timeout(self):
+        with self.app.app_context():
+            results = health.probe_all(
+                [SlowInstance('db', 'shared', state='running')], timeout=0.1)
+        self.assertEqual(results, {'db': {'state': 'unknown',
+                                          'latency': None}})
+
+
+class BatchStatusTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(BatchStatusTestCase, self).setUp()
+        self._drop_test_db()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password')),
+        }
+
+    def tearDown(self):
+        super(BatchStatusTestCase, self).tearDown()
+        self._drop_test_db()
+
+    def test_status(self):
+        with self.app.app_context():
+            managers.SharedManager().create_instance('databasenotexist')
+            InstanceStorage().store(Instance('pendingdb', 'shared'))
+
+        rv = self.client.post(
+            '/resources/status', headers=self.headers,
+            content_type='application/json',
+            data=json.dumps(['databasenotexist', 'pendingdb', 'unknowndb']))
+        self.assertEqual(rv.status_code, 200)
+        results = json.loads(rv.data)
+        self.assertEqual(results['databasenotexist']['state'], 'running')
+        self.assertEqual(results['pendingdb'],
+                         {'state': 'pending', 'latency': None})
+        self.assertEqual(results['unknowndb'],
+                         {'state': 'not found', 'latency': None})
+
+        rv = self.client.post('/resources/status', headers=self.headers,
+                              data={'name': ['pendingdb', 'pendingDb']})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(json.loads(rv.data)['pendingDb']['state'],
+                         'not found')
+
+    def test_400(self):
+        rv = self.client.post('/resources/status', headers=self.headers)
+        self.assertEqual(rv.status_code, 400)
+        rv = self.client.post('/resources/status', headers=self.headers,
+                              content_type='application/json',
+                              data=json.dumps({'names': [1]}))
+        self.assertEqual(rv.status_code, 400)
+
+
+class MonitorTestCase(_base.TestCase):
+
+    def setUp(self):
+        super(MonitorTestCase, self).setUp()
+        self._drop_test_db()
+        self.client = self.app.test_client()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                "{0}:{1}".format('admin', 'password')),
+        }
+        with self.app.app_context():
+            managers.SharedManager().create_instance('databasenotexist')
+            InstanceStorage().store_many([
+                Instance('downdb', 'shared', state='running'),
+                Instance('pendingdb', 'shared')])
+
+    def tearDown(self):
+        super(MonitorTestCase, self).tearDown()
+        self._drop_test_db()
+
+    def _health(self):
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute('SELECT name, health, last_seen IS NOT NULL, '
+                           'probe_latency IS NOT NULL, '
+                           'checked_at IS NOT NULL FROM instance '
+                           'ORDER BY name')
+            rows = cursor.fetchall()
+        db.close()
+        return rows
+
+    def _status(self, name, query=''):
+        return self.client.get('/resources/%s/status%s' % (name, query),
+                               headers=self.headers).status_code
+
+    def test_monitor(self):
+        with self.app.app_context():
+            self.assertEqual(health.monitor(batch_size=1), 2)
+        self.assertEqual(self._health(), [
+            ('databasenotexist', 'running', True, True, True),
+            ('downdb', 'down', False, True, True),
+            ('pendingdb', None, False, False, False)])
+
+        # probes do not keep a connection to the databases
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_stat_activity "
+                           "WHERE datname = 'databasenotexist'")
+            self.assertEqual(cursor.fetchone(), (0, ))
+        db.close()
+
+    def test_monitor_locked(self):
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)',
+                           (storage.HEALTH_MONITOR_LOCK, ))
+            with self.app.app_context():
+                self.assertEqual(health.monitor(), 0)
+        db.close()
+
+    def test_status_from_record(self):
+        with self.app.app_context():
+            health.monitor()
+        self.assertEqual(self._status('databasenotexist'), 204)
+        self.assertEqual(self._status('downdb'), 500)
+        self.assertEqual(self._status('pendingdb'), 202)
+        self.assertEqual(self._status('unknowndb'), 404)
+
+        with self.app.app_context():
+            InstanceStorage().record_health({
+                'databasenotexist': {'state': 'down', 'latency': 0.1}})
+        self.assertEqual(self._status('databasenotexist'), 500)
+        self.assertEqual(self._status('databasenotexist', '?live=1'), 204)
+
+    def test_status_outdated_record(self):
+        with self.app.app_context():
+            InstanceStorage().record_health({
+                'databasenotexist': {'state': 'down', 'latency': None}})
+        self.app.config['HEALTH_MAX_AGE'] = 0
+        try:
+            self.assertEqual(self._status('databasenotexist'), 204)
+        finally:
+            self.app.config['HEALTH_MAX_AGE'] = 90
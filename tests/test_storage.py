@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import select
+
+from postgresapi.database import tracer
+from postgresapi.models import Instance
+from postgresapi.storage import InstanceStorage
+from . import _base
+
+
+class InstanceStorageTestCase(_base.TestCase):
+
+    def _rows(self):
+        db = self.create_db()
+        with db.transaction() as cursor:
+            cursor.execute('SELECT name, plan, state, host, port '
+                           'FROM instance ORDER BY name')
+            rows = cursor.fetchall()
+        db.close()
+        return rows
+
+    def test_store(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            instance = Instance('stored', 'dedicated', state='pending',
+                                host='10.0.0.1', port=40112)
+            storage.store(instance)
+            self.assertEqual(self._rows(), [
+                ('stored', 'dedicated', 'pending', '10.0.0.1', 40112)])
+
+            instance.state = 'running'
+            storage.store(instance)
+            self.assertEqual(self._rows(), [
+                ('stored', 'dedicated', 'running', '10.0.0.1', 40112)])
+
+    def test_update(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            instance = Instance('stored', 'shared', state='pending')
+            self.assertFalse(storage.update(instance))
+            self.assertEqual(self._rows(), [])
+
+            storage.store(instance)
+            instance.state = 'running'
+            self.assertTrue(storage.update(instance))
+            self.assertEqual(self._rows(), [
+                ('stored', 'shared', 'running', None, None)])
+
+    def test_fail_pending(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.store_many([Instance('lost', 'dedicated'),
+                                Instance('provisioning', 'dedicated'),
+                                Instance('old', 'shared', state='running')])
+            db = self.create_db()
+            with db.transaction() as cursor:
+                cursor.execute("UPDATE instance SET created_at = "
+                               "now() - interval '1 hour' "
+                               "WHERE name IN ('lost', 'old')")
+            db.close()
+            # cached as pending beforehand
+            self.assertEqual(storage.instance_by_name('lost').state,
+                             'pending')
+
+            self.assertEqual(storage.fail_pending(600), ['lost'])
+            self.assertEqual(storage.instance_by_name('lost').state, 'error')
+        self.assertEqual(self._rows(), [
+            ('lost', 'dedicated', 'error', None, None),
+            ('old', 'shared', 'running', None, None),
+            ('provisioning', 'dedicated', 'pending', None, None)])
+
+    def test_store_many(self):
+        with self.app.app_context():
+            storage = InstanceStorage()
+            storage.store(Instance('stored1', 'shared', state='pending'))
+            storage.store_many([
+                Instance('stored0', 'shared', state='running'),
+                Instance('stored1', 'shared', state='running'),
+                Instance('stored2', 'shared', state='pending'),
+                Instance('stored2', 'shared', state='error'),
+            ], page_size=2)
+            self.assertEqual(self._rows(), [
+                ('stored0', 'shared', 'running', None, None),
+                ('stored1', 'shared', 'running', None, None),
+                ('stored2', 'shared', 'error', None, None)])
+
+            storage.store_many([])
+            self.assertEqual(len(self._rows()), 3)
+
+    def test_store_many_notifies_at_once(self):
+        conn = self.create_conn()
+        conn.autocommit = True
+        conn.cursor().execute('LISTEN postgresapi_instance')
+        try:
+            with self.app.app_context():
+                tracer.start()
+                try:
+                    InstanceStorage().store_many([
+                        Instance('stored%d' % i, 'shared') for i in range(3)])
+                    traces = tracer.traces()
+                finally:
+                    tracer.stop()
+            # the upsert and the notifications
+            self.assertEqual(len(traces), 2)
+
+            payloads = set()
+            while len(payloads) < 3 and select.select([conn], [], [], 5)[0]:
+                conn.poll()
+                payloads.update(notify.payload for notify in conn.notifies)
+                del conn.notifies[:]
+            self.assertEqual(payloads, set(['instance:stored0',
+                                            'instance:stored1',
+                                            'instance:stored2']))
+        finally:
+            conn.close()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from flask import current_app
+
+from postgresapi import workers
+from . import _base
+
+
+class WorkersTestCase(_base.TestCase):
+
+    def test_submit(self):
+        pool = workers.WorkerPool('test', 2)
+        task = pool.submit(lambda x, y: x + y, 1, y=2)
+        self.assertTrue(task.wait(5))
+        self.assertEqual(task.result, 3)
+        self.assertEqual(task.exception, None)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('failed')
+
+        pool = workers.WorkerPool('test', 1)
+        task = pool.submit(fail)
+        pool.join()
+        self.assertTrue(task.done())
+        self.assertTrue(isinstance(task.exception, ValueError))
+
+    def test_app_context(self):
+        pool = workers.WorkerPool('test', 1)
+        with self.app.app_context():
+            task = pool.submit(lambda: (current_app.name,
+                                        threading.current_thread().name))
+        task.wait(5)
+        self.assertEqual(task.result, ('postgresapi', 'test-0'))
+
+    def test_get_pool(self):
+        pool = workers.get_pool('test-shared', 1)
+        self.assertTrue(workers.get_pool('test-shared', 1) is pool)